@@ -1,11 +1,11 @@
 """Módulo de Agentes do Jarvis."""
 
-from .base_agent import BaseAgent
+from .base_agent import BaseAgent, AgentProtocol
 from .finance_agent import FinanceAgent
 from .partner_agent import PartnerAgent
 from .setup_agent import SetupAgent
 from .output_agent import OutputAgent
 from .router_agent import RouterAgent
 
-__all__ = ["BaseAgent", "FinanceAgent", "PartnerAgent", "SetupAgent", "OutputAgent", "RouterAgent"]
+__all__ = ["BaseAgent", "AgentProtocol", "FinanceAgent", "PartnerAgent", "SetupAgent", "OutputAgent", "RouterAgent"]
 
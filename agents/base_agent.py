@@ -9,17 +9,173 @@ herdam desta classe base, que fornece funcionalidades comuns:
 Para criar um novo agente:
 1. Herde de BaseAgent
 2. Implemente o método process() (obrigatório)
-3. Use self.log() para logging
+3. Use self.log() para logging (formatação estilo "%": self.log("valor: %s", valor))
+
+Os logs de todos os agentes passam por uma fila (QueueHandler) e são escritos
+no console por uma única thread em segundo plano (QueueListener), para que o
+processamento das mensagens não fique esperando o I/O do terminal.
 """
 
-from abc import ABC, abstractmethod
-from typing import Dict, Any
+import atexit
+import functools
+import hashlib
+import json
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Any, Protocol
 from datetime import datetime
 
+from config import LOG_LEVEL
+from tools.cache_tool import TTLCache
+
+
+# ============================================================================
+# PIPELINE DE LOGGING
+# ============================================================================
+
+# Fila compartilhada por todos os agentes.
+# O agente só enfileira o registro (operação barata no caminho da requisição);
+# a formatação final e a escrita no stdout acontecem na thread do listener.
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+
+
+class _SecondCachedFormatter(logging.Formatter):
+    """
+    Formatter que reaproveita o timestamp "HH:MM:SS" dentro do mesmo segundo.
+    
+    Como a resolução do log é de 1 segundo, o strftime só é refeito quando o
+    segundo muda. Só é usado pela thread do listener, então não precisa de lock.
+    """
+    
+    def __init__(self, fmt: str):
+        super().__init__(fmt)
+        self._last_sec = -1
+        self._last_ts = ""
+    
+    def formatTime(self, record: logging.LogRecord, datefmt=None) -> str:
+        sec = int(record.created)
+        if sec != self._last_sec:
+            self._last_ts = time.strftime("%H:%M:%S", time.localtime(sec))
+            self._last_sec = sec
+        return self._last_ts
+
+
+class _StdoutHandler(logging.Handler):
+    """
+    Handler final que escreve as linhas de log no stdout.
+    
+    Diferente do StreamHandler, recebe lotes de registros (ver
+    _BatchQueueListener) e escreve cada lote com um único write() + flush,
+    agrupando rajadas de logs em poucas syscalls.
+    """
+    
+    def __init__(self, stream):
+        super().__init__()
+        self._write = stream.write
+        self._flush = stream.flush
+    
+    def emit(self, record: logging.LogRecord):
+        self.emit_batch([record])
+    
+    def emit_batch(self, records):
+        try:
+            self._write("".join(self.format(record) + "\n" for record in records))
+            self._flush()
+        except Exception:
+            self.handleError(records[0])
+
+
+class _BatchQueueListener(QueueListener):
+    """
+    QueueListener que consome a fila em lotes de até _LOG_BATCH_SIZE registros.
+    
+    A cada vez que acorda, a thread pega tudo que já está na fila (sem esperar)
+    e entrega o lote inteiro ao handler de uma vez.
+    """
+    
+    def _monitor(self):
+        stop = False
+        while not stop:
+            record = self.dequeue(True)  # Espera o primeiro registro
+            if record is self._sentinel:
+                break
+            
+            batch = [record]
+            while len(batch) < _LOG_BATCH_SIZE:
+                try:
+                    record = self.dequeue(False)  # Só o que já está na fila
+                except queue.Empty:
+                    break
+                if record is self._sentinel:
+                    stop = True
+                    break
+                batch.append(record)
+            
+            for handler in self.handlers:
+                handler.emit_batch(batch)
+
+
+# Máximo de registros escritos de uma vez pelo listener
+_LOG_BATCH_SIZE = 64
+
+# Handler final: escreve no stdout no mesmo formato de antes
+# [HH:MM:SS] [NomeDoAgente] LEVEL: mensagem
+_stream_handler = _StdoutHandler(sys.stdout)
+_stream_handler.setFormatter(
+    _SecondCachedFormatter("[%(asctime)s] [%(agent)s] %(levelname)s: %(message)s")
+)
+
+# Thread única que consome a fila e escreve os logs
+_log_listener = _BatchQueueListener(_log_queue, _stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)  # Garante que a fila é esvaziada ao sair
+
+# Logger pai de todos os agentes ("jarvis.agents.<Nome>")
+# propagate=False evita que os logs dos agentes dupliquem no logger raiz
+_agents_logger = logging.getLogger("jarvis.agents")
+_agents_logger.addHandler(QueueHandler(_log_queue))
+_agents_logger.setLevel(LOG_LEVEL.upper())
+_agents_logger.propagate = False
+
+# Níveis aceitos por self.log() -> nível numérico do logging
+# (evita getattr(logging, level) a cada chamada)
+_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+}
+
+
+def _cache_key(data: Dict[str, Any]) -> bytes:
+    """
+    Gera a chave de cache de um dicionário de entrada do process().
+    
+    Serializa de forma canônica (sort_keys) e resume com blake2b de 16 bytes,
+    para que a chave seja pequena mesmo com mensagens longas.
+    """
+    canonical = json.dumps(data, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
 
-class BaseAgent(ABC):
+class AgentProtocol(Protocol):
     """
-    Classe abstrata base para todos os agentes do sistema.
+    Interface estrutural de um agente, para checagem de tipos.
+    
+    Qualquer objeto com process(data) -> dict é aceito onde se espera um
+    agente, sem precisar herdar de BaseAgent.
+    """
+    
+    def process(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+
+class BaseAgent:
+    """
+    Classe base para todos os agentes do sistema.
     
     Todos os agentes devem herdar desta classe e implementar o método process().
     Esta classe fornece funcionalidades comuns como logging padronizado.
@@ -30,25 +186,106 @@ class BaseAgent(ABC):
                 super().__init__("MeuAgent")
             
             def process(self, data: Dict[str, Any]) -> Dict[str, Any]:
-                self.log("Processando dados...")
+                self.log("Processando dados de %s", data.get("user_phone"))
                 return {"success": True, "response": "OK"}
     """
     
+    # Atributos comuns ficam em slots (acesso por offset, sem dict por instância).
+    # Subclasses que não declaram __slots__ continuam tendo __dict__ normalmente
+    # para seus próprios atributos (llm_client, model, etc).
+    __slots__ = ("name", "_created_at", "_logger", "_log_enabled", "_log_extra")
+    
+    # Registro de instâncias únicas por classe concreta (ver get())
+    _instances: Dict[type, "BaseAgent"] = {}
+    
+    # Cache de resultados do process() (desligado por padrão).
+    # Só ative em agentes cujo process() é determinístico: mesma entrada,
+    # mesma saída, sem depender do banco nem do LLM.
+    cacheable: bool = False
+    cache_maxsize: int = 512   # Máximo de entradas no cache
+    cache_ttl: float = 300.0   # Segundos até uma entrada expirar
+    
+    def __init_subclass__(cls, **kwargs):
+        """
+        Envolve o process() das subclasses com cacheable = True em um cache TTL + LRU.
+        
+        A chave é um hash do dicionário de entrada serializado de forma canônica
+        (sort_keys), então a ordem das chaves não importa.
+        """
+        super().__init_subclass__(**kwargs)
+        
+        if not cls.cacheable or "process" not in cls.__dict__:
+            return
+        
+        process = cls.__dict__["process"]
+        cache = TTLCache(maxsize=cls.cache_maxsize, ttl=cls.cache_ttl)
+        cls._process_cache = cache
+        
+        @functools.wraps(process)
+        def cached_process(self, data: Dict[str, Any]) -> Dict[str, Any]:
+            key = _cache_key(data)
+            result = cache.get(key)
+            if result is None:
+                result = process(self, data)
+                cache.set(key, result)
+            # Cópia rasa: quem chamou pode alterar o dict sem afetar o cache
+            return dict(result)
+        
+        cls.process = cached_process
+    
     def __init__(self, name: str):
         """
-        Inicializa o agente com um nome e timestamp de criação.
+        Inicializa o agente com um nome.
         
         Args:
             name: Nome do agente (ex: "FinanceAgent", "SetupAgent")
                   Usado nos logs para identificar qual agente está executando
         """
         self.name = name
-        self.created_at = datetime.now()  # Timestamp de quando o agente foi criado
+        
+        # Logger do agente (filho de "jarvis.agents", herda o QueueHandler)
+        self._logger = logging.getLogger(f"jarvis.agents.{name}")
+        self._log_enabled = self._logger.isEnabledFor  # Cacheado para o guard do log()
+        
+        # Campo "agent" dos registros de log (usado no formato [%(agent)s]),
+        # criado uma única vez e reaproveitado em todas as chamadas
+        self._log_extra = {"agent": name}
+    
+    @classmethod
+    def get(cls) -> "BaseAgent":
+        """
+        Retorna a instância única (singleton) do agente, criando na primeira chamada.
+        
+        Os agentes não guardam estado por requisição, então a mesma instância
+        pode atender todas as mensagens. Assim o __init__ (cliente LLM, logger)
+        roda uma única vez por processo.
+        
+        Exemplo:
+            finance_agent = FinanceAgent.get()
+        """
+        instance = BaseAgent._instances.get(cls)
+        if instance is None:
+            instance = cls()
+            BaseAgent._instances[cls] = instance
+        return instance
+    
+    @property
+    def created_at(self) -> datetime:
+        """
+        Timestamp do agente, registrado só no primeiro acesso.
+        
+        Quase nunca é lido (só no __repr__), então não vale a pena chamar
+        datetime.now() em toda criação de agente.
+        """
+        try:
+            return self._created_at
+        except AttributeError:
+            self._created_at = datetime.now()
+            return self._created_at
     
-    @abstractmethod
     def process(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Método abstrato que DEVE ser implementado por todos os agentes.
+        Método que DEVE ser implementado por todos os agentes.
         
         Este método recebe dados de entrada e retorna um resultado processado.
         Cada agente implementa sua própria lógica de processamento aqui.
@@ -72,29 +309,61 @@ class BaseAgent(ABC):
         Raises:
             NotImplementedError: Se o método não for implementado
         """
-        pass
+        raise NotImplementedError(f"{type(self).__name__} deve implementar process()")
     
-    def log(self, message: str, level: str = "INFO"):
+    def log(self, message: str, *args: Any, level: str = "INFO"):
         """
         Sistema de logging padronizado para todos os agentes.
         
         Logs aparecem no console no formato:
         [HH:MM:SS] [NomeDoAgente] LEVEL: mensagem
         
-        Use este método para debug e rastreamento do fluxo:
+        Use formatação estilo "%" com os valores como argumentos, em vez de
+        f-string: a mensagem só é montada se o nível estiver habilitado.
         - self.log("Iniciando processamento")  # INFO (padrão)
-        - self.log("Aviso importante", "WARNING")
-        - self.log("Erro ocorreu", "ERROR")
+        - self.log("Categoria '%s' criada (ID: %s)", nome, cat_id)
+        - self.log("Aviso importante", level="WARNING")
+        - self.log("Erro ao salvar: %s", e, level="ERROR")
         
         Args:
-            message: Mensagem a ser logada
-            level: Nível do log
+            message: Mensagem a ser logada (pode conter marcadores %s, %.2f, ...)
+            *args: Valores dos marcadores da mensagem
+            level: Nível do log (sempre por nome: level="WARNING")
                    - INFO: Informações normais (padrão)
                    - WARNING: Avisos (algo pode estar errado)
                    - ERROR: Erros (algo falhou)
         """
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        print(f"[{timestamp}] [{self.name}] {level}: {message}")
+        lvl = _LEVELS.get(level, logging.INFO)
+        
+        # Nível desabilitado (ex: LOG_LEVEL=WARNING): sai antes de qualquer
+        # formatação ou criação de LogRecord
+        if not self._log_enabled(lvl):
+            return
+        
+        # Os args só são interpolados pelo logging ao formatar o registro
+        # (sem args, a mensagem é usada como está, mesmo contendo "%").
+        # Nome do agente, nível e horário ficam a cargo do Formatter.
+        self._logger.log(lvl, message, *args, extra=self._log_extra)
+    
+    def log_many(self, entries):
+        """
+        Loga várias linhas relacionadas de uma vez (ex: erro + detalhe).
+        
+        Os registros entram na fila em sequência, então o listener os pega no
+        mesmo lote e escreve o grupo em um único write.
+        
+        Exemplo:
+            self.log_many([
+                ("ERROR", "Erro ao fazer parse do JSON: %s", e),
+                ("ERROR", "Resposta do LLM: %s", response_text[:200]),
+            ])
+        
+        Args:
+            entries: Iterável de tuplas (level, message, *args), com o mesmo
+                     significado dos parâmetros de self.log()
+        """
+        for level, message, *args in entries:
+            self.log(message, *args, level=level)
     
     def __repr__(self) -> str:
         """
@@ -25,291 +25,32 @@ Para debug:
 """
 
 import re
+import calendar
 import json
-from typing import Dict, Any, Optional
+import string
+import sys
+import difflib
+import functools
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from datetime import datetime, timedelta
 
 from agents.base_agent import BaseAgent
-from tools import SQLTool, FormatterTool
+from tools import SQLTool, FormatterTool, TTLCache
 from config import GEMINI_API_KEY, GEMINI_MODEL, GOOGLE_CLOUD_PROJECT
-from llm_client import create_llm_client
+from llm_client import create_llm_client, extract_json_text, json_loads
 
 
-class FinanceAgent(BaseAgent):
-    """
-    FinanceAgent - Agente principal para operações financeiras.
-    
-    Este agente usa LLM Gemini para:
-    - Entender intenções do usuário (registro, consulta, ajuda)
-    - Extrair dados de gastos de linguagem natural
-    - Executar ações apropriadas (salvar, consultar, alertar)
-    
-    Todas as decisões são tomadas pelo LLM, garantindo flexibilidade máxima.
-    """
-    
-    def __init__(self):
-        """
-        Inicializa o FinanceAgent e configura o LLM Gemini.
-        
-        O LLM é essencial para este agente funcionar corretamente.
-        Se não houver API key, o agente não funcionará adequadamente.
-        """
-        super().__init__("FinanceAgent")
-        
-        # Configura LLM (Gemini API ou Vertex AI) para processamento inteligente
-        # O LLMClient detecta automaticamente qual usar baseado na chave
-        # IMPORTANTE: Este agente depende do LLM para funcionar
-        if GEMINI_API_KEY:
-            try:
-                self.llm_client = create_llm_client(
-                    api_key=GEMINI_API_KEY,
-                    model_name=GEMINI_MODEL,
-                    project_id=GOOGLE_CLOUD_PROJECT
-                )
-                self.model = self.llm_client.model  # Compatibilidade com código existente
-                self.log(f"LLM configurado ({self.llm_client.client_type}, {GEMINI_MODEL}) para extração de gastos")
-            except Exception as e:
-                self.llm_client = None
-                self.model = None
-                self.log(f"Erro ao configurar LLM: {e}. Extração limitada", "ERROR")
-        else:
-            self.llm_client = None
-            self.model = None
-            self.log("LLM não configurado - extração limitada", "WARNING")
-    
-    def process(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Método principal de processamento do FinanceAgent.
-        
-        Roteia para diferentes métodos baseado na ação solicitada.
-        A ação padrão é "process" que usa LLM para decidir tudo.
-        
-        Args:
-            data: Dicionário com dados de entrada
-                  Deve conter:
-                  - user_phone: str (ID do usuário)
-                  - message: str (mensagem do usuário)
-                  - action: str (opcional, padrão: "process")
-                            - "process": Usa LLM para detectar intenção e processar
-                            - "extract": Extrai e registra gasto (legado)
-                            - "query_total": Consulta total de gastos
-                            - "query_category": Consulta por categoria
-                            - "setup": Placeholder para setup
-        
-        Returns:
-            Dicionário com resultado do processamento:
-            {
-                "success": bool (True se processou com sucesso),
-                "response": str (mensagem de resposta ao usuário),
-                "data": dict (dados adicionais, como transaction_id)
-            }
-        
-        Para debug:
-        - Ação "process" é a mais usada - rastreie process_with_llm()
-        - Outras ações são legado ou específicas
-        """
-        action = data.get("action", "process")
-        
-        # Ação padrão: usa LLM para detectar intenção e processar
-        # Esta é a forma moderna e flexível de processar mensagens
-        if action == "process":
-            clarification_context = data.get("clarification_context")
-            return self.process_with_llm(data["user_phone"], data["message"], clarification_context)
-        
-        # Ação de esclarecimento: processa resposta de esclarecimento
-        elif action == "clarification":
-            clarification_context = data.get("clarification_context", {})
-            return self.handle_clarification(data["user_phone"], data["message"], clarification_context)
-        
-        # Ações legadas/específicas (menos usadas)
-        elif action == "extract":
-            return self.extract_and_register(data["user_phone"], data["message"])
-        elif action == "query_total":
-            return self.query_total(data["user_phone"], data.get("period", "month"))
-        elif action == "query_category":
-            return self.query_by_category(data["user_phone"], data.get("category"))
-        elif action == "setup":
-            return self.setup_placeholder(data["user_phone"])
-        else:
-            return {"success": False, "response": "Ação desconhecida"}
-    
-    def handle_clarification(self, user_phone: str, message: str, clarification_context: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Processa resposta de esclarecimento do usuário.
-        
-        Quando o usuário responde a uma pergunta de esclarecimento, este método
-        combina a informação original (do contexto) com a nova informação (da mensagem)
-        e processa a ação completa.
-        
-        Args:
-            user_phone: ID do usuário
-            message: Resposta do usuário ao esclarecimento
-            clarification_context: Contexto do esclarecimento contendo:
-                - missing_info: O que estava faltando
-                - ambiguous_field: Campo ambíguo
-                - target_agent: Agente que deve processar
-                - suggestion: Sugestão original
-        
-        Returns:
-            Dicionário com resultado do processamento
-        """
-        self.log(f"Processando esclarecimento: {clarification_context.get('missing_info')}")
-        
-        # Usa LLM para combinar informação original com esclarecimento
-        if not self.llm_client or not self.llm_client.model:
-            return {
-                "success": False,
-                "response": "Sistema de IA não disponível. Tente novamente mais tarde."
-            }
-        
-        missing_info = clarification_context.get("missing_info", "")
-        ambiguous_field = clarification_context.get("ambiguous_field", "")
-        
-        prompt = f"""Você está processando uma resposta de esclarecimento.
-
-**Contexto do esclarecimento:**
-- Informação faltando: {missing_info}
-- Campo ambíguo: {ambiguous_field}
-
-**Resposta do usuário:** "{message}"
-
-**Sua tarefa:**
-1. Extraia a informação que estava faltando da resposta do usuário
-2. Combine com o contexto para formar uma mensagem completa
-3. Retorne JSON com a intenção e dados completos
-
-**Exemplos:**
-
-Contexto: categoria faltando, usuário respondeu "Alimentação"
-→ {{"intent": "registro", "valor": [valor original], "categoria": "Alimentação", "descricao": "[descrição original]"}}
-
-Contexto: valor faltando, usuário respondeu "50 reais"
-→ {{"intent": "registro", "valor": 50, "categoria": "[categoria original]", "descricao": "[descrição original]"}}
-
-Contexto: nome da categoria faltando, usuário respondeu "Pets"
-→ {{"intent": "adicionar_categoria", "categoria": "Pets"}}
-
-**IMPORTANTE:**
-- Se a resposta ainda estiver ambígua, use intent="pedir_esclarecimento"
-- Retorne JSON válido
+# ============================================================================
+# PROMPTS
+# ============================================================================
+# Templates montados uma única vez, na importação do módulo.
+# A cada mensagem só os campos dinâmicos são substituídos (str.format, ou
+# "".join das partes fixas no prompt principal). Chaves literais do JSON de
+# exemplo ficam duplicadas: {{ }}.
 
-JSON:"""
-        
-        try:
-            response = self.llm_client.generate_content(prompt)
-            response_text = response.text.strip()
-            
-            # Extrai JSON (pode estar em bloco markdown ou direto)
-            json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-            json_text = json_match.group(1) if json_match else response_text
-            
-            result_data = json.loads(json_text)
-            intent = result_data.get("intent")
-            
-            # Processa com a intenção completa
-            if intent == "pedir_esclarecimento":
-                # Ainda ambíguo, pede mais esclarecimento
-                response_msg = result_data.get("resposta", "Ainda não consegui entender. Pode reformular?")
-                return {
-                    "success": False,
-                    "response": response_msg,
-                    "needs_clarification": True
-                }
-            else:
-                # Processa normalmente com dados completos
-                # Chama process_with_llm com a mensagem combinada
-                return self.process_with_llm(user_phone, message)
-        
-        except Exception as e:
-            self.log(f"Erro ao processar esclarecimento: {e}", "ERROR")
-            return {
-                "success": False,
-                "response": "Erro ao processar sua resposta. Pode tentar novamente?"
-            }
-    
-    def process_with_llm(self, user_phone: str, message: str, clarification_context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """
-        Processa mensagem usando LLM Gemini para detecção inteligente de intenção.
-        
-        Este é o método PRINCIPAL do FinanceAgent. Ele usa LLM para:
-        1. Detectar a intenção do usuário (registro, consulta, ajuda, setup)
-        2. Extrair dados estruturados (valor, categoria, descrição)
-        3. Executar ação apropriada (registrar, consultar, responder)
-        4. Gerar resposta natural e formatada
-        
-        Fluxo:
-        1. Busca contexto do usuário (total gasto no mês)
-        2. Cria prompt detalhado para o LLM
-        3. LLM retorna JSON com intenção e dados
-        4. Executa ação baseada na intenção
-        5. Retorna resposta formatada
-        
-        Args:
-            user_phone: ID único do usuário (telefone ou ID do Telegram)
-            message: Mensagem do usuário em linguagem natural
-                    Exemplos:
-                    - "gastei 50 reais no mercado"
-                    - "quanto gastei esse mês?"
-                    - "oi, como funciona?"
-        
-        Returns:
-            Dicionário com resultado:
-            {
-                "success": bool (True se processou com sucesso),
-                "response": str (mensagem de resposta ao usuário),
-                "data": dict (dados adicionais, como transaction_id)
-            }
-        
-        Para debug:
-        - Logs mostram intenção detectada pelo LLM
-        - Erros são logados com detalhes completos
-        - Adicione print() para ver JSON retornado pelo LLM
-        """
-        # Validação: LLM é obrigatório para este método
-        if not self.llm_client or not self.llm_client.model:
-            return {"success": False, "response": "IA não configurada"}
-        
-        try:
-            # 1. Busca ou cria usuário no banco de dados
-            # Isso garante que o usuário existe antes de processar
-            user = SQLTool.get_or_create_user(user_phone)
-            
-            # 2. Busca contexto financeiro do usuário para dar ao LLM
-            # Total gasto no mês ajuda o LLM a dar respostas mais contextuais
-            try:
-                end = datetime.now()
-                start = end - timedelta(days=30)  # Últimos 30 dias
-                total_month = SQLTool.get_total_by_period(user_phone, start, end)
-            except:
-                # Se falhar ao buscar total, não é crítico - continua com 0
-                total_month = 0.0
-            
-            # 2.5. Busca histórico de conversas recentes para contexto
-            # Busca últimas 5 interações para dar contexto ao LLM
-            conversation_history = SQLTool.get_conversation_history(user_phone, limit=5)
-            history_text = ""
-            if conversation_history:
-                history_lines = []
-                for conv in conversation_history:
-                    # Limita tamanho da resposta do bot para não exceder tokens
-                    bot_response_short = conv['bot_response'][:150] + "..." if len(conv['bot_response']) > 150 else conv['bot_response']
-                    history_lines.append(f"Usuário: {conv['user_message']}")
-                    history_lines.append(f"Bot: {bot_response_short}")
-                history_text = "\n\n".join(history_lines)
-            
-            # 3. Cria prompt detalhado para o LLM
-            # O prompt instrui o LLM sobre:
-            # - Contexto do usuário (ID, total gasto)
-            # - Histórico de conversas recentes (context window)
-            # - Intenções possíveis (registro, consulta, ajuda, setup)
-            # - Formato de resposta esperado (JSON estruturado)
-            # - Como extrair dados de gastos
-            # Prepara histórico para incluir no prompt
-            history_section = ""
-            if history_text:
-                history_section = f"**Histórico de conversas recentes (para contexto):**\n{history_text}\n\n"
-            
-            prompt = f"""Você é o Jarvis, um assistente financeiro pessoal via Telegram.
+# Prompt principal do process_with_llm()
+# Campos: user_phone, total_month, history_section, message
+_PROCESS_PROMPT_TEMPLATE = """Você é o Jarvis, um assistente financeiro pessoal via Telegram.
 
 **Contexto do usuário:**
 - ID: {user_phone}
@@ -476,538 +217,1390 @@ JSON:"""
 }}
 ```
 """
+
+
+def _split_prompt_template(template: str, fields: Tuple[str, ...]) -> Tuple[str, ...]:
+    """
+    Separa um template str.format nos trechos fixos entre os campos.
+    
+    string.Formatter já desfaz as chaves duplicadas {{ }}. Retorna
+    len(fields) + 1 trechos; falha na importação se os campos do template
+    não forem exatamente `fields`, nessa ordem.
+    """
+    parts, current, found = [], [], []
+    for literal, field, _, _ in string.Formatter().parse(template):
+        current.append(literal)
+        if field is not None:
+            found.append(field)
+            parts.append("".join(current))
+            current = []
+    parts.append("".join(current))
+    assert tuple(found) == fields, found
+    return tuple(parts)
+
+
+# Partes fixas do prompt principal, separadas uma única vez na importação.
+# A cada mensagem o prompt é montado com um único "".join, sem reinterpretar
+# o template inteiro (~12 KB) com str.format.
+_PROCESS_PROMPT_PARTS = _split_prompt_template(
+    _PROCESS_PROMPT_TEMPLATE, ("user_phone", "total_month", "history_section", "message")
+)
+
+
+def _build_process_prompt(user_phone: str, total_month: float, history_section: str, message: str) -> str:
+    """Monta o prompt principal (equivale a _PROCESS_PROMPT_TEMPLATE.format(...))."""
+    parts = _PROCESS_PROMPT_PARTS
+    return "".join((
+        parts[0], user_phone,
+        parts[1], f"{total_month:.2f}",
+        parts[2], history_section,
+        parts[3], message,
+        parts[4],
+    ))
+
+# Intenções cuja resposta do LLM não depende de dados extraídos da mensagem
+# (valores, datas, categorias) - podem ser reaproveitadas do cache
+_CACHEABLE_INTENTS = {"ajuda", "setup", "fora_escopo", "listar_categorias", "consulta_limites"}
+
+# Intenções cujo handler responde só com textos fixos do bot (_RESPONSES e
+# templates sobre dados do banco) - a resposta vai ao usuário sem a revisão
+# por LLM do OutputAgent, mesmo sem emoji/Markdown (ex: lista de categorias
+# vazia, "Nenhuma transação encontrada")
+_TEMPLATE_INTENTS = frozenset({
+    "registro", "consulta_total", "consulta_categoria", "consulta_ultima_transacao",
+    "consulta_limites", "listar_categorias", "adicionar_categoria",
+    "remover_categoria", "remover_transacao", "remover_limite",
+})
+
+# Janela do "total gasto este mês" mostrado no prompt (criada uma vez só)
+_THIRTY_DAYS = timedelta(days=30)
+
+_ONE_DAY = timedelta(days=1)
+_SEVEN_DAYS = timedelta(days=7)
+
+# Períodos de query_total: period → (início(agora, hoje à meia-noite), rótulo)
+# Para "all", usa data muito antiga para buscar todas as transações
+_ALL_START = datetime(2000, 1, 1)
+_PERIODS: Dict[str, Tuple[Callable[[datetime, datetime], datetime], str]] = {
+    "day": (lambda now, today: today, "hoje"),
+    "week": (lambda now, today: now - _SEVEN_DAYS, "nos últimos 7 dias"),
+    "month": (lambda now, today: today.replace(day=1), "este mês"),
+    "all": (lambda now, today: _ALL_START, "no total"),
+}
+
+# Datas aceitas, reconhecidas com um único match (sem strptime nem exceções):
+# - YYYY-MM-DD (ISO, como o LLM devolve)
+# - DD/MM/YYYY, DD-MM-YYYY e DD/MM/YY (ano com 2 dígitos = 20XX)
+# Dia e mês podem vir sem zero à esquerda ("1/2/2024"); o separador tem que
+# ser o mesmo nas duas posições.
+_DATE_RE = re.compile(
+    r"(?:(?P<iso_year>\d{4})-(?P<iso_month>\d{1,2})-(?P<iso_day>\d{1,2})"
+    r"|(?P<day>\d{1,2})(?P<sep>[/-])(?P<month>\d{1,2})(?P=sep)(?P<year>\d{4}|\d{2}))"
+)
+
+
+def _match_date(date_str: str) -> Optional[datetime]:
+    """
+    Converte uma data em um dos formatos de _DATE_RE.
+    
+    Returns:
+        datetime (meia-noite do dia), ou None se o formato não for
+        reconhecido ou a data não existir (ex: 31/02/2024)
+    """
+    match = _DATE_RE.fullmatch(date_str)
+    if match is None:
+        return None
+    
+    if match.group("iso_year"):
+        year, month, day = match.group("iso_year", "iso_month", "iso_day")
+    else:
+        year, month, day = match.group("year", "month", "day")
+        if len(year) == 2:
+            year = "20" + year
+    
+    year, month, day = int(year), int(month), int(day)
+    # Valida o dia sem depender de exceção (fevereiro/bissexto incluídos)
+    if year < 1 or not 1 <= month <= 12 or not 1 <= day <= calendar.monthrange(year, month)[1]:
+        return None
+    return datetime(year, month, day)
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_user_date(date_str: str) -> Optional[datetime]:
+    """
+    Converte a data informada pelo usuário/LLM (formatos de _DATE_RE).
+    
+    Memoizada: as mesmas datas ("2024-11-20") se repetem entre mensagens.
+    
+    Returns:
+        datetime (meia-noite do dia), ou None se a data não for reconhecida
+    """
+    return _match_date(date_str)
+
+
+# Similaridade mínima (difflib, nomes normalizados) para uma categoria existente
+# ser considerada "talvez a mesma" ao adicionar uma nova
+_SIMILAR_CATEGORY_RATIO = 0.8
+
+# Similaridade mínima para aceitar a categoria sem consultar o LLM
+# (erros de digitação/acentuação: "alimentacao" → "Alimentação")
+_LOCAL_CATEGORY_RATIO = 0.85
+
+# Abaixo desta similaridade nenhuma categoria é parecida o bastante para o LLM
+# de matching (restrito a digitação/acentuação) dizer algo além de "NENHUMA":
+# só a faixa ambígua [0.70, 0.85) ainda vai para o LLM
+_AMBIGUOUS_CATEGORY_RATIO = 0.70
+
+
+def _closest_category(
+    category_name: str,
+    categories: List[Dict[str, Any]]
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], float]:
+    """
+    Compara um nome de categoria com as categorias do usuário, sem LLM.
+    
+    Args:
+        category_name: Nome digitado pelo usuário
+        categories: Categorias do usuário (SQLTool.get_user_categories)
+    
+    Returns:
+        (exata, mais_parecida, similaridade):
+        - exata: categoria com o mesmo nome (sem diferenciar maiúsculas), ou None
+        - mais_parecida: categoria de maior similaridade (sem acentos/maiúsculas), ou None
+        - similaridade: razão do difflib (0.0 a 1.0) da mais parecida
+    """
+    lowered = category_name.lower()
+    normalized = FormatterTool.normalize_text(category_name)
+    best, best_ratio = None, 0.0
+    for cat in categories:
+        if cat["category_name"].lower() == lowered:
+            return cat, cat, 1.0
+        ratio = difflib.SequenceMatcher(
+            None, normalized, FormatterTool.normalize_text(cat["category_name"])
+        ).ratio()
+        if ratio > best_ratio:
+            best, best_ratio = cat, ratio
+    return None, best, best_ratio
+
+
+# Menção a "último gasto"/"última transação" (remover_transacao)
+_LAST_TRANSACTION_RE = re.compile(r"[úu]ltim[oa]", re.IGNORECASE)
+
+# Texto ao redor de um valor monetário ("R$ 50", "50 reais", "50 rs")
+_VALOR_NOISE_RE = re.compile(r"r\$|reais|real|rs|\s", re.IGNORECASE)
+
+# Número já normalizado por _parse_valor ("1234.56", "-50", ".5")
+_VALOR_NUMBER_RE = re.compile(r"-?(?:\d+(?:\.\d*)?|\.\d+)")
+
+
+def _parse_valor(valor: Any) -> Optional[float]:
+    """
+    Converte um valor monetário (do LLM ou de regex) em float.
+    
+    Aceita números e textos como "50", "50,5", "R$ 1.234,56", "1,234.56"
+    ou "50 reais". O último separador (. ou ,) é o decimal quando seguido
+    de 1 ou 2 dígitos; os demais são separadores de milhar.
+    
+    Returns:
+        Valor em float, ou None se não for possível interpretar
+    """
+    if isinstance(valor, bool):
+        return None
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    if not isinstance(valor, str):
+        return None
+    
+    text = _VALOR_NOISE_RE.sub("", valor)
+    last_sep = max(text.rfind(","), text.rfind("."))
+    if last_sep != -1 and 1 <= len(text) - last_sep - 1 <= 2:
+        # "1.234,56" -> "1234.56"
+        text = text[:last_sep].replace(",", "").replace(".", "") + "." + text[last_sep + 1:]
+    else:
+        # Só separadores de milhar: "1.000" -> "1000"
+        text = text.replace(",", "").replace(".", "")
+    
+    # Valida antes de converter: texto inválido não levanta (e não aloca)
+    # uma exceção só para ser descartada
+    if not _VALOR_NUMBER_RE.fullmatch(text):
+        return None
+    return float(text)
+
+# ============================================================================
+# ATALHOS SEM LLM
+# ============================================================================
+# Padrões óbvios reconhecidos direto por regex, sem prompt nem chamada ao LLM.
+# Aplicados sobre a mensagem normalizada (FormatterTool.normalize_text):
+# minúsculas, sem acentos e sem pontuação final.
+
+# Saudações simples: "oi", "olá!", "bom dia, jarvis"
+_FAST_GREETING_RE = re.compile(
+    r"^(?:oi|ola|opa|e ai|eai|bom dia|boa tarde|boa noite)(?:,? jarvis)?$"
+)
+
+# Consultas de total: "quanto gastei?", "quanto gastei hoje", "meus gastos da semana"
+_FAST_TOTAL_RE = re.compile(
+    r"^(?:quanto (?:eu )?gastei|meus gastos|resumo(?: dos gastos)?)"
+    r"(?: (?P<day>hoje)"
+    r"| (?:nesta|nessa|esta|essa|na|da) (?P<week>semana)"
+    r"| (?:neste|nesse|este|esse|no|do) (?P<month>mes))?$"
+)
+
+# Registro explícito: "gastei 50 em lazer", "gastei r$ 32,90 no delivery"
+# O valor só aceita até 2 casas decimais, para "1.500" (milhar) cair no LLM
+_FAST_EXPENSE_RE = re.compile(
+    r"^gastei (?:r\$ ?)?(?P<valor>\d+(?:[.,]\d{1,2})?)(?: reais| rs)? (?:no|na|em|com) (?P<categoria>.+)$"
+)
+
+# Resposta fixa para saudações
+_GREETING_RESPONSE = (
+    "👋 Olá! Eu sou o Jarvis, seu assistente financeiro.\n\n"
+    "Posso te ajudar a:\n"
+    "• Registrar gastos (ex: \"gastei 50 no mercado\")\n"
+    "• Consultar seus gastos (ex: \"quanto gastei este mês?\")\n"
+    "• Ver e gerenciar categorias e limites\n\n"
+    "Como posso ajudar?"
+)
+
+# Prompt do handle_clarification()
+# Campos: missing_info, ambiguous_field, message
+_CLARIFICATION_PROMPT_TEMPLATE = """Você está processando uma resposta de esclarecimento.
+
+**Contexto do esclarecimento:**
+- Informação faltando: {missing_info}
+- Campo ambíguo: {ambiguous_field}
+
+**Resposta do usuário:** "{message}"
+
+**Sua tarefa:**
+1. Extraia a informação que estava faltando da resposta do usuário
+2. Combine com o contexto para formar uma mensagem completa
+3. Retorne JSON com a intenção e dados completos
+
+**Exemplos:**
+
+Contexto: categoria faltando, usuário respondeu "Alimentação"
+→ {{"intent": "registro", "valor": [valor original], "categoria": "Alimentação", "descricao": "[descrição original]"}}
+
+Contexto: valor faltando, usuário respondeu "50 reais"
+→ {{"intent": "registro", "valor": 50, "categoria": "[categoria original]", "descricao": "[descrição original]"}}
+
+Contexto: nome da categoria faltando, usuário respondeu "Pets"
+→ {{"intent": "adicionar_categoria", "categoria": "Pets"}}
+
+**IMPORTANTE:**
+- Se a resposta ainda estiver ambígua, use intent="pedir_esclarecimento"
+- Retorne JSON válido
+
+JSON:"""
+
+# Prompt do _find_category_with_llm()
+# Campos: category_input, category_list (uma linha "- Nome" por categoria)
+_CATEGORY_MATCH_PROMPT_TEMPLATE = """Você é um assistente que faz matching inteligente de categorias.
+
+**Categoria que o usuário digitou:** "{category_input}"
+
+**Categorias disponíveis:**
+{category_list}
+
+**Sua tarefa:** Encontre a categoria mais próxima da que o usuário digitou.
+
+**IMPORTANTE - Seja RESTRITIVO:**
+- Só retorne uma categoria se for REALMENTE a mesma (ex: "Alimentacao" → "Alimentação")
+- NÃO confunda categorias diferentes (ex: "bebidas alcoolicas" ≠ "Alimentação")
+- NÃO retorne categorias apenas por serem relacionadas (ex: "Pets" ≠ "Saúde")
+- Se a categoria digitada for claramente diferente, retorne "NENHUMA"
+
+Considere APENAS:
+- Erros de digitação (ex: "Alimentacao" → "Alimentação")
+- Diferenças de acentuação (ex: "Alimentação" = "Alimentacao")
+- Variações mínimas de nome (ex: "Alimentação" = "Alimentacao")
+
+NÃO considere:
+- Categorias relacionadas mas diferentes (ex: "bebidas" ≠ "Alimentação")
+- Categorias que compartilham palavras mas são diferentes (ex: "bebidas alcoolicas" ≠ "Alimentação")
+
+Retorne APENAS o nome exato da categoria mais próxima, ou "NENHUMA" se não houver correspondência EXATA ou muito próxima.
+
+Categoria mais próxima:"""
+
+
+# Respostas fixas dos handlers: chave → (texto, success, needs_clarification).
+# Textos com {categoria} recebem o nome via _reply(chave, categoria=...).
+_RESPONSES: Dict[str, Tuple[str, bool, bool]] = {
+    "json_invalido": (
+        "Desculpe, tive um problema ao processar sua mensagem. Pode tentar novamente?",
+        False, True,
+    ),
+    "json_vazio": (
+        "Desculpe, não consegui entender sua mensagem. Pode reformular?",
+        False, True,
+    ),
+    "valor_ausente": (
+        "Não consegui identificar o valor. Pode informar quanto foi?",
+        True, True,
+    ),
+    "valor_invalido": (
+        "Não consegui entender o valor. Pode informar em números?",
+        True, True,
+    ),
+    "valor_nao_positivo": (
+        "O valor precisa ser maior que zero. Pode informar o valor correto?",
+        True, True,
+    ),
+    "datas_invalidas": (
+        "❓ Não consegui entender as datas informadas. Pode informar no formato DD/MM/YYYY? (ex: 'quanto gastei de 18/11/2024 até 25/11/2024')",
+        False, False,
+    ),
+    "consulta_sem_categoria": (
+        "❓ Não consegui identificar qual categoria você quer consultar. Pode informar o nome da categoria?",
+        False, False,
+    ),
+    "nenhuma_transacao": (
+        "📭 Você ainda não tem transações registradas.",
+        True, False,
+    ),
+    "categoria_sem_nome": (
+        "Não consegui identificar o nome da categoria. Pode informar o nome?",
+        True, True,
+    ),
+    "categoria_ja_existe": (
+        "✅ A categoria *{categoria}* já existe! Você pode usá-la para registrar gastos.",
+        True, False,
+    ),
+    "erro_criar_categoria": (
+        "❌ Erro ao criar categoria '{categoria}'. Tente novamente com outro nome.",
+        False, False,
+    ),
+    "remover_categoria_sem_nome": (
+        "Qual categoria você quer remover?",
+        True, True,
+    ),
+    "categoria_nao_encontrada": (
+        "❌ Categoria '{categoria}' não encontrada.",
+        False, False,
+    ),
+    "categoria_removida": (
+        "✅ Categoria *{categoria}* removida com sucesso!",
+        True, False,
+    ),
+    "categoria_com_transacoes": (
+        "❌ Não é possível remover a categoria *{categoria}* porque ela possui transações registradas.\n\nPara remover, primeiro você precisa deletar ou mover todas as transações dessa categoria.",
+        False, False,
+    ),
+    "erro_remocao": (
+        "❌ Erro ao processar solicitação de remoção. Tente novamente.",
+        False, True,
+    ),
+    "sem_transacoes": (
+        "❌ Você não tem transações registradas.",
+        False, False,
+    ),
+    "erro_remover_transacao": (
+        "❌ Erro ao remover a transação. Tente novamente.",
+        False, False,
+    ),
+    "transacao_nao_encontrada": (
+        "❌ Não encontrei transações que correspondam aos critérios informados.",
+        False, False,
+    ),
+    "limite_sem_categoria": (
+        "De qual categoria você quer remover o limite?",
+        True, True,
+    ),
+    "limite_removido": (
+        "✅ Limite da categoria *{categoria}* removido com sucesso!",
+        True, False,
+    ),
+    "limite_inexistente": (
+        "❌ Não foi possível remover o limite da categoria *{categoria}*.\n\nA categoria não possui limite configurado.",
+        False, False,
+    ),
+}
+
+
+# Bloco de cada limite na resposta de query_limits
+_LIMIT_LINE_TEMPLATE = (
+    "{emoji} *{category}* ({period})\n"
+    "   Limite: {limit}\n"
+    "   Gasto atual: {current}\n"
+    "   Status: {status} ({percentage})\n"
+)
+
+
+def _reply(key: str, resposta: Optional[str] = None, **fields: Any) -> Dict[str, Any]:
+    """
+    Monta o dicionário de resposta a partir de _RESPONSES.
+    
+    Args:
+        key: Chave da resposta em _RESPONSES
+        resposta: Texto gerado pelo LLM; quando informado, substitui o texto padrão
+        **fields: Valores dos marcadores do texto (ex: categoria="Lazer")
+    """
+    text, success, needs_clarification = _RESPONSES[key]
+    if resposta:
+        text = resposta
+    elif fields:
+        text = text.format(**fields)
+    
+    response = {"success": success, "response": text}
+    if needs_clarification:
+        response["needs_clarification"] = True
+    return response
+
+
+def _str_field(data: Dict[str, Any], key: str) -> str:
+    """
+    Lê um campo de texto do JSON do LLM já sem espaços nas pontas.
+    
+    Um único get() por campo; valores ausentes, null ou que não são texto
+    viram "" (em vez de quebrar no .strip()).
+    """
+    value = data.get(key)
+    return value.strip() if isinstance(value, str) else ""
+
+
+class FinanceAgent(BaseAgent):
+    """
+    FinanceAgent - Agente principal para operações financeiras.
+    
+    Este agente usa LLM Gemini para:
+    - Entender intenções do usuário (registro, consulta, ajuda)
+    - Extrair dados de gastos de linguagem natural
+    - Executar ações apropriadas (salvar, consultar, alertar)
+    
+    Todas as decisões são tomadas pelo LLM, garantindo flexibilidade máxima.
+    """
+    
+    # Intenções do RouterAgent que não precisam de extração de dados
+    # intent do roteador -> método que atende a intenção (só recebe user_phone)
+    _ROUTED_INTENTS = {
+        "consulta_limites": "query_limits",
+        "listar_categorias": "list_categories",
+    }
+    
+    def __init__(self):
+        """
+        Inicializa o FinanceAgent e configura o LLM Gemini.
+        
+        O LLM é essencial para este agente funcionar corretamente.
+        Se não houver API key, o agente não funcionará adequadamente.
+        """
+        super().__init__("FinanceAgent")
+        
+        # Configura LLM (Gemini API ou Vertex AI) para processamento inteligente
+        # O LLMClient detecta automaticamente qual usar baseado na chave
+        # IMPORTANTE: Este agente depende do LLM para funcionar
+        if GEMINI_API_KEY:
+            try:
+                self.llm_client = create_llm_client(
+                    api_key=GEMINI_API_KEY,
+                    model_name=GEMINI_MODEL,
+                    project_id=GOOGLE_CLOUD_PROJECT
+                )
+                self.model = self.llm_client.model  # Compatibilidade com código existente
+                self.log("LLM configurado (%s, %s) para extração de gastos", self.llm_client.client_type, GEMINI_MODEL)
+            except Exception as e:
+                self.llm_client = None
+                self.model = None
+                self.log("Erro ao configurar LLM: %s. Extração limitada", e, level="ERROR")
+        else:
+            self.llm_client = None
+            self.model = None
+            self.log("LLM não configurado - extração limitada", level="WARNING")
+        
+        # Cache de intenções "sem estado" detectadas pelo LLM
+        # Chave: (usuário, mensagem normalizada, última resposta do bot) -> result_data
+        self._intent_cache = TTLCache(maxsize=2048, ttl=600)
+        
+        # Total gasto nos últimos 30 dias por usuário (contexto do prompt)
+        # Invalidado sempre que o usuário registra ou remove uma transação
+        self._total_cache = TTLCache(maxsize=4096, ttl=60)
+        
+        # Tabela de intenções do process_with_llm(): intent -> handler
+        self._intent_handlers = {
+            "pedir_esclarecimento": self._handle_pedir_esclarecimento,
+            "registro": self._handle_registro,
+            "consulta_total": self._handle_consulta_total,
+            "consulta_categoria": self._handle_consulta_categoria,
+            "consulta_ultima_transacao": self._handle_consulta_ultima_transacao,
+            "consulta_limites": self._handle_consulta_limites,
+            "listar_categorias": self._handle_listar_categorias,
+            "fora_escopo": self._handle_fora_escopo,
+            "adicionar_categoria": self._handle_adicionar_categoria,
+            "remover_categoria": self._handle_remover_categoria,
+            "remover_transacao": self._handle_remover_transacao,
+            "remover_limite": self._handle_remover_limite,
+            "setup": self._handle_setup,
+            "ajuda": self._handle_ajuda,
+        }
+        
+        # Categorias do usuário durante uma requisição: user_phone -> lista
+        # Descartado no início de cada process() e ao criar/remover categoria
+        self._category_cache: Dict[str, List[Dict[str, Any]]] = {}
+        
+        # Tabela de ações do process(): action -> handler(data)
+        # Montada uma vez aqui para o process() fazer uma única busca no dict
+        self._actions = {
+            # Ação padrão: usa LLM para detectar intenção e processar
+            "process": self._action_process,
+            # Ação de esclarecimento: processa resposta de esclarecimento
+            "clarification": lambda data: self.handle_clarification(
+                data["user_phone"], data["message"], data.get("clarification_context", {})
+            ),
+            # Ações legadas/específicas (menos usadas)
+            "extract": lambda data: self.extract_and_register(data["user_phone"], data["message"]),
+            "query_total": lambda data: self.query_total(data["user_phone"], data.get("period", "month")),
+            "query_category": lambda data: self.query_by_category(data["user_phone"], data.get("category")),
+            "setup": lambda data: self.setup_placeholder(data["user_phone"]),
+        }
+    
+    def process(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Método principal de processamento do FinanceAgent.
+        
+        Roteia para diferentes métodos baseado na ação solicitada.
+        A ação padrão é "process" que usa LLM para decidir tudo.
+        
+        Args:
+            data: Dicionário com dados de entrada
+                  Deve conter:
+                  - user_phone: str (ID do usuário)
+                  - message: str (mensagem do usuário)
+                  - action: str (opcional, padrão: "process")
+                            - "process": Usa LLM para detectar intenção e processar
+                            - "extract": Extrai e registra gasto (legado)
+                            - "query_total": Consulta total de gastos
+                            - "query_category": Consulta por categoria
+                            - "setup": Placeholder para setup
+        
+        Returns:
+            Dicionário com resultado do processamento:
+            {
+                "success": bool (True se processou com sucesso),
+                "response": str (mensagem de resposta ao usuário),
+                "data": dict (dados adicionais, como transaction_id)
+            }
+        
+        Para debug:
+        - Ação "process" é a mais usada - rastreie process_with_llm()
+        - Outras ações são legado ou específicas
+        """
+        handler = self._actions.get(data.get("action", "process"))
+        if handler is None:
+            return {"success": False, "response": "Ação desconhecida"}
+        
+        # Nova requisição: categorias são relidas do banco na primeira consulta
+        self._category_cache.pop(data.get("user_phone"), None)
+        return handler(data)
+    
+    def _action_process(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Ação padrão do process(): usa LLM para detectar intenção e processar.
+        
+        Esta é a forma moderna e flexível de processar mensagens.
+        """
+        # Reaproveita a decisão do RouterAgent quando ela já basta
+        # (evita uma segunda chamada ao LLM para a mesma classificação)
+        routed = self._process_routed_intent(data)
+        if routed is not None:
+            return routed
+        
+        clarification_context = data.get("clarification_context")
+        return self.process_with_llm(
+            data["user_phone"],
+            data["message"],
+            clarification_context,
+            normalized_message=data.get("normalized_message"),
+        )
+    
+    def _process_routed_intent(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Executa direto as intenções já classificadas pelo RouterAgent.
+        
+        O RouterAgent e o FinanceAgent classificam a mesma mensagem. Para intenções
+        que não precisam de nenhum dado extraído (só o user_phone), a decisão do
+        roteador já é suficiente e o prompt do FinanceAgent pode ser pulado.
+        
+        Args:
+            data: Dados do process(), com router_intent e router_confidence
+                  preenchidos pelo workflow
+        
+        Returns:
+            Resultado da intenção, ou None se o FinanceAgent deve usar o LLM
+        """
+        intent = data.get("router_intent")
+        method_name = self._ROUTED_INTENTS.get(intent)
+        
+        # Só confia na decisão do roteador quando ela é confiante e não há
+        # esclarecimento pendente (que muda o significado da mensagem)
+        if (
+            method_name is None
+            or data.get("clarification_context")
+            or (data.get("router_confidence") or 0) < 0.9
+        ):
+            return None
+        
+        self.log("Reaproveitando intenção do RouterAgent: %s", intent)
+        return getattr(self, method_name)(data["user_phone"])
+    
+    def handle_clarification(self, user_phone: str, message: str, clarification_context: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Processa resposta de esclarecimento do usuário.
+        
+        Quando o usuário responde a uma pergunta de esclarecimento, este método
+        combina a informação original (do contexto) com a nova informação (da mensagem)
+        e processa a ação completa.
+        
+        Args:
+            user_phone: ID do usuário
+            message: Resposta do usuário ao esclarecimento
+            clarification_context: Contexto do esclarecimento contendo:
+                - missing_info: O que estava faltando
+                - ambiguous_field: Campo ambíguo
+                - target_agent: Agente que deve processar
+                - suggestion: Sugestão original
+        
+        Returns:
+            Dicionário com resultado do processamento
+        """
+        self.log("Processando esclarecimento: %s", clarification_context.get('missing_info'))
+        
+        # Usa LLM para combinar informação original com esclarecimento
+        if not self.llm_client or not self.llm_client.model:
+            return {
+                "success": False,
+                "response": "Sistema de IA não disponível. Tente novamente mais tarde."
+            }
+        
+        missing_info = clarification_context.get("missing_info", "")
+        ambiguous_field = clarification_context.get("ambiguous_field", "")
+        
+        prompt = _CLARIFICATION_PROMPT_TEMPLATE.format(
+            missing_info=missing_info,
+            ambiguous_field=ambiguous_field,
+            message=message,
+        )
+        
+        try:
+            response = self.llm_client.generate_content(prompt)
+            response_text = response.text.strip()
+            
+            # Extrai JSON (pode estar em bloco markdown ou direto)
+            json_text = extract_json_text(response_text)
+            
+            result_data = json_loads(json_text)
+            intent = result_data.get("intent")
+            
+            # Processa com a intenção completa
+            if intent == "pedir_esclarecimento":
+                # Ainda ambíguo, pede mais esclarecimento
+                response_msg = result_data.get("resposta", "Ainda não consegui entender. Pode reformular?")
+                return {
+                    "success": False,
+                    "response": response_msg,
+                    "needs_clarification": True
+                }
+            else:
+                # Processa normalmente com dados completos
+                # Chama process_with_llm com a mensagem combinada
+                return self.process_with_llm(user_phone, message)
+        
+        except Exception as e:
+            self.log("Erro ao processar esclarecimento: %s", e, level="ERROR")
+            return {
+                "success": False,
+                "response": "Erro ao processar sua resposta. Pode tentar novamente?"
+            }
+    
+    def process_with_llm(
+        self,
+        user_phone: str,
+        message: str,
+        clarification_context: Optional[Dict[str, Any]] = None,
+        normalized_message: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Processa mensagem usando LLM Gemini para detecção inteligente de intenção.
+        
+        Este é o método PRINCIPAL do FinanceAgent. Ele usa LLM para:
+        1. Detectar a intenção do usuário (registro, consulta, ajuda, setup)
+        2. Extrair dados estruturados (valor, categoria, descrição)
+        3. Executar ação apropriada (registrar, consultar, responder)
+        4. Gerar resposta natural e formatada
+        
+        Fluxo:
+        1. Busca contexto do usuário (total gasto no mês)
+        2. Cria prompt detalhado para o LLM
+        3. LLM retorna JSON com intenção e dados
+        4. Executa ação baseada na intenção
+        5. Retorna resposta formatada
+        
+        Args:
+            user_phone: ID único do usuário (telefone ou ID do Telegram)
+            message: Mensagem do usuário em linguagem natural
+                    Exemplos:
+                    - "gastei 50 reais no mercado"
+                    - "quanto gastei esse mês?"
+                    - "oi, como funciona?"
+        
+        Returns:
+            Dicionário com resultado:
+            {
+                "success": bool (True se processou com sucesso),
+                "response": str (mensagem de resposta ao usuário),
+                "data": dict (dados adicionais, como transaction_id)
+            }
+        
+        Para debug:
+        - Logs mostram intenção detectada pelo LLM
+        - Erros são logados com detalhes completos
+        - Adicione print() para ver JSON retornado pelo LLM
+        """
+        # Validação: LLM é obrigatório para este método
+        if not self.llm_client or not self.llm_client.model:
+            return {"success": False, "response": "IA não configurada"}
+        
+        try:
+            # O workflow já manda a mensagem normalizada (partner_node)
+            if normalized_message is None:
+                normalized_message = FormatterTool.normalize_text(message)
+            
+            # 0. Saudações óbvias ("oi", "ajuda") não dependem de nada do banco:
+            # responde antes de buscar usuário e contexto (o workflow já
+            # garante que o usuário existe ao entrar no grafo)
+            if _FAST_GREETING_RE.match(normalized_message):
+                self.log("Intenção detectada sem LLM: ajuda")
+                return self._handle_ajuda(user_phone, message, {"intent": "ajuda", "resposta": _GREETING_RESPONSE})
+            
+            # Um único "agora" por mensagem: contexto do prompt e consultas de
+            # período usam o mesmo instante (sem divergir na virada do dia)
+            now = datetime.now()
+            
+            # 1. Busca ou cria usuário no banco de dados
+            # Isso garante que o usuário existe antes de processar
+            user = SQLTool.get_or_create_user(user_phone)
             
-            # 4. Chama o LLM (Gemini API ou Vertex AI) com o prompt
-            # O LLM analisa a mensagem e retorna JSON estruturado
-            response = self.llm_client.generate_content(prompt)
-            response_text = response.text.strip()
-            
-            # 5. Extrai JSON da resposta do LLM
-            # O LLM pode retornar JSON dentro de blocos de código markdown ou diretamente como texto
-            json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-            json_text = json_match.group(1) if json_match else response_text
-            
-            # 6. Faz parse do JSON retornado pelo LLM
-            # O JSON contém: intent, valor, categoria, descricao, resposta
-            try:
-                result_data = json.loads(json_text)
-            except json.JSONDecodeError as e:
-                self.log(f"Erro ao fazer parse do JSON do LLM: {e}. Resposta: {response_text[:200]}", "ERROR")
-                return {
-                    "success": False,
-                    "response": "Desculpe, tive um problema ao processar sua mensagem. Pode tentar novamente?",
-                    "needs_clarification": True
-                }
-            
-            # Valida que result_data não é None
-            if not result_data:
-                self.log("LLM retornou JSON vazio ou None", "ERROR")
-                return {
-                    "success": False,
-                    "response": "Desculpe, não consegui entender sua mensagem. Pode reformular?",
-                    "needs_clarification": True
-                }
-            
-            intent = result_data.get("intent")
-            
-            self.log(f"LLM detectou intenção: {intent}")
-            
-            # 7. Executa ação baseada na intenção detectada pelo LLM
-            if intent == "pedir_esclarecimento":
-                # ============================================================
-                # INTENÇÃO: PEDIR ESCLARECIMENTO (MENSAGEM AMBÍGUA)
-                # ============================================================
-                # LLM detectou ambiguidade e pediu esclarecimento
-                # Resposta já vem formatada do LLM no campo "resposta"
-                response_msg = result_data.get("resposta", 
-                    "Não consegui entender completamente. Pode reformular sua mensagem?")
-                self.log("Mensagem ambígua detectada - pedindo esclarecimento")
-                return {"success": True, "response": response_msg, "data": {}}
-            
-            elif intent == "registro":
-                # Registra o gasto
-                # Confia no LLM - se ele retornou "registro", tenta processar
-                valor_str = result_data.get("valor")
-                categoria = result_data.get("categoria", "").strip()
-                descricao = result_data.get("descricao", message[:50])
-                
-                # Se não tem valor, deixa LLM lidar (já deveria ter detectado como pedir_esclarecimento)
-                if not valor_str or valor_str == 0:
-                    self.log("Valor não identificado - deixando LLM lidar", "WARNING")
-                    return {
-                        "success": True,
-                        "response": result_data.get("resposta", "Não consegui identificar o valor. Pode informar quanto foi?"),
-                        "needs_clarification": True
-                    }
-                
-                try:
-                    valor = float(valor_str)
-                    if valor <= 0:
-                        self.log("Valor inválido - deixando LLM lidar", "WARNING")
-                        return {
-                            "success": True,
-                            "response": result_data.get("resposta", "O valor precisa ser maior que zero. Pode informar o valor correto?"),
-                            "needs_clarification": True
-                        }
-                except (ValueError, TypeError):
-                    self.log("Erro ao parsear valor - deixando LLM lidar", "WARNING")
-                    return {
-                        "success": True,
-                        "response": result_data.get("resposta", "Não consegui entender o valor. Pode informar em números?"),
-                        "needs_clarification": True
-                    }
-                
-                # Validação de categoria - usa "Geral" como fallback se não identificada
-                if not categoria or categoria.strip() == "":
-                    categoria = "Geral"
-                    self.log(f"Categoria não identificada, usando 'Geral' como fallback")
-                
-                # Usa matching inteligente com LLM para encontrar categoria existente
-                # A categoria já foi validada acima, então não está vazia aqui
-                cat = self._find_category_with_llm(user_phone, categoria)
-                if not cat:
-                    # Se não encontrou categoria existente, cria nova categoria
-                    # Isso garante que "Geral" será criada se não existir
-                    cat_id = SQLTool.create_category(user_phone, categoria, f"Categoria {categoria}")
-                    self.log(f"Categoria '{categoria}' criada automaticamente")
-                else:
-                    cat_id = cat["category_id"]
-                    # Usa o nome correto da categoria encontrada
-                    categoria = cat["category_name"]
-                
-                # Registra transação
-                trans_id = SQLTool.insert_transaction(user_phone, cat_id, valor, descricao)
-                
-                # Verifica limites e gera alerta se necessário
-                alert_message = self._check_limits(user_phone, cat_id, valor)
-                
-                response_msg = f"✅ Gasto registrado: {FormatterTool.format_currency(valor)} em {categoria}"
-                
-                # Adiciona alerta à resposta se houver
-                if alert_message:
-                    response_msg += f"\n\n{alert_message}"
-                
-                return {"success": True, "response": response_msg, "data": {"transaction_id": trans_id}}
-            
-            elif intent == "consulta_total":
-                # ============================================================
-                # INTENÇÃO: CONSULTA DE GASTOS
-                # ============================================================
-                # Usuário quer ver quanto gastou
-                # Chama método que busca dados e formata resposta
-                # O LLM pode retornar:
-                # - period: "day|week|month|all" (períodos relativos)
-                # - start_date e end_date: datas específicas (YYYY-MM-DD)
-                
-                # Verifica se há datas específicas
-                start_date_str = result_data.get("start_date")
-                end_date_str = result_data.get("end_date")
-                
-                if start_date_str and end_date_str:
-                    # Consulta por período específico (datas customizadas)
-                    try:
-                        start_date = self._parse_date(start_date_str)
-                        end_date = self._parse_date(end_date_str)
-                        
-                        # Garante que end_date inclui o dia inteiro (até 23:59:59)
-                        end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-                        
-                        self.log(f"Consulta por período específico: {start_date_str} até {end_date_str}")
-                        return self.query_by_date_range(user_phone, start_date, end_date)
-                    except Exception as e:
-                        self.log(f"Erro ao parsear datas: {e}", "ERROR")
-                        return {
-                            "success": False,
-                            "response": "❓ Não consegui entender as datas informadas. Pode informar no formato DD/MM/YYYY? (ex: 'quanto gastei de 18/11/2024 até 25/11/2024')"
-                        }
-                else:
-                    # Consulta por período relativo (day, week, month, all)
-                    period = result_data.get("period", "month")  # Default: mês atual
-                    self.log(f"Consulta de gastos solicitada (período: {period})")
-                    return self.query_total(user_phone, period)
-            
-            elif intent == "consulta_categoria":
-                # ============================================================
-                # INTENÇÃO: CONSULTA POR CATEGORIA ESPECÍFICA
-                # ============================================================
-                # Usuário quer ver gastos de uma categoria específica
-                categoria = result_data.get("categoria", "").strip()
-                if not categoria:
-                    return {
-                        "success": False,
-                        "response": "❓ Não consegui identificar qual categoria você quer consultar. Pode informar o nome da categoria?"
-                    }
-                self.log(f"Consulta por categoria solicitada: {categoria}")
-                return self.query_by_category(user_phone, categoria)
-            
-            elif intent == "consulta_ultima_transacao":
-                # ============================================================
-                # INTENÇÃO: CONSULTA ÚLTIMA TRANSAÇÃO
-                # ============================================================
-                # Usuário quer ver a última transação registrada
-                self.log("Consulta de última transação solicitada")
-                transactions = SQLTool.get_transactions(user_phone, limit=1)
-                
-                if not transactions:
-                    return {
-                        "success": True,
-                        "response": "📭 Você ainda não tem transações registradas."
-                    }
-                
-                transaction = transactions[0]
-                date = datetime.fromisoformat(transaction['created_at']) if isinstance(transaction['created_at'], str) else transaction['created_at']
-                datetime_str = FormatterTool.format_datetime(date)
-                amount_str = FormatterTool.format_currency(transaction['amount'])
-                category = transaction.get('category_name', 'Sem categoria')
-                description = transaction.get('expense_description', 'Sem descrição')
-                
-                response = f"📋 *Última Transação:*\n\n"
-                response += f"• {datetime_str} - {amount_str}\n"
-                response += f"  {description} ({category})"
-                
-                return {
-                    "success": True,
-                    "response": response,
-                    "data": {"transaction": transaction}
-                }
+            # 2. Busca contexto financeiro do usuário para dar ao LLM
+            # - Total gasto no mês ajuda o LLM a dar respostas mais contextuais
+            # - Últimas 5 interações dão contexto de conversa ao LLM
+            # (usuário sem conversas salvas nem consulta o histórico)
+            total_month, conversation_history = self._load_prompt_context(
+                user_phone, has_history=bool(user.get("has_history", True)), now=now
+            )
             
-            elif intent == "consulta_limites":
-                # ============================================================
-                # INTENÇÃO: CONSULTA DE LIMITES
-                # ============================================================
-                # Usuário quer ver seus limites configurados
-                self.log("Consulta de limites solicitada")
-                return self.query_limits(user_phone)
+            # 2.5. Formata o histórico de conversas recentes
+            # (bot_response já vem cortada em 150 caracteres pelo SQL, para não exceder tokens)
+            history_text = "\n\n".join(
+                f"Usuário: {conv['user_message']}\n\nBot: {conv['bot_response']}"
+                for conv in conversation_history
+            )
             
-            elif intent == "listar_categorias":
-                # ============================================================
-                # INTENÇÃO: LISTAR CATEGORIAS
-                # ============================================================
-                # Usuário quer ver todas as categorias cadastradas
-                self.log("Listagem de categorias solicitada")
-                return self.list_categories(user_phone)
+            # 2.6. Consulta o cache de intenções antes de chamar o LLM
+            # Mensagens repetidas ("oi", "meus limites", ...) no mesmo ponto da
+            # conversa recebem a mesma classificação sem novo round-trip.
+            # A última resposta do bot entra na chave porque muda o sentido de
+            # respostas curtas como "sim" ou "não". O usuário também: a
+            # "resposta" do LLM é escrita com o total e o histórico dele e
+            # não pode ser entregue a outro usuário.
+            last_bot_response = conversation_history[-1]['bot_response'] if conversation_history else ""
+            cache_key = (user_phone, normalized_message, last_bot_response)
             
-            elif intent == "fora_escopo":
-                # ============================================================
-                # INTENÇÃO: MENSAGEM FORA DO ESCOPO
-                # ============================================================
-                # Usuário fez pergunta não relacionada a finanças
-                # Resposta já vem formatada do LLM no campo "resposta"
-                response_msg = result_data.get("resposta", 
-                    "Desculpe, mas eu sou um assistente financeiro e só posso ajudar com questões relacionadas a gastos, categorias, limites e consultas financeiras. Como posso ajudar você com suas finanças?")
-                self.log("Mensagem fora do escopo detectada")
-                return {"success": True, "response": response_msg, "data": {}}
+            # Antes do cache, tenta os atalhos por regex (mensagens óbvias)
+            result_data = self._match_fast_path(user_phone, message, normalized_message)
+            if result_data is not None:
+                self.log("Intenção detectada sem LLM: %s", result_data["intent"])
+            else:
+                cached_result = self._intent_cache.get(cache_key)
+                if cached_result is not None:
+                    self.log("Intenção reaproveitada do cache: %s", cached_result.get("intent"))
+                    result_data = dict(cached_result)
             
-            elif intent == "adicionar_categoria":
-                # ============================================================
-                # INTENÇÃO: ADICIONAR CATEGORIA
-                # ============================================================
-                # Usuário quer criar uma nova categoria
-                # Confia no LLM - se ele retornou "adicionar_categoria", tenta processar
-                categoria = result_data.get("categoria", "").strip()
+            if result_data is None:
+                # 3. Cria prompt detalhado para o LLM
+                # O prompt instrui o LLM sobre:
+                # - Contexto do usuário (ID, total gasto)
+                # - Histórico de conversas recentes (context window)
+                # - Intenções possíveis (registro, consulta, ajuda, setup)
+                # - Formato de resposta esperado (JSON estruturado)
+                # - Como extrair dados de gastos
+                # Prepara histórico para incluir no prompt
+                history_section = ""
+                if history_text:
+                    history_section = f"**Histórico de conversas recentes (para contexto):**\n{history_text}\n\n"
                 
-                # Se não tem categoria, deixa LLM lidar (já deveria ter detectado como pedir_esclarecimento)
-                if not categoria or len(categoria) < 2:
-                    self.log("Nome da categoria não identificado - deixando LLM lidar", "WARNING")
-                    return {
-                        "success": True,
-                        "response": result_data.get("resposta", "Não consegui identificar o nome da categoria. Pode informar o nome?"),
-                        "needs_clarification": True
-                    }
+                prompt = _build_process_prompt(user_phone, total_month, history_section, message)
                 
-                # Verifica se categoria já existe (busca exata primeiro, depois matching restritivo)
-                # Primeiro tenta busca exata (case-insensitive)
-                existing_exact = SQLTool.get_category_by_name(user_phone, categoria)
-                if existing_exact:
-                    return {
-                        "success": True,
-                        "response": f"✅ A categoria *{existing_exact['category_name']}* já existe! Você pode usá-la para registrar gastos."
-                    }
+                # 4. Chama o LLM (Gemini API ou Vertex AI) com o prompt
+                # O LLM analisa a mensagem e retorna JSON estruturado.
+                # Em streaming: a leitura para assim que o objeto JSON fecha
+                response_text = self.llm_client.generate_json_text(prompt)
                 
-                # Se não encontrou exato, usa matching inteligente mas RESTRITIVO
-                # Só retorna se for realmente a mesma categoria (erro de digitação/acentuação)
-                existing = self._find_category_with_llm(user_phone, categoria)
-                if existing:
-                    # Verifica se o nome é realmente similar (não apenas relacionado)
-                    # Se a categoria digitada for claramente diferente, cria nova
-                    if existing['category_name'].lower() == categoria.lower():
-                        return {
-                            "success": True,
-                            "response": f"✅ A categoria *{existing['category_name']}* já existe! Você pode usá-la para registrar gastos."
-                        }
-                    # Se for similar mas não igual, pergunta ao usuário
-                    return {
-                        "success": True,
-                        "response": f"❓ Encontrei uma categoria similar: *{existing['category_name']}*\n\nVocê quer criar uma nova categoria chamada *{categoria}* ou usar a categoria *{existing['category_name']}* existente?",
-                        "needs_clarification": True
-                    }
+                # 5. Extrai JSON da resposta do LLM
+                # Normalmente já vem só o objeto; se o streaming não achou um objeto
+                # completo, o LLM pode ter retornado JSON dentro de blocos de código
+                # markdown ou diretamente como texto
+                json_text = extract_json_text(response_text)
                 
-                # Cria nova categoria
+                # 6. Faz parse do JSON retornado pelo LLM
+                # O JSON contém: intent, valor, categoria, descricao, resposta
                 try:
-                    cat_id = SQLTool.create_category(user_phone, categoria, f"Categoria personalizada: {categoria}")
-                    self.log(f"Categoria '{categoria}' criada (ID: {cat_id})")
-                    return {
-                        "success": True,
-                        "response": f"✅ Categoria *{categoria}* criada com sucesso!\n\nAgora você pode usar ela para registrar gastos. Ex: 'gastei 50 em {categoria}'"
-                    }
-                except Exception as e:
-                    self.log(f"Erro ao criar categoria: {e}", "ERROR")
-                    return {
-                        "success": False,
-                        "response": f"❌ Erro ao criar categoria '{categoria}'. Tente novamente com outro nome."
-                    }
-            
-            elif intent == "remover_categoria":
-                # ============================================================
-                # INTENÇÃO: REMOVER CATEGORIA
-                # ============================================================
-                # Usuário quer remover/excluir uma categoria
-                categoria = result_data.get("categoria", "").strip()
-                
-                # Se não tem categoria, deixa LLM lidar
-                if not categoria or len(categoria) < 2:
-                    self.log("Nome da categoria não identificado para remoção - deixando LLM lidar", "WARNING")
-                    return {
-                        "success": True,
-                        "response": result_data.get("resposta", "Qual categoria você quer remover?"),
-                        "needs_clarification": True
-                    }
+                    result_data = json_loads(json_text)
+                except json.JSONDecodeError as e:
+                    self.log("Erro ao fazer parse do JSON do LLM: %s. Resposta: %s", e, response_text[:200], level="ERROR")
+                    return _reply("json_invalido")
                 
-                # Busca categoria usando matching inteligente
-                cat = self._find_category_with_llm(user_phone, categoria)
-                if not cat:
-                    return {
-                        "success": False,
-                        "response": f"❌ Categoria '{categoria}' não encontrada."
-                    }
-                
-                # Tenta remover
-                if SQLTool.delete_category(user_phone, cat["category_id"]):
-                    self.log(f"Categoria '{cat['category_name']}' removida com sucesso")
-                    return {
-                        "success": True,
-                        "response": f"✅ Categoria *{cat['category_name']}* removida com sucesso!"
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "response": f"❌ Não é possível remover a categoria *{cat['category_name']}* porque ela possui transações registradas.\n\nPara remover, primeiro você precisa deletar ou mover todas as transações dessa categoria."
-                    }
-            
-            elif intent == "remover_transacao":
-                # ============================================================
-                # INTENÇÃO: REMOVER TRANSAÇÃO
-                # ============================================================
-                # Usuário quer remover/excluir uma transação específica
-                # Valida result_data
+                # Valida que result_data não é None
                 if not result_data:
-                    return {
-                        "success": False,
-                        "response": "❌ Erro ao processar solicitação de remoção. Tente novamente.",
-                        "needs_clarification": True
-                    }
-                
-                descricao = result_data.get("descricao", "").strip() if result_data.get("descricao") else ""
-                data_str = result_data.get("data", "").strip() if result_data.get("data") else ""
-                valor = result_data.get("valor")
-                remover_ultimo = result_data.get("remover_ultimo", False)  # Flag para remover última transação
-                
-                # Busca transações que correspondem aos critérios
-                all_transactions = SQLTool.get_transactions(user_phone, limit=100)
-                
-                if not all_transactions:
-                    return {
-                        "success": False,
-                        "response": "❌ Você não tem transações registradas."
-                    }
-                
-                # Se pediu para remover o último gasto e não especificou critérios, remove a última
-                if remover_ultimo or (not descricao and not data_str and valor is None):
-                    # Verifica se a mensagem menciona "último" ou "última"
-                    message_lower = message.lower()
-                    if any(word in message_lower for word in ["ultimo", "último", "ultima", "última", "ultimo gasto", "ultima transacao"]):
-                        # Remove a última transação (primeira da lista, pois está ordenada por data DESC)
-                        transaction = all_transactions[0]
-                        transaction_id = transaction['transaction_id']
-                        
-                        if SQLTool.delete_transaction(user_phone, transaction_id):
-                            date = datetime.fromisoformat(transaction['created_at']) if isinstance(transaction['created_at'], str) else transaction['created_at']
-                            datetime_str = FormatterTool.format_datetime(date)
-                            amount_str = FormatterTool.format_currency(transaction['amount'])
-                            self.log(f"Última transação {transaction_id} removida com sucesso")
-                            return {
-                                "success": True,
-                                "response": f"✅ Última transação removida com sucesso!\n\n• {datetime_str} - {amount_str}\n  {transaction.get('expense_description') or 'Sem descrição'} ({transaction.get('category_name', 'Sem categoria')})"
-                            }
-                        else:
-                            return {
-                                "success": False,
-                                "response": "❌ Erro ao remover a transação. Tente novamente."
-                            }
-                
-                # Filtra transações baseado nos critérios fornecidos
-                matching_transactions = []
-                for t in all_transactions:
-                    match = True
-                    
-                    # Filtro por descrição
-                    if descricao:
-                        expense_desc = t.get('expense_description') or ''
-                        if not expense_desc or descricao.lower() not in expense_desc.lower():
-                            match = False
-                    
-                    # Filtro por data
-                    if data_str:
-                        try:
-                            # Tenta vários formatos de data
-                            target_date = None
-                            for fmt in ["%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"]:
-                                try:
-                                    target_date = datetime.strptime(data_str, fmt).date()
-                                    break
-                                except:
-                                    continue
-                            
-                            if target_date:
-                                t_date = datetime.fromisoformat(t['created_at']).date() if isinstance(t['created_at'], str) else t['created_at'].date()
-                                if t_date != target_date:
-                                    match = False
-                        except Exception as e:
-                            self.log(f"Erro ao processar data '{data_str}': {e}", "WARNING")
-                            pass
-                    
-                    # Filtro por valor
-                    if valor is not None:
-                        if abs(float(t['amount']) - float(valor)) > 0.01:  # Tolerância para float
-                            match = False
-                    
-                    if match:
-                        matching_transactions.append(t)
-                
-                if not matching_transactions:
-                    return {
-                        "success": False,
-                        "response": "❌ Não encontrei transações que correspondam aos critérios informados."
-                    }
-                
-                if len(matching_transactions) > 1:
-                    # Múltiplas transações encontradas - mostra para o usuário escolher
-                    response = f"❓ Encontrei {len(matching_transactions)} transações que correspondem:\n\n"
-                    for i, t in enumerate(matching_transactions[:5], 1):  # Mostra até 5
-                        date = datetime.fromisoformat(t['created_at']) if isinstance(t['created_at'], str) else t['created_at']
-                        datetime_str = FormatterTool.format_datetime(date)
-                        amount_str = FormatterTool.format_currency(t['amount'])
-                        response += f"{i}. {datetime_str} - {amount_str} - {t.get('expense_description', 'Sem descrição')}\n"
-                    response += "\nPor favor, seja mais específico (adicione data ou descrição mais detalhada)."
-                    return {
-                        "success": True,
-                        "response": response,
-                        "needs_clarification": True
-                    }
-                
-                # Exatamente uma transação encontrada - remove
-                transaction = matching_transactions[0]
-                transaction_id = transaction['transaction_id']
-                
-                if SQLTool.delete_transaction(user_phone, transaction_id):
-                    date = datetime.fromisoformat(transaction['created_at']) if isinstance(transaction['created_at'], str) else transaction['created_at']
-                    datetime_str = FormatterTool.format_datetime(date)
-                    amount_str = FormatterTool.format_currency(transaction['amount'])
-                    self.log(f"Transação {transaction_id} removida com sucesso")
-                    return {
-                        "success": True,
-                        "response": f"✅ Transação removida com sucesso!\n\n• {datetime_str} - {amount_str}\n  {transaction.get('expense_description', 'Sem descrição')}"
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "response": "❌ Erro ao remover a transação. Tente novamente."
-                    }
-            
-            elif intent == "remover_limite":
-                # ============================================================
-                # INTENÇÃO: REMOVER LIMITE
-                # ============================================================
-                # Usuário quer remover/excluir um limite de gasto
-                categoria = result_data.get("categoria", "").strip()
+                    self.log("LLM retornou JSON vazio ou None", level="ERROR")
+                    return _reply("json_vazio")
                 
-                # Se não tem categoria, deixa LLM lidar
-                if not categoria or len(categoria) < 2:
-                    self.log("Nome da categoria não identificado para remover limite - deixando LLM lidar", "WARNING")
-                    return {
-                        "success": True,
-                        "response": result_data.get("resposta", "De qual categoria você quer remover o limite?"),
-                        "needs_clarification": True
-                    }
+                # Interna a intenção vinda do JSON (objeto novo a cada resposta):
+                # as chaves de _intent_handlers e _CACHEABLE_INTENTS são literais
+                # já internados, então o lookup casa por identidade, sem comparar
+                # caracteres. Atalhos e entradas do cache já chegam internados.
+                intent = result_data.get("intent")
+                if isinstance(intent, str):
+                    result_data["intent"] = sys.intern(intent)
                 
-                # Busca categoria usando matching inteligente
-                cat = self._find_category_with_llm(user_phone, categoria)
-                if not cat:
-                    return {
-                        "success": False,
-                        "response": f"❌ Categoria '{categoria}' não encontrada."
-                    }
+                # Só guarda intenções que não dependem de dados da mensagem
+                if result_data.get("intent") in _CACHEABLE_INTENTS:
+                    self._intent_cache.set(cache_key, dict(result_data))
                 
-                # Remove limite
-                if SQLTool.delete_limit_rule(user_phone, cat["category_id"]):
-                    self.log(f"Limite da categoria '{cat['category_name']}' removido com sucesso")
-                    return {
-                        "success": True,
-                        "response": f"✅ Limite da categoria *{cat['category_name']}* removido com sucesso!"
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "response": f"❌ Não foi possível remover o limite da categoria *{cat['category_name']}*.\n\nA categoria não possui limite configurado."
-                    }
+            intent = result_data.get("intent")
             
-            elif intent == "setup":
-                # ============================================================
-                # INTENÇÃO: SETUP/CONFIGURAÇÃO
-                # ============================================================
-                # Usuário quer configurar o sistema
-                # Redireciona para SetupAgent que tem fluxo guiado
-                self.log("Setup detectado - redirecionando para SetupAgent")
-                return {
-                    "success": True,
-                    "response": None,  # SetupAgent vai gerar a resposta
-                    "data": {},
-                    "route_to": "setup"  # Flag para o workflow rotear corretamente
-                }
+            self.log("Intenção detectada: %s", intent)
             
-            elif intent == "ajuda":
-                # ============================================================
-                # INTENÇÃO: AJUDA/SAUDAÇÃO
-                # ============================================================
-                # Usuário quer ajuda ou está cumprimentando
-                # Resposta já vem formatada do LLM no campo "resposta"
-                response_msg = result_data.get("resposta", "Como posso ajudar?")
-                return {"success": True, "response": response_msg, "data": {}}
+            # 7. Executa ação baseada na intenção detectada pelo LLM
+            # Cada intenção tem seu handler (_handle_<intenção>); intenções
+            # desconhecidas usam a resposta que o LLM gerou
+            # (depois do cache de intenções: o instante não faz parte da intenção)
+            result_data["now"] = now
+            handler = self._intent_handlers.get(intent, self._handle_unknown)
+            result = handler(user_phone, message, result_data)
             
-            else:
-                # ============================================================
-                # FALLBACK: INTENÇÃO DESCONHECIDA
-                # ============================================================
-                # Se o LLM retornou uma intenção não reconhecida,
-                # usa a resposta que o LLM gerou (pode ser útil)
-                response_msg = result_data.get("resposta", "Não entendi. Pode reformular?")
-                self.log(f"Intenção desconhecida: {intent}, usando resposta do LLM")
-                return {"success": True, "response": response_msg, "data": {}}
+            # Resposta montada só com textos fixos: avisa o OutputAgent para
+            # entregá-la como está. Se o LLM mandou "resposta", o handler pode
+            # tê-la usado (ex: _reply com texto do LLM) e a revisão continua.
+            if intent in _TEMPLATE_INTENTS and not result_data.get("resposta"):
+                result["data"] = {**(result.get("data") or {}), "skip_validation": True}
+            return result
         
         except json.JSONDecodeError as e:
             # Erro ao fazer parse do JSON retornado pelo LLM
             # Pode acontecer se o LLM não retornar JSON válido
-            self.log(f"Erro ao fazer parse do JSON do LLM: {e}", "ERROR")
-            self.log(f"Resposta do LLM: {response_text[:200]}", "ERROR")
+            self.log_many([
+                ("ERROR", "Erro ao fazer parse do JSON do LLM: %s", e),
+                ("ERROR", "Resposta do LLM: %s", response_text[:200]),
+            ])
             return {"success": False, "response": "Erro ao processar resposta. Tente novamente!"}
         
         except Exception as e:
             # Erro genérico - loga detalhes para debug
-            self.log(f"Erro ao processar com LLM: {e}", "ERROR")
+            self.log("Erro ao processar com LLM: %s", e, level="ERROR")
+            # Stack trace completo pelo logger (fila, sem escrita síncrona no
+            # stderr); o import fica aqui porque só o caminho de erro precisa dele
             import traceback
-            traceback.print_exc()  # Stack trace completo para debug
+            self.log("Traceback:\n%s", traceback.format_exc(), level="ERROR")
             return {"success": False, "response": f"Erro ao processar: {str(e)}"}
     
+    # ========================================================================
+    # HANDLERS DE INTENÇÃO (process_with_llm)
+    # ========================================================================
+    # Recebem (user_phone, message, result_data) - result_data é o JSON do LLM
+    # (ou do atalho por regex/cache) - e retornam o dicionário de resposta.
+    # Exceções sobem para o tratamento de erros de process_with_llm().
+    
+    def _handle_pedir_esclarecimento(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Mensagem ambígua: devolve a pergunta de esclarecimento gerada pelo LLM."""
+        # ============================================================
+        # INTENÇÃO: PEDIR ESCLARECIMENTO (MENSAGEM AMBÍGUA)
+        # ============================================================
+        # LLM detectou ambiguidade e pediu esclarecimento
+        # Resposta já vem formatada do LLM no campo "resposta"
+        response_msg = result_data.get("resposta", 
+            "Não consegui entender completamente. Pode reformular sua mensagem?")
+        self.log("Mensagem ambígua detectada - pedindo esclarecimento")
+        return {"success": True, "response": response_msg, "data": {}}
+    
+    def _handle_registro(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Registra um gasto (valor, categoria e descrição extraídos pelo LLM)."""
+        # Registra o gasto
+        # Confia no LLM - se ele retornou "registro", tenta processar
+        valor_str = result_data.get("valor")
+        categoria = _str_field(result_data, "categoria")
+        descricao = result_data.get("descricao", message[:50])
+        
+        # Se não tem valor, deixa LLM lidar (já deveria ter detectado como pedir_esclarecimento)
+        if not valor_str or valor_str == 0:
+            self.log("Valor não identificado - deixando LLM lidar", level="WARNING")
+            return _reply("valor_ausente", result_data.get("resposta"))
+        
+        # Aceita também "50,00" ou "R$ 50" (o LLM às vezes devolve texto)
+        valor = _parse_valor(valor_str)
+        if valor is None:
+            self.log("Erro ao parsear valor - deixando LLM lidar", level="WARNING")
+            return _reply("valor_invalido", result_data.get("resposta"))
+        if valor <= 0:
+            self.log("Valor inválido - deixando LLM lidar", level="WARNING")
+            return _reply("valor_nao_positivo", result_data.get("resposta"))
+        
+        # Validação de categoria - usa "Geral" como fallback se não identificada
+        if not categoria or categoria.strip() == "":
+            categoria = "Geral"
+            self.log("Categoria não identificada, usando 'Geral' como fallback")
+        
+        # Usa matching inteligente com LLM para encontrar categoria existente
+        # A categoria já foi validada acima, então não está vazia aqui
+        cat = self._find_category_with_llm(user_phone, categoria)
+        if not cat:
+            # Se não encontrou categoria existente, cria nova categoria
+            # Isso garante que "Geral" será criada se não existir
+            cat_id = SQLTool.create_category(user_phone, categoria, f"Categoria {categoria}")
+            self._category_cache.pop(user_phone, None)
+            self.log("Categoria '%s' criada automaticamente", categoria)
+        else:
+            cat_id = cat["category_id"]
+            # Usa o nome correto da categoria encontrada
+            categoria = cat["category_name"]
+        
+        # Registra transação e recalcula os limites da categoria na mesma ida ao banco
+        inserted = SQLTool.insert_transaction_and_check_limit(user_phone, cat_id, valor, descricao)
+        trans_id = inserted["transaction_id"]
+        self._total_cache.pop(user_phone)  # Total do prompt mudou
+        
+        # Gera alerta se algum limite foi atingido
+        alert_message = self._check_limits(inserted["rules"])
+        
+        response_msg = f"✅ Gasto registrado: {FormatterTool.format_currency(valor)} em {categoria}"
+        
+        # Adiciona alerta à resposta se houver
+        if alert_message:
+            response_msg += f"\n\n{alert_message}"
+        
+        return {"success": True, "response": response_msg, "data": {"transaction_id": trans_id}}
+    
+    def _handle_consulta_total(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Consulta o total gasto (período relativo ou datas específicas)."""
+        # ============================================================
+        # INTENÇÃO: CONSULTA DE GASTOS
+        # ============================================================
+        # Usuário quer ver quanto gastou
+        # Chama método que busca dados e formata resposta
+        # O LLM pode retornar:
+        # - period: "day|week|month|all" (períodos relativos)
+        # - start_date e end_date: datas específicas (YYYY-MM-DD)
+        
+        # Verifica se há datas específicas
+        start_date_str = result_data.get("start_date")
+        end_date_str = result_data.get("end_date")
+        
+        if start_date_str and end_date_str:
+            # Consulta por período específico (datas customizadas)
+            try:
+                start_date = self._parse_date(start_date_str)
+                end_date = self._parse_date(end_date_str)  # query_by_date_range inclui o dia inteiro
+                
+                self.log("Consulta por período específico: %s até %s", start_date_str, end_date_str)
+                return self.query_by_date_range(user_phone, start_date, end_date)
+            except Exception as e:
+                self.log("Erro ao parsear datas: %s", e, level="ERROR")
+                return _reply("datas_invalidas")
+        else:
+            # Consulta por período relativo (day, week, month, all)
+            period = result_data.get("period", "month")  # Default: mês atual
+            self.log("Consulta de gastos solicitada (período: %s)", period)
+            return self.query_total(user_phone, period, now=result_data.get("now"))
+    
+    def _handle_consulta_categoria(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Consulta os gastos de uma categoria específica."""
+        # ============================================================
+        # INTENÇÃO: CONSULTA POR CATEGORIA ESPECÍFICA
+        # ============================================================
+        # Usuário quer ver gastos de uma categoria específica
+        categoria = _str_field(result_data, "categoria")
+        if not categoria:
+            return _reply("consulta_sem_categoria")
+        self.log("Consulta por categoria solicitada: %s", categoria)
+        return self.query_by_category(user_phone, categoria)
+    
+    def _handle_consulta_ultima_transacao(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Mostra a última transação registrada."""
+        # ============================================================
+        # INTENÇÃO: CONSULTA ÚLTIMA TRANSAÇÃO
+        # ============================================================
+        # Usuário quer ver a última transação registrada
+        self.log("Consulta de última transação solicitada")
+        transactions = SQLTool.get_transactions(user_phone, limit=1)
+        
+        if not transactions:
+            return _reply("nenhuma_transacao")
+        
+        transaction = transactions[0]
+        datetime_str = transaction['created_at_display']
+        amount_str = FormatterTool.format_currency(transaction['amount'])
+        category = transaction.get('category_name', 'Sem categoria')
+        description = transaction.get('expense_description', 'Sem descrição')
+        
+        response = f"📋 *Última Transação:*\n\n"
+        response += f"• {datetime_str} - {amount_str}\n"
+        response += f"  {description} ({category})"
+        
+        return {
+            "success": True,
+            "response": response,
+            "data": {"transaction": transaction}
+        }
+    
+    def _handle_consulta_limites(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Mostra os limites configurados."""
+        # ============================================================
+        # INTENÇÃO: CONSULTA DE LIMITES
+        # ============================================================
+        # Usuário quer ver seus limites configurados
+        self.log("Consulta de limites solicitada")
+        return self.query_limits(user_phone)
+    
+    def _handle_listar_categorias(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Lista as categorias cadastradas."""
+        # ============================================================
+        # INTENÇÃO: LISTAR CATEGORIAS
+        # ============================================================
+        # Usuário quer ver todas as categorias cadastradas
+        self.log("Listagem de categorias solicitada")
+        return self.list_categories(user_phone)
+    
+    def _handle_fora_escopo(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Mensagem não relacionada a finanças: devolve a resposta do LLM."""
+        # ============================================================
+        # INTENÇÃO: MENSAGEM FORA DO ESCOPO
+        # ============================================================
+        # Usuário fez pergunta não relacionada a finanças
+        # Resposta já vem formatada do LLM no campo "resposta"
+        response_msg = result_data.get("resposta", 
+            "Desculpe, mas eu sou um assistente financeiro e só posso ajudar com questões relacionadas a gastos, categorias, limites e consultas financeiras. Como posso ajudar você com suas finanças?")
+        self.log("Mensagem fora do escopo detectada")
+        return {"success": True, "response": response_msg, "data": {}}
+    
+    def _handle_adicionar_categoria(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Cria uma nova categoria (se não existir uma igual ou parecida)."""
+        # ============================================================
+        # INTENÇÃO: ADICIONAR CATEGORIA
+        # ============================================================
+        # Usuário quer criar uma nova categoria
+        # Confia no LLM - se ele retornou "adicionar_categoria", tenta processar
+        categoria = _str_field(result_data, "categoria")
+        
+        # Se não tem categoria, deixa LLM lidar (já deveria ter detectado como pedir_esclarecimento)
+        if not categoria or len(categoria) < 2:
+            self.log("Nome da categoria não identificado - deixando LLM lidar", level="WARNING")
+            return _reply("categoria_sem_nome", result_data.get("resposta"))
+        
+        # Verifica se categoria já existe (busca exata primeiro, depois matching restritivo)
+        # Uma única consulta traz as categorias; a comparação é feita aqui
+        all_categories = self._get_user_categories(user_phone)
+        existing_exact, closest, similarity = _closest_category(categoria, all_categories)
+        if existing_exact:
+            return _reply("categoria_ja_existe", categoria=existing_exact['category_name'])
+        
+        # Se não encontrou exato, usa matching inteligente mas RESTRITIVO
+        # Só retorna se for realmente a mesma categoria (erro de digitação/acentuação)
+        # O LLM só é consultado quando alguma categoria é parecida de fato
+        existing = None
+        if closest and similarity >= _SIMILAR_CATEGORY_RATIO:
+            existing = self._find_category_with_llm(user_phone, categoria, all_categories)
+        if existing:
+            # Verifica se o nome é realmente similar (não apenas relacionado)
+            # Se a categoria digitada for claramente diferente, cria nova
+            if existing['category_name'].lower() == categoria.lower():
+                return _reply("categoria_ja_existe", categoria=existing['category_name'])
+            # Se for similar mas não igual, pergunta ao usuário
+            return {
+                "success": True,
+                "response": f"❓ Encontrei uma categoria similar: *{existing['category_name']}*\n\nVocê quer criar uma nova categoria chamada *{categoria}* ou usar a categoria *{existing['category_name']}* existente?",
+                "needs_clarification": True
+            }
+        
+        # Cria nova categoria
+        try:
+            cat_id = SQLTool.create_category(user_phone, categoria, f"Categoria personalizada: {categoria}")
+            self._category_cache.pop(user_phone, None)
+            self.log("Categoria '%s' criada (ID: %s)", categoria, cat_id)
+            return {
+                "success": True,
+                "response": f"✅ Categoria *{categoria}* criada com sucesso!\n\nAgora você pode usar ela para registrar gastos. Ex: 'gastei 50 em {categoria}'"
+            }
+        except Exception as e:
+            self.log("Erro ao criar categoria: %s", e, level="ERROR")
+            return _reply("erro_criar_categoria", categoria=categoria)
+    
+    def _handle_remover_categoria(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Remove uma categoria sem transações."""
+        # ============================================================
+        # INTENÇÃO: REMOVER CATEGORIA
+        # ============================================================
+        # Usuário quer remover/excluir uma categoria
+        categoria = _str_field(result_data, "categoria")
+        
+        # Se não tem categoria, deixa LLM lidar
+        if not categoria or len(categoria) < 2:
+            self.log("Nome da categoria não identificado para remoção - deixando LLM lidar", level="WARNING")
+            return _reply("remover_categoria_sem_nome", result_data.get("resposta"))
+        
+        # Busca categoria usando matching inteligente
+        cat = self._find_category_with_llm(user_phone, categoria)
+        if not cat:
+            return _reply("categoria_nao_encontrada", categoria=categoria)
+        
+        # Tenta remover
+        if SQLTool.delete_category(user_phone, cat["category_id"]):
+            self._category_cache.pop(user_phone, None)
+            self.log("Categoria '%s' removida com sucesso", cat['category_name'])
+            return _reply("categoria_removida", categoria=cat['category_name'])
+        else:
+            return _reply("categoria_com_transacoes", categoria=cat['category_name'])
+    
+    def _handle_remover_transacao(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Remove uma transação (a última ou a que atende aos critérios)."""
+        # ============================================================
+        # INTENÇÃO: REMOVER TRANSAÇÃO
+        # ============================================================
+        # Usuário quer remover/excluir uma transação específica
+        # Valida result_data
+        if not result_data:
+            return _reply("erro_remocao")
+        
+        descricao = _str_field(result_data, "descricao")
+        data_str = _str_field(result_data, "data")
+        valor = result_data.get("valor")
+        remover_ultimo = result_data.get("remover_ultimo", False)  # Flag para remover última transação
+        
+        # Busca a última transação (também confirma que o usuário tem alguma)
+        latest_transactions = SQLTool.get_transactions(user_phone, limit=1)
+        
+        if not latest_transactions:
+            return _reply("sem_transacoes")
+        
+        # Se pediu para remover o último gasto e não especificou critérios, remove a última
+        if remover_ultimo or (not descricao and not data_str and valor is None):
+            # Verifica se a mensagem menciona "último" ou "última"
+            if _LAST_TRANSACTION_RE.search(message):
+                # Remove a última transação (get_transactions ordena por data DESC)
+                transaction = latest_transactions[0]
+                transaction_id = transaction['transaction_id']
+                
+                if SQLTool.delete_transaction(user_phone, transaction_id):
+                    self._total_cache.pop(user_phone)  # Total do prompt mudou
+                    datetime_str = transaction['created_at_display']
+                    amount_str = FormatterTool.format_currency(transaction['amount'])
+                    self.log("Última transação %s removida com sucesso", transaction_id)
+                    return {
+                        "success": True,
+                        "response": f"✅ Última transação removida com sucesso!\n\n• {datetime_str} - {amount_str}\n  {transaction.get('expense_description') or 'Sem descrição'} ({transaction.get('category_name', 'Sem categoria')})"
+                    }
+                else:
+                    return _reply("erro_remover_transacao")
+        
+        # Converte os critérios uma vez só e deixa o SQL filtrar
+        # Data: tenta vários formatos (data inválida = sem filtro de data)
+        target_date = _parse_user_date(data_str) if data_str else None
+        if data_str and target_date is None:
+            self.log("Data '%s' em formato desconhecido - ignorando filtro de data", data_str, level="WARNING")
+        
+        found = SQLTool.find_transactions(
+            user_phone,
+            description=descricao or None,
+            date=target_date,
+            amount=_parse_valor(valor) if valor is not None else None,
+            limit=5  # Só até 5 são mostradas ao usuário
+        )
+        matching_transactions = found["transactions"]
+        
+        if not matching_transactions:
+            return _reply("transacao_nao_encontrada")
+        
+        if found["total_matches"] > 1:
+            # Múltiplas transações encontradas - mostra para o usuário escolher
+            response = f"❓ Encontrei {found['total_matches']} transações que correspondem:\n\n"
+            for i, t in enumerate(matching_transactions, 1):  # Mostra até 5
+                datetime_str = t['created_at_display']
+                amount_str = FormatterTool.format_currency(t['amount'])
+                response += f"{i}. {datetime_str} - {amount_str} - {t.get('expense_description', 'Sem descrição')}\n"
+            response += "\nPor favor, seja mais específico (adicione data ou descrição mais detalhada)."
+            return {
+                "success": True,
+                "response": response,
+                "needs_clarification": True
+            }
+        
+        # Exatamente uma transação encontrada - remove
+        transaction = matching_transactions[0]
+        transaction_id = transaction['transaction_id']
+        
+        if SQLTool.delete_transaction(user_phone, transaction_id):
+            self._total_cache.pop(user_phone)  # Total do prompt mudou
+            datetime_str = transaction['created_at_display']
+            amount_str = FormatterTool.format_currency(transaction['amount'])
+            self.log("Transação %s removida com sucesso", transaction_id)
+            return {
+                "success": True,
+                "response": f"✅ Transação removida com sucesso!\n\n• {datetime_str} - {amount_str}\n  {transaction.get('expense_description', 'Sem descrição')}"
+            }
+        else:
+            return _reply("erro_remover_transacao")
+    
+    def _handle_remover_limite(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Remove o limite de gasto de uma categoria."""
+        # ============================================================
+        # INTENÇÃO: REMOVER LIMITE
+        # ============================================================
+        # Usuário quer remover/excluir um limite de gasto
+        categoria = _str_field(result_data, "categoria")
+        
+        # Se não tem categoria, deixa LLM lidar
+        if not categoria or len(categoria) < 2:
+            self.log("Nome da categoria não identificado para remover limite - deixando LLM lidar", level="WARNING")
+            return _reply("limite_sem_categoria", result_data.get("resposta"))
+        
+        # Busca categoria usando matching inteligente
+        cat = self._find_category_with_llm(user_phone, categoria)
+        if not cat:
+            return _reply("categoria_nao_encontrada", categoria=categoria)
+        
+        # Remove limite
+        if SQLTool.delete_limit_rule(user_phone, cat["category_id"]):
+            self.log("Limite da categoria '%s' removido com sucesso", cat['category_name'])
+            return _reply("limite_removido", categoria=cat['category_name'])
+        else:
+            return _reply("limite_inexistente", categoria=cat['category_name'])
+    
+    def _handle_setup(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Pede ao workflow para redirecionar ao SetupAgent."""
+        # ============================================================
+        # INTENÇÃO: SETUP/CONFIGURAÇÃO
+        # ============================================================
+        # Usuário quer configurar o sistema
+        # Redireciona para SetupAgent que tem fluxo guiado
+        self.log("Setup detectado - redirecionando para SetupAgent")
+        return {
+            "success": True,
+            "response": None,  # SetupAgent vai gerar a resposta
+            "data": {},
+            "route_to": "setup"  # Flag para o workflow rotear corretamente
+        }
+    
+    def _handle_ajuda(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Ajuda/saudação: devolve a resposta do LLM."""
+        # ============================================================
+        # INTENÇÃO: AJUDA/SAUDAÇÃO
+        # ============================================================
+        # Usuário quer ajuda ou está cumprimentando
+        # Resposta já vem formatada do LLM no campo "resposta"
+        response_msg = result_data.get("resposta", "Como posso ajudar?")
+        return {"success": True, "response": response_msg, "data": {}}
+    
+    def _handle_unknown(self, user_phone: str, message: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Intenção não reconhecida: usa a resposta que o LLM gerou (pode ser útil)."""
+        # ============================================================
+        # FALLBACK: INTENÇÃO DESCONHECIDA
+        # ============================================================
+        # Se o LLM retornou uma intenção não reconhecida,
+        # usa a resposta que o LLM gerou (pode ser útil)
+        response_msg = result_data.get("resposta", "Não entendi. Pode reformular?")
+        self.log("Intenção desconhecida: %s, usando resposta do LLM", result_data.get("intent"))
+        return {"success": True, "response": response_msg, "data": {}}
+    
+    def _load_prompt_context(
+        self,
+        user_phone: str,
+        has_history: bool = True,
+        now: Optional[datetime] = None
+    ) -> Tuple[float, List[Dict[str, Any]]]:
+        """
+        Busca o total gasto nos últimos 30 dias e as últimas 5 conversas.
+        
+        O total tem cache de 60 segundos por usuário: ele só decora o prompt,
+        então em uma conversa com várias mensagens seguidas não precisa ser
+        recalculado a cada mensagem. Sem cache, total e histórico saem juntos
+        de SQLTool.get_total_and_history() (uma conexão só).
+        
+        Args:
+            user_phone: ID do usuário
+            has_history: False quando já se sabe que o usuário não tem conversas
+                         salvas (get_or_create_user) - o histórico nem é consultado
+            now: Instante da mensagem (padrão: datetime.now())
+        
+        Returns:
+            (total_month, conversation_history) - total é 0.0 se a consulta
+            falhar (não é crítico)
+        """
+        def fetch_history() -> List[Dict[str, Any]]:
+            if not has_history:
+                return []
+            return SQLTool.get_conversation_history(user_phone, limit=5, max_response_chars=150)
+        
+        total = self._total_cache.get(user_phone)
+        if total is not None:
+            return total, fetch_history()
+        
+        try:
+            end = now or datetime.now()
+            start = end - _THIRTY_DAYS  # Últimos 30 dias
+            if has_history:
+                context = SQLTool.get_total_and_history(
+                    user_phone, start, end, history_limit=5, max_response_chars=150
+                )
+            else:
+                context = {"total": SQLTool.get_total_by_period(user_phone, start, end), "history": []}
+        except Exception:
+            # Se falhar ao buscar total, não é crítico - continua com 0 (sem cachear)
+            return 0.0, fetch_history()
+        
+        self._total_cache.set(user_phone, context["total"])
+        return context["total"], context["history"]
+    
+    def _match_fast_path(self, user_phone: str, message: str, normalized_message: str) -> Optional[Dict[str, Any]]:
+        """
+        Reconhece mensagens óbvias por regex, sem chamar o LLM.
+        
+        Cobre consultas de total simples e registros explícitos em uma
+        categoria que já existe (saudações são tratadas antes, em
+        process_with_llm, sem acessar o banco). Qualquer coisa fora desses padrões
+        (ou ambígua) retorna None e segue para o LLM.
+        
+        Args:
+            user_phone: ID do usuário (para conferir a categoria do registro)
+            message: Mensagem original (usada como descrição do gasto)
+            normalized_message: Mensagem normalizada por FormatterTool.normalize_text
+        
+        Returns:
+            result_data no mesmo formato do JSON do LLM, ou None
+        """
+        match = _FAST_TOTAL_RE.match(normalized_message)
+        if match:
+            if match.group("day"):
+                period = "day"
+            elif match.group("week"):
+                period = "week"
+            else:
+                period = "month"  # Sem período explícito = mês atual (igual ao prompt)
+            return {"intent": "consulta_total", "period": period}
+        
+        match = _FAST_EXPENSE_RE.match(normalized_message)
+        if match:
+            # Só usa o atalho se a categoria já existe com esse nome exato;
+            # "mercado" → "Alimentação" continua exigindo o LLM
+            category = _closest_category(match.group("categoria"), self._get_user_categories(user_phone))[0]
+            if category:
+                return {
+                    "intent": "registro",
+                    "valor": _parse_valor(match.group("valor")),
+                    "categoria": category["category_name"],
+                    "descricao": message[:50],
+                }
+        
+        return None
+    
     def setup_placeholder(self, user_phone: str) -> Dict[str, Any]:
         """
         Resposta temporária para configuração (até implementar SetupAgent).
@@ -1057,7 +1650,7 @@ Por enquanto, só começar a usar: "gastei 50 no supermercado" 😊
         """
         # Este método não é mais usado - toda extração é feita via LLM no process_with_llm()
         # Se chamado, retorna None para forçar uso do método principal
-        self.log("extract_expense() chamado - use process_with_llm() em vez disso", "WARNING")
+        self.log("extract_expense() chamado - use process_with_llm() em vez disso", level="WARNING")
         return None
     
     def extract_and_register(self, user_phone: str, message: str) -> Dict[str, Any]:
@@ -1087,20 +1680,22 @@ Por enquanto, só começar a usar: "gastei 50 no supermercado" 😊
         if not category:
             # Cria categoria automaticamente
             category_id = SQLTool.create_category(user_phone, category_name, f"Categoria {category_name}")
-            self.log(f"Categoria '{category_name}' criada automaticamente (ID: {category_id})")
+            self.log("Categoria '%s' criada automaticamente (ID: %s)", category_name, category_id)
         else:
             category_id = category["category_id"]
         
-        # Registra transação
-        transaction_id = SQLTool.insert_transaction(
+        # Registra transação e recalcula os limites da categoria
+        inserted = SQLTool.insert_transaction_and_check_limit(
             user_phone,
             category_id,
             expense["amount"],
             expense["description"]
         )
+        transaction_id = inserted["transaction_id"]
+        self._total_cache.pop(user_phone)  # Total do prompt mudou
         
         # Verifica limites
-        alert_message = self._check_limits(user_phone, category_id, expense["amount"])
+        alert_message = self._check_limits(inserted["rules"])
         
         # Formata resposta
         response = FormatterTool.format_success_message(
@@ -1110,7 +1705,7 @@ Por enquanto, só começar a usar: "gastei 50 no supermercado" 😊
         if alert_message:
             response += f"\n\n{alert_message}"
         
-        self.log(f"Transação {transaction_id} registrada: R$ {expense['amount']}")
+        self.log("Transação %s registrada: R$ %s", transaction_id, expense['amount'])
         
         return {
             "success": True,
@@ -1123,79 +1718,50 @@ Por enquanto, só começar a usar: "gastei 50 no supermercado" 😊
             }
         }
     
-    def _check_limits(self, user_phone: str, category_id: int, new_amount: float) -> Optional[str]:
-        """Verifica se algum limite foi atingido e retorna alerta se necessário."""
-        
-        rules = SQLTool.get_active_rules(user_phone)
+    def _check_limits(self, rules: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        Retorna alerta se algum limite foi atingido.
         
+        Args:
+            rules: Regras da categoria com current_total já recalculado
+                   (SQLTool.insert_transaction_and_check_limit)
+        """
         for rule in rules:
-            if rule["category_id"] == category_id:
-                # Define período baseado no tipo da regra
-                end_date = datetime.now()
-                if rule["period_type"] == "mensal":
-                    # Primeiro dia do mês atual
-                    start_date = end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-                elif rule["period_type"] == "semanal":
-                    # 7 dias atrás
-                    start_date = end_date - timedelta(days=7)
-                else:
-                    # Default: mês atual
-                    start_date = end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-                
-                # Calcula total do período
-                current_total = SQLTool.get_total_by_category(
-                    user_phone, 
-                    category_id, 
-                    start_date=start_date,
-                    end_date=end_date
+            if rule["current_total"] >= rule["limit_value"]:
+                return FormatterTool.format_limit_alert(
+                    rule["category_name"],
+                    rule["current_total"],
+                    rule["limit_value"],
+                    rule["period_type"]
                 )
-                
-                # Atualiza regra
-                SQLTool.update_rule_total(rule["rule_id"], current_total)
-                
-                # Verifica se excedeu
-                if current_total >= rule["limit_value"]:
-                    return FormatterTool.format_limit_alert(
-                        rule["category_name"],
-                        current_total,
-                        rule["limit_value"],
-                        rule["period_type"]
-                    )
         
         return None
     
-    def query_total(self, user_phone: str, period: str = "month") -> Dict[str, Any]:
+    def query_total(self, user_phone: str, period: str = "month", now: Optional[datetime] = None) -> Dict[str, Any]:
         """
         Consulta total gasto em um período.
         
         Args:
             period: "day", "week", "month", "all"
+            now: Instante de referência (padrão: datetime.now())
         """
-        now = datetime.now()
-        
-        if period == "day":
-            # Hoje (do início do dia até agora)
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            period_label = "hoje"
-        elif period == "week":
-            start_date = now - timedelta(days=7)
-            period_label = "nos últimos 7 dias"
-        elif period == "month":
-            start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            period_label = "este mês"
-        else:  # period == "all"
-            # Para "all", usa data muito antiga para buscar todas as transações
-            start_date = datetime(2000, 1, 1)
-            period_label = "no total"
-        
-        # Busca total
-        total = SQLTool.get_total_by_period(user_phone, start_date, now)
-        
-        # Busca por categoria (usa None para start_date quando for "all" para buscar todas)
-        if period == "all":
-            spending_data = SQLTool.get_spending_by_category(user_phone, None, now)
-        else:
-            spending_data = SQLTool.get_spending_by_category(user_phone, start_date, now)
+        now = now or datetime.now()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        
+        # Períodos desconhecidos contam como "all"
+        start_of, period_label = _PERIODS.get(period, _PERIODS["all"])
+        start_date = start_of(now, today)
+        
+        # Fim exclusivo do período: meia-noite de amanhã (inclui o dia de hoje inteiro)
+        end_date = today + _ONE_DAY
+        
+        # Total e resumo por categoria em uma só ida ao banco
+        # (start_date None quando for "all" para buscar todas)
+        snapshot = SQLTool.get_period_snapshot(
+            user_phone, None if period == "all" else start_date, end_date
+        )
+        total = snapshot["total"]
+        spending_data = snapshot["by_category"]
         
         # Formata resposta
         summary = FormatterTool.format_category_summary(spending_data)
@@ -1234,38 +1800,27 @@ Por enquanto, só começar a usar: "gastei 50 no supermercado" 😊
                 "data": {}
             }
         
-        # Formata lista de limites
+        # Formata lista de limites (um bloco de _LIMIT_LINE_TEMPLATE por regra)
+        format_currency = FormatterTool.format_currency
         lines = ["📊 *Seus Limites Configurados:*\n"]
         
         for rule in rules:
-            category_name = rule["category_name"]
             limit_value = rule["limit_value"]
             current_total = rule.get("current_total", 0)
-            period_type = rule["period_type"]
             
-            # Calcula percentual usado
+            # Calcula percentual usado e o status correspondente
             percentage = (current_total / limit_value * 100) if limit_value > 0 else 0
+            emoji, status = FormatterTool.limit_status(percentage)
             
-            # Emoji baseado no percentual
-            if percentage >= 100:
-                emoji = "🔴"
-                status = "EXCEDIDO"
-            elif percentage >= 80:
-                emoji = "🟡"
-                status = "ATENÇÃO"
-            else:
-                emoji = "🟢"
-                status = "OK"
-            
-            # Formata período
-            period_label = "mensal" if period_type == "mensal" else period_type
-            
-            lines.append(
-                f"{emoji} *{category_name}* ({period_label})\n"
-                f"   Limite: {FormatterTool.format_currency(limit_value)}\n"
-                f"   Gasto atual: {FormatterTool.format_currency(current_total)}\n"
-                f"   Status: {status} ({FormatterTool.format_percentage(percentage)})\n"
-            )
+            lines.append(_LIMIT_LINE_TEMPLATE.format(
+                emoji=emoji,
+                category=rule["category_name"],
+                period=rule["period_type"],
+                limit=format_currency(limit_value),
+                current=format_currency(current_total),
+                status=status,
+                percentage=FormatterTool.format_percentage(percentage),
+            ))
         
         response_msg = "\n".join(lines)
         
@@ -1343,7 +1898,26 @@ Por enquanto, só começar a usar: "gastei 50 no supermercado" 😊
             "data": {"total": total, "transactions": transactions}
         }
     
-    def _find_category_with_llm(self, user_phone: str, category_input: str) -> Optional[Dict[str, Any]]:
+    def _get_user_categories(self, user_phone: str) -> List[Dict[str, Any]]:
+        """
+        Categorias do usuário, lidas do banco uma vez por requisição.
+        
+        Vários passos de uma mesma mensagem (atalho, matching, criação) precisam
+        da lista; o cache é descartado no início de process() e sempre que uma
+        categoria é criada ou removida.
+        """
+        categories = self._category_cache.get(user_phone)
+        if categories is None:
+            categories = SQLTool.get_user_categories(user_phone)
+            self._category_cache[user_phone] = categories
+        return categories
+    
+    def _find_category_with_llm(
+        self,
+        user_phone: str,
+        category_input: str,
+        all_categories: Optional[List[Dict[str, Any]]] = None
+    ) -> Optional[Dict[str, Any]]:
         """
         Usa LLM para encontrar a categoria mais próxima (matching inteligente).
         
@@ -1351,52 +1925,43 @@ Por enquanto, só começar a usar: "gastei 50 no supermercado" 😊
         - Erros de digitação (Alimentacao vs Alimentação)
         - Diferenças de acentuação
         - Variações de nome
-        """
-        # Primeiro tenta busca exata
-        category = SQLTool.get_category_by_name(user_phone, category_input)
-        if category:
-            return category
         
-        # Se não encontrou, busca todas as categorias do usuário
-        all_categories = SQLTool.get_user_categories(user_phone)
+        Args:
+            user_phone: ID do usuário
+            category_input: Nome digitado pelo usuário
+            all_categories: Categorias do usuário já carregadas (opcional). Quem
+                            passa a lista evita reler do cache/banco
+        """
+        if all_categories is None:
+            all_categories = self._get_user_categories(user_phone)
         if not all_categories:
             return None
         
-        # Se não tem LLM, retorna None
-        if not self.llm_client or not self.llm_client.model:
+        # Primeiro tenta busca exata; depois matching local (sem LLM), que
+        # resolve a grande maioria dos casos de digitação/acentuação
+        exact, closest, similarity = _closest_category(category_input, all_categories)
+        if exact:
+            return exact
+        if closest and similarity >= _LOCAL_CATEGORY_RATIO:
+            self.log("Categoria encontrada sem LLM: '%s' → '%s'", category_input, closest['category_name'])
+            return closest
+        
+        # Nenhuma categoria sequer parecida: o LLM responderia "NENHUMA"
+        if not closest or similarity < _AMBIGUOUS_CATEGORY_RATIO:
+            return None
+        
+        # Se não tem LLM (ou o nome é curto demais para um matching útil), retorna None
+        if not self.llm_client or not self.llm_client.model or len(category_input) < 3:
             return None
         
         # Usa LLM para encontrar a categoria mais próxima
         try:
             category_names = [cat["category_name"] for cat in all_categories]
             
-            prompt = f"""Você é um assistente que faz matching inteligente de categorias.
-
-**Categoria que o usuário digitou:** "{category_input}"
-
-**Categorias disponíveis:**
-{chr(10).join(f"- {name}" for name in category_names)}
-
-**Sua tarefa:** Encontre a categoria mais próxima da que o usuário digitou.
-
-**IMPORTANTE - Seja RESTRITIVO:**
-- Só retorne uma categoria se for REALMENTE a mesma (ex: "Alimentacao" → "Alimentação")
-- NÃO confunda categorias diferentes (ex: "bebidas alcoolicas" ≠ "Alimentação")
-- NÃO retorne categorias apenas por serem relacionadas (ex: "Pets" ≠ "Saúde")
-- Se a categoria digitada for claramente diferente, retorne "NENHUMA"
-
-Considere APENAS:
-- Erros de digitação (ex: "Alimentacao" → "Alimentação")
-- Diferenças de acentuação (ex: "Alimentação" = "Alimentacao")
-- Variações mínimas de nome (ex: "Alimentação" = "Alimentacao")
-
-NÃO considere:
-- Categorias relacionadas mas diferentes (ex: "bebidas" ≠ "Alimentação")
-- Categorias que compartilham palavras mas são diferentes (ex: "bebidas alcoolicas" ≠ "Alimentação")
-
-Retorne APENAS o nome exato da categoria mais próxima, ou "NENHUMA" se não houver correspondência EXATA ou muito próxima.
-
-Categoria mais próxima:"""
+            prompt = _CATEGORY_MATCH_PROMPT_TEMPLATE.format(
+                category_input=category_input,
+                category_list="\n".join(f"- {name}" for name in category_names)
+            )
             
             response_llm = self.llm_client.generate_content(prompt)
             matched_name = response_llm.text.strip()
@@ -1410,66 +1975,29 @@ Categoria mais próxima:"""
             # Busca a categoria encontrada pelo LLM
             for cat in all_categories:
                 if cat["category_name"].lower() == matched_name.lower():
-                    self.log(f"LLM encontrou categoria: '{category_input}' → '{cat['category_name']}'")
+                    self.log("LLM encontrou categoria: '%s' → '%s'", category_input, cat['category_name'])
                     return cat
             
             return None
             
         except Exception as e:
-            self.log(f"Erro no LLM de matching: {e}", "ERROR")
+            self.log("Erro no LLM de matching: %s", e, level="ERROR")
             return None
     
     def _parse_date(self, date_str: str) -> datetime:
         """
         Converte string de data em datetime.
         
-        Suporta múltiplos formatos:
-        - YYYY-MM-DD (ISO)
-        - DD/MM/YYYY
-        - DD-MM-YYYY
-        - DD/MM/YY (assume 20XX)
+        Suporta YYYY-MM-DD, DD/MM/YYYY, DD-MM-YYYY e DD/MM/YY (assume 20XX).
+        A conversão fica em _parse_user_date (memoizada).
         
-        Args:
-            date_str: String com data em qualquer formato
-            
-        Returns:
-            datetime objeto
-            
         Raises:
             ValueError: Se não conseguir parsear a data
         """
-        date_str = date_str.strip()
-        
-        # Tenta formato ISO primeiro (YYYY-MM-DD)
-        try:
-            return datetime.strptime(date_str, "%Y-%m-%d")
-        except ValueError:
-            pass
-        
-        # Tenta formato brasileiro (DD/MM/YYYY)
-        try:
-            return datetime.strptime(date_str, "%d/%m/%Y")
-        except ValueError:
-            pass
-        
-        # Tenta formato com hífen (DD-MM-YYYY)
-        try:
-            return datetime.strptime(date_str, "%d-%m-%Y")
-        except ValueError:
-            pass
-        
-        # Tenta formato curto (DD/MM/YY) - assume 20XX
-        try:
-            dt = datetime.strptime(date_str, "%d/%m/%y")
-            # Se ano for < 2000, assume 20XX
-            if dt.year < 2000:
-                dt = dt.replace(year=dt.year + 2000)
-            return dt
-        except ValueError:
-            pass
-        
-        # Se nenhum formato funcionou, lança erro
-        raise ValueError(f"Formato de data não reconhecido: {date_str}")
+        parsed = _parse_user_date(date_str.strip())
+        if parsed is None:
+            raise ValueError(f"Formato de data não reconhecido: {date_str}")
+        return parsed
     
     def query_by_date_range(self, user_phone: str, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
         """
@@ -1483,16 +2011,18 @@ Categoria mais próxima:"""
         Args:
             user_phone: ID do usuário
             start_date: Data inicial (inclusive)
-            end_date: Data final (inclusive, até 23:59:59)
+            end_date: Data final (inclusive - o dia inteiro entra na consulta)
             
         Returns:
             Dicionário com resposta formatada contendo total, resumo e lista
         """
-        # Garante que start_date começa no início do dia
+        # Trabalha com dias inteiros
         start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        end_date = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
         
-        # Garante que end_date termina no final do dia
-        end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
+        # O SQL usa o intervalo semiaberto [start_date, end_exclusive): a
+        # meia-noite do dia seguinte cobre o último dia inteiro sem 23:59:59.999999
+        end_exclusive = end_date + timedelta(days=1)
         
         # Validação: end_date deve ser >= start_date
         if end_date < start_date:
@@ -1501,39 +2031,26 @@ Categoria mais próxima:"""
                 "response": "❓ A data final deve ser posterior à data inicial. Verifique as datas informadas."
             }
         
-        # Busca total do período
-        total = SQLTool.get_total_by_period(user_phone, start_date, end_date)
-        
-        # Busca resumo por categoria
-        spending_data = SQLTool.get_spending_by_category(user_phone, start_date, end_date)
-        
-        # Busca lista de transações (limite de 50)
-        transactions = SQLTool.get_transactions(
-            user_phone,
-            category_id=None,
-            start_date=start_date,
-            end_date=end_date,
-            limit=50
-        )
+        # Total, resumo por categoria e lista de transações (limite de 50)
+        # em uma só ida ao banco
+        snapshot = SQLTool.get_period_snapshot(user_phone, start_date, end_exclusive, transactions_limit=50)
+        total = snapshot["total"]
+        spending_data = snapshot["by_category"]
+        transactions = snapshot["transactions"]
         
         # Formata período para exibição
         start_str = FormatterTool.format_date(start_date)
         end_str = FormatterTool.format_date(end_date)
         period_label = f"de {start_str} até {end_str}"
         
-        # Formata resposta
-        summary = FormatterTool.format_category_summary(spending_data)
-        transaction_list = FormatterTool.format_transaction_list(transactions)
-        
-        # Monta resposta completa
-        response_lines = [
-            f"📊 *Resumo de Gastos* ({period_label}):\n",
-            summary,
-            "\n",
-            transaction_list
-        ]
-        
-        response = "\n".join(response_lines)
+        # Monta a resposta completa em um único join: os pedaços do resumo e
+        # da lista entram direto, sem criar as strings intermediárias
+        response = "".join((
+            f"📊 *Resumo de Gastos* ({period_label}):\n\n",
+            *FormatterTool.format_category_summary_iter(spending_data),
+            "\n\n\n",
+            *FormatterTool.format_transaction_list_iter(transactions),
+        ))
         
         return {
             "success": True,
@@ -1,10 +1,38 @@
 """OutputAgent - Valida e modera respostas usando LLM."""
 
-from typing import Dict, Any
+from typing import Dict, Any, Tuple, Union
 import os
 from agents.base_agent import BaseAgent
 from config import GEMINI_MODEL, GEMINI_API_KEY, GOOGLE_CLOUD_PROJECT
 from llm_client import create_llm_client
+from tools import FormatterTool
+
+
+# Prompt da validação por LLM
+# Campos: intent, response
+_VALIDATION_PROMPT_TEMPLATE = """Você é um validador e moderador de respostas de chatbot financeiro.
+
+**Contexto:** {intent}
+
+**Resposta a validar:**
+"{response}"
+
+**Sua tarefa:**
+1. Se a resposta já está boa e formatada, retorne ela EXATAMENTE como está, sem mudanças
+2. Se precisa melhorar, faça APENAS ajustes mínimos:
+   - Adicione emojis apropriados se não tiver (✅ ❌ ⚠️ 💰 📊 🎉 📝)
+   - Corrija erros de formatação Markdown APENAS se houver problemas
+3. NUNCA altere números, valores ou informações importantes
+4. Mantenha o português brasileiro natural
+
+**IMPORTANTE:**
+- Se a resposta já está perfeita, retorne ela EXATAMENTE como está
+- Não invente informações novas
+- Mantenha números e valores exatos
+- Faça mudanças MÍNIMAS apenas se necessário
+- Retorne APENAS a resposta melhorada, SEM explicações ou comentários
+
+**Resposta melhorada:**"""
 
 
 class OutputAgent(BaseAgent):
@@ -27,15 +55,15 @@ class OutputAgent(BaseAgent):
                     project_id=GOOGLE_CLOUD_PROJECT
                 )
                 self.model = self.llm_client.model  # Compatibilidade com código existente
-                self.log(f"LLM configurado ({self.llm_client.client_type}, {GEMINI_MODEL}) para validação inteligente")
+                self.log("LLM configurado (%s, %s) para validação inteligente", self.llm_client.client_type, GEMINI_MODEL)
             except Exception as e:
                 self.llm_client = None
                 self.model = None
-                self.log(f"Erro ao configurar LLM: {e}. Usando fallback", "WARNING")
+                self.log("Erro ao configurar LLM: %s. Usando fallback", e, level="WARNING")
         else:
             self.llm_client = None
             self.model = None
-            self.log("LLM não configurado - usando fallback", "WARNING")
+            self.log("LLM não configurado - usando fallback", level="WARNING")
     
     def process(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -52,7 +80,9 @@ class OutputAgent(BaseAgent):
             data: {
                 "response": str (resposta a validar),
                 "intent": str (intenção detectada),
-                "user_phone": str (opcional)
+                "user_phone": str (opcional),
+                "skip_validation": bool (opcional - resposta montada só com
+                                   textos fixos pelo agente anterior; dispensa o LLM)
             }
             
         Returns:
@@ -62,12 +92,33 @@ class OutputAgent(BaseAgent):
                 "error": str (se houver)
             }
         """
+        prepared = self._prepare(data)
+        if isinstance(prepared, dict):
+            return prepared
+        
+        response, prompt = prepared
+        try:
+            # Usa LLMClient que funciona com ambas as APIs
+            result_text = self.llm_client.generate_content(prompt).text
+        except Exception as e:
+            # Inclui o ValueError do .text em respostas bloqueadas/sem candidato
+            return self._llm_failed(data, response, e)
+        return self._finish(data, response, result_text)
+    
+    def _prepare(self, data: Dict[str, Any]) -> Union[Dict[str, Any], Tuple[str, str]]:
+        """
+        Faz as checagens que não usam LLM.
+        
+        Returns:
+            O resultado final (dict) quando a resposta não precisa do LLM, ou
+            (resposta, prompt) para a validação por LLM
+        """
         response = data.get("response", "")
         intent = data.get("intent", "")
         
         # Validação básica de segurança (não usa LLM - rápido)
         if not response or len(response.strip()) == 0:
-            self.log("Resposta vazia detectada", "ERROR")
+            self.log("Resposta vazia detectada", level="ERROR")
             return {
                 **data,
                 "response": "Desculpe, não consegui gerar uma resposta.",
@@ -78,11 +129,11 @@ class OutputAgent(BaseAgent):
         # Trunca se muito longo (aumentado para permitir respostas mais detalhadas)
         if len(response) > 8000:
             response = response[:8000]
-            self.log("Resposta truncada para 8000 caracteres", "WARNING")
+            self.log("Resposta truncada para 8000 caracteres", level="WARNING")
         
-        # Se não tem LLM, retorna com validação básica
-        if not self.llm_client or not self.llm_client.model:
-            self.log("Usando fallback sem LLM")
+        # O agente anterior já marcou a resposta como pronta
+        if data.get("skip_validation"):
+            self.log("Resposta marcada como pronta, retornando sem validação")
             return {
                 **data,
                 "response": response,
@@ -90,75 +141,56 @@ class OutputAgent(BaseAgent):
                 "error": None
             }
         
-        # Usa LLM para validar e melhorar APENAS se necessário
-        # Verifica se a resposta já está bem formatada antes de modificar
-        try:
-            # Verifica se resposta já tem formatação adequada
-            has_emojis = any(emoji in response for emoji in ["✅", "❌", "⚠️", "💰", "📊", "🎉", "📝", "📋", "🔴", "🟡", "🟢"])
-            has_markdown = "*" in response or "_" in response or "`" in response
-            is_well_formatted = has_emojis and has_markdown and len(response) > 20
-            
-            # Se já está bem formatada, retorna sem modificar
-            if is_well_formatted:
-                self.log("Resposta já bem formatada, retornando sem modificação")
-                return {
-                    **data,
-                    "response": response,
-                    "valid": True,
-                    "error": None
-                }
-            
-            # Só modifica se realmente necessário
-            prompt = f"""Você é um validador e moderador de respostas de chatbot financeiro.
-
-**Contexto:** {intent}
-
-**Resposta a validar:**
-"{response}"
-
-**Sua tarefa:**
-1. Se a resposta já está boa e formatada, retorne ela EXATAMENTE como está, sem mudanças
-2. Se precisa melhorar, faça APENAS ajustes mínimos:
-   - Adicione emojis apropriados se não tiver (✅ ❌ ⚠️ 💰 📊 🎉 📝)
-   - Corrija erros de formatação Markdown APENAS se houver problemas
-3. NUNCA altere números, valores ou informações importantes
-4. Mantenha o português brasileiro natural
-
-**IMPORTANTE:**
-- Se a resposta já está perfeita, retorne ela EXATAMENTE como está
-- Não invente informações novas
-- Mantenha números e valores exatos
-- Faça mudanças MÍNIMAS apenas se necessário
-- Retorne APENAS a resposta melhorada, SEM explicações ou comentários
-
-**Resposta melhorada:**"""
-            
-            # Usa LLMClient que funciona com ambas as APIs
-            result = self.llm_client.generate_content(prompt)
-            improved_response = result.text.strip()
-            
-            # Se a resposta melhorada estiver vazia, usa a original
-            if not improved_response:
-                self.log("LLM retornou resposta vazia, usando original", "WARNING")
-                improved_response = response
-            
-            self.log("Resposta validada e melhorada com LLM (apenas se necessário)")
-            
+        # Se não tem LLM, retorna com validação básica
+        if not self.llm_client or not self.llm_client.model:
+            self.log("Usando fallback sem LLM")
             return {
                 **data,
-                "response": improved_response,
+                "response": response,
                 "valid": True,
                 "error": None
             }
         
-        except Exception as e:
-            self.log(f"Erro no LLM de validação: {e}", "ERROR")
-            # Fallback: retorna original sem modificação
-            # Isso garante que o usuário sempre recebe uma resposta
+        # Usa LLM para validar e melhorar APENAS se necessário
+        # Se já está bem formatada (emoji + Markdown), retorna sem modificar
+        if FormatterTool.is_well_formatted(response):
+            self.log("Resposta já bem formatada, retornando sem modificação")
             return {
                 **data,
-                "response": response if response else "Desculpe, não consegui processar sua solicitação.",
+                "response": response,
                 "valid": True,
-                "error": f"Erro no LLM: {str(e)}"
+                "error": None
             }
-
+        
+        # Só modifica se realmente necessário
+        return response, _VALIDATION_PROMPT_TEMPLATE.format(intent=intent, response=response)
+    
+    def _finish(self, data: Dict[str, Any], response: str, llm_text: str) -> Dict[str, Any]:
+        """Monta o resultado a partir do texto devolvido pelo LLM."""
+        improved_response = llm_text.strip()
+        
+        # Se a resposta melhorada estiver vazia, usa a original
+        if not improved_response:
+            self.log("LLM retornou resposta vazia, usando original", level="WARNING")
+            improved_response = response
+        
+        self.log("Resposta validada e melhorada com LLM (apenas se necessário)")
+        
+        return {
+            **data,
+            "response": improved_response,
+            "valid": True,
+            "error": None
+        }
+    
+    def _llm_failed(self, data: Dict[str, Any], response: str, error: Exception) -> Dict[str, Any]:
+        """Resultado quando a chamada ao LLM falha: devolve a resposta original."""
+        self.log("Erro no LLM de validação: %s", error, level="ERROR")
+        # Fallback: retorna original sem modificação
+        # Isso garante que o usuário sempre recebe uma resposta
+        return {
+            **data,
+            "response": response if response else "Desculpe, não consegui processar sua solicitação.",
+            "valid": True,
+            "error": f"Erro no LLM: {str(error)}"
+        }
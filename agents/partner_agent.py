@@ -29,6 +29,34 @@ from config import GEMINI_MODEL, GEMINI_API_KEY, GOOGLE_CLOUD_PROJECT
 from llm_client import create_llm_client
 
 
+# Padrões PERIGOSOS para validação básica
+# Simplificada - apenas SQL injection crítico (Telegram já sanitiza XSS)
+# Mantemos apenas padrões que realmente podem causar dano ao banco de dados
+_DANGEROUS_PATTERNS = (
+    r"DROP\s+TABLE",  # SQL injection - deletar tabela
+    r"DELETE\s+FROM\s+\w+\s*;",  # SQL injection - deletar dados (com ponto e vírgula)
+    r";\s*DROP",  # Comando SQL seguido de DROP
+)
+
+# Todos os padrões compilados uma vez em uma única alternância:
+# cada mensagem é varrida uma só vez, sem loop em Python nem consulta
+# ao cache interno do módulo re por padrão
+_DANGER_RE = re.compile(
+    "|".join(f"(?:{pattern})" for pattern in _DANGEROUS_PATTERNS),
+    re.IGNORECASE
+)
+
+# Palavras que todo padrão perigoso contém (em minúsculas). Mensagem
+# sem nenhuma delas não tem como casar com _DANGER_RE - ao incluir um
+# padrão novo, inclua aqui a palavra obrigatória dele
+_DANGER_KEYWORDS = ("drop", "delete")
+
+# Tamanho máximo da mensagem ANTES de remover espaços extras. Acima disso a
+# mensagem é recusada sem ser limpa (o limite de 2000 caracteres vale para
+# a mensagem já limpa; a folga cobre mensagens com muitos espaços)
+_MAX_RAW_MESSAGE_LENGTH = 8000
+
+
 class PartnerAgent(BaseAgent):
     """
     PartnerAgent - Gateway de segurança do sistema.
@@ -47,6 +75,10 @@ class PartnerAgent(BaseAgent):
     - Mensagens bloqueadas aparecem como WARNING nos logs
     """
     
+    # A validação é determinística (só regex), então mensagens repetidas
+    # podem reaproveitar o resultado (ver BaseAgent.cacheable)
+    cacheable = True
+    
     def __init__(self):
         """
         Inicializa o PartnerAgent com LLM Gemini para validação inteligente.
@@ -69,24 +101,15 @@ class PartnerAgent(BaseAgent):
                     project_id=GOOGLE_CLOUD_PROJECT
                 )
                 self.model = self.llm_client.model  # Compatibilidade com código existente
-                self.log(f"LLM configurado ({self.llm_client.client_type}, {GEMINI_MODEL}) para validação inteligente de segurança")
+                self.log("LLM configurado (%s, %s) para validação inteligente de segurança", self.llm_client.client_type, GEMINI_MODEL)
             except Exception as e:
                 self.llm_client = None
                 self.model = None
-                self.log(f"Erro ao configurar LLM: {e}. Usando validação básica com regex", "WARNING")
+                self.log("Erro ao configurar LLM: %s. Usando validação básica com regex", e, level="WARNING")
         else:
             self.llm_client = None
             self.model = None
-            self.log("LLM não configurado - usando validação básica com regex", "WARNING")
-        
-        # Lista de padrões PERIGOSOS para validação básica
-        # Simplificada - apenas SQL injection crítico (Telegram já sanitiza XSS)
-        # Mantemos apenas padrões que realmente podem causar dano ao banco de dados
-        self.dangerous_patterns = [
-            r"DROP\s+TABLE",  # SQL injection - deletar tabela
-            r"DELETE\s+FROM\s+\w+\s*;",  # SQL injection - deletar dados (com ponto e vírgula)
-            r";\s*DROP",  # Comando SQL seguido de DROP
-        ]
+            self.log("LLM não configurado - usando validação básica com regex", level="WARNING")
         
         self.log("PartnerAgent inicializado (gateway de segurança com LLM)")
     
@@ -123,7 +146,7 @@ class PartnerAgent(BaseAgent):
         if not is_valid:
             # Mensagem bloqueada por segurança
             # Loga como WARNING para facilitar identificação
-            self.log(f"Mensagem bloqueada: {result}", "WARNING")
+            self.log("Mensagem bloqueada: %s", result, level="WARNING")
             return {
                 "valid": False,
                 "cleaned_message": "",
@@ -131,7 +154,7 @@ class PartnerAgent(BaseAgent):
             }
         
         # Mensagem válida - loga preview para debug
-        self.log(f"Mensagem validada: '{result[:50]}...'")
+        self.log("Mensagem validada: '%s...'", result[:50])
         
         return {
             "valid": True,
@@ -168,13 +191,19 @@ class PartnerAgent(BaseAgent):
         - Logs mostram quando LLM é usado vs regex
         - Mensagens bloqueadas aparecem como WARNING
         """
-        # 1. Verifica se mensagem está vazia ou só tem espaços
-        if not message or not message.strip():
-            return (False, "Mensagem vazia")
+        # 0. Mensagem gigante é recusada antes de qualquer cópia (ver
+        # _MAX_RAW_MESSAGE_LENGTH)
+        if message and len(message) > _MAX_RAW_MESSAGE_LENGTH:
+            return (False, "Mensagem muito longa (máximo 2000 caracteres)")
         
-        # 2. Remove espaços extras e normaliza
-        # Exemplo: "gastei   50   reais" → "gastei 50 reais"
-        cleaned = " ".join(message.strip().split())
+        # 1. Remove espaços extras e normaliza em uma só passada: split() sem
+        # argumentos já descarta os espaços das pontas
+        # Exemplo: "  gastei   50   reais " → "gastei 50 reais"
+        cleaned = " ".join(message.split()) if message else ""
+        
+        # 2. Verifica se mensagem está vazia ou só tinha espaços
+        if not cleaned:
+            return (False, "Mensagem vazia")
         
         # 3. Verifica tamanho máximo (proteção contra spam/DoS)
         # Aumentado para 2000 caracteres para permitir mensagens mais longas e detalhadas
@@ -187,13 +216,19 @@ class PartnerAgent(BaseAgent):
         # O Telegram já sanitiza XSS, então não precisamos validar isso
         
         # 5. Fallback: Verifica padrões perigosos usando regex (se LLM não disponível)
-        # Itera sobre todos os padrões definidos em self.dangerous_patterns
-        for pattern in self.dangerous_patterns:
-            # Busca case-insensitive (ignora maiúsculas/minúsculas)
-            if re.search(pattern, cleaned, re.IGNORECASE):
-                # Padrão perigoso encontrado - bloqueia mensagem
-                self.log(f"Regex bloqueou mensagem (padrão: {pattern})", "WARNING")
-                return (False, "Mensagem contém conteúdo não permitido")
+        # Pré-filtro: a quase totalidade das mensagens não tem nenhuma palavra
+        # obrigatória dos padrões - um lower() e buscas de substring (em C)
+        # dispensam o regex
+        lowered = cleaned.lower()
+        if not any(keyword in lowered for keyword in _DANGER_KEYWORDS):
+            return (True, cleaned)
+        
+        # Uma busca case-insensitive com todos os padrões de _DANGEROUS_PATTERNS
+        match = _DANGER_RE.search(cleaned)
+        if match:
+            # Padrão perigoso encontrado - bloqueia mensagem
+            self.log("Regex bloqueou mensagem (trecho: %s)", match.group(0), level="WARNING")
+            return (False, "Mensagem contém conteúdo não permitido")
         
         # Mensagem passou em todas as validações
         return (True, cleaned)
@@ -19,11 +19,208 @@ Fluxo:
 
 import json
 import re
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple, Union
 from agents.base_agent import BaseAgent
 from config import GEMINI_API_KEY, GEMINI_MODEL, GOOGLE_CLOUD_PROJECT
-from llm_client import create_llm_client
+from llm_client import create_llm_client, extract_json_text, json_loads
 from database import get_connection
+from tools import FormatterTool, TTLCache
+
+
+# Mensagens óbvias roteadas sem LLM: (regex sobre a mensagem normalizada por
+# FormatterTool.normalize_text, intenção). A primeira que casar vence. Os
+# padrões são ancorados nas duas pontas para não capturar frases maiores
+# ("remover limite de Lazer", "oi, gastei 50") - essas seguem para o LLM.
+_ROUTE_TABLE = (
+    (re.compile(r"^(?:oi|ola|opa|e ai|eai|bom dia|boa tarde|boa noite|ajuda|help|como funciona)(?:,? jarvis)?$"), "ajuda"),
+    (re.compile(r"^(?:(?:ver|mostrar|me mostre|quais sao) )?(?:(?:os|meus|os meus) )?limites$"), "consulta_limites"),
+    (re.compile(r"^(?:(?:listar|ver|mostrar|me mostre|quais sao) )?(?:(?:as|minhas|as minhas) )?categorias$"), "listar_categorias"),
+)
+
+# Palavras-chave de setup do roteamento básico (_route_basic), em uma única
+# alternância case-insensitive: a mensagem é varrida uma vez, sem lower()
+_SETUP_KEYWORDS_RE = re.compile(r"cadastrar|configurar|setup|começar|iniciar", re.IGNORECASE)
+
+# Confiança das rotas da _ROUTE_TABLE (acima do mínimo que o FinanceAgent
+# exige para executar a intenção direto, sem o próprio LLM)
+_TABLE_ROUTE_CONFIDENCE = 0.95
+
+
+# Prompt do roteamento por LLM, em duas partes: só o começo tem campos
+# (message, name, setup_complete) e passa por str.format; o resto é fixo e
+# só é concatenado, sem ser reinterpretado a cada mensagem
+_ROUTER_PROMPT_HEAD = """Você é um roteador inteligente que analisa mensagens e decide qual agente deve processar.
+
+**Mensagem do usuário:** "{message}"
+
+**Contexto do usuário:**
+- Nome: {name}
+- Setup completo: {setup_complete}
+
+"""
+
+_ROUTER_PROMPT_BODY = """**Sua tarefa:**
+1. Identifique a intenção principal:
+   - REGISTRO: registrar gasto (ex: "gastei 50 reais", "paguei 30")
+   - CONSULTA: ver gastos (ex: "quanto gastei?", "resumo")
+   - CONSULTA_LIMITES: ver limites (ex: "meus limites", "limites")
+   - LISTAR_CATEGORIAS: listar todas as categorias (ex: "me mostre minhas categorias", "quais são minhas categorias?", "listar categorias")
+   - ADICIONAR_CATEGORIA: criar categoria (ex: "adicionar categoria Pets")
+   - SETUP: configurar sistema (ex: "quero me cadastrar", "configurar")
+   - AJUDA: ajuda/informação (ex: "oi", "como funciona?")
+   - FORA_ESCOPO: não relacionado a finanças (ex: "qual o tamanho do brasil")
+
+2. Identifique AMBIGUIDADES (seja flexível):
+   - Apenas ambiguidades CRÍTICAS que realmente impedem processamento
+   - Permita suposições razoáveis (ex: "50" = R$ 50,00, não R$ 0,50)
+   - Use contexto para inferir informações faltantes quando possível
+   - Só peça esclarecimento se realmente não conseguir processar
+
+3. Decida a ROTA:
+   - "setup": se intenção é SETUP ou usuário não completou setup
+   - "finance": se intenção é REGISTRO, CONSULTA, CONSULTA_LIMITES, LISTAR_CATEGORIAS, ADICIONAR_CATEGORIA, AJUDA
+   - "clarification": APENAS se houver ambiguidade CRÍTICA que realmente impede processamento
+
+4. Se houver ambiguidade CRÍTICA, identifique:
+   - O que está faltando ou ambíguo
+   - Qual informação precisa ser esclarecida
+   - Qual agente deve fazer o esclarecimento (finance ou setup)
+
+**IMPORTANTE:**
+- Seja FLEXÍVEL: permita suposições razoáveis baseadas em contexto
+- Confie no LLM para inferir informações quando possível
+- Só use route="clarification" para ambiguidades REALMENTE críticas
+- Prefira processar com suposições razoáveis do que pedir esclarecimento
+- Retorne JSON válido
+
+**Formato de resposta:**
+{
+  "intent": "registro|consulta|consulta_limites|listar_categorias|adicionar_categoria|setup|ajuda|fora_escopo",
+  "route": "finance|setup|clarification",
+  "confidence": 0.0-1.0,
+  "needs_clarification": true|false,
+  "ambiguity_cases": ["descrição da ambiguidade 1", "descrição da ambiguidade 2"],
+  "clarification_context": {
+    "missing_info": "o que está faltando",
+    "ambiguous_field": "campo ambíguo",
+    "target_agent": "finance|setup",
+    "suggestion": "sugestão de pergunta para esclarecimento"
+  }
+}
+
+**Exemplos:**
+
+Mensagem: "gastei 50"
+{
+  "intent": "registro",
+  "route": "clarification",
+  "confidence": 0.9,
+  "needs_clarification": true,
+  "ambiguity_cases": ["Categoria não especificada"],
+  "clarification_context": {
+    "missing_info": "categoria",
+    "ambiguous_field": "categoria",
+    "target_agent": "finance",
+    "suggestion": "Em qual categoria devo registrar? (ex: Alimentação, Transporte)"
+  }
+}
+
+Mensagem: "gastei 50 reais no mercado"
+{
+  "intent": "registro",
+  "route": "finance",
+  "confidence": 0.95,
+  "needs_clarification": false,
+  "ambiguity_cases": [],
+  "clarification_context": null
+}
+
+Mensagem: "quanto gastei?"
+{
+  "intent": "consulta",
+  "route": "finance",
+  "confidence": 0.9,
+  "needs_clarification": false,
+  "ambiguity_cases": [],
+  "clarification_context": null
+}
+
+Mensagem: "paguei"
+{
+  "intent": "registro",
+  "route": "finance",
+  "confidence": 0.7,
+  "needs_clarification": false,
+  "ambiguity_cases": [],
+  "clarification_context": null
+}
+Nota: Deixe o FinanceAgent lidar com a ambiguidade - ele pode pedir esclarecimento se necessário, mas tente processar primeiro.
+
+JSON:"""
+
+# Consulta do contexto do usuário (RouterAgent.get_user_context). A conexão
+# da thread é reaproveitada (get_connection) e o sqlite3 guarda o comando já
+# compilado no cache de statements da conexão, chaveado por este texto
+_USER_CONTEXT_QUERY = "SELECT user_name, setup_step FROM users WHERE user_phone = ?"
+
+# Saída estruturada do Gemini para o roteamento: o modelo devolve JSON puro
+# (sem bloco ```json) no formato de _ROUTER_RESPONSE_SCHEMA
+_ROUTER_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "intent": {
+            "type": "STRING",
+            "enum": [
+                "registro", "consulta", "consulta_limites", "listar_categorias",
+                "adicionar_categoria", "setup", "ajuda", "fora_escopo",
+            ],
+        },
+        "route": {"type": "STRING", "enum": ["finance", "setup", "clarification"]},
+        "confidence": {"type": "NUMBER"},
+        "needs_clarification": {"type": "BOOLEAN"},
+        "ambiguity_cases": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "clarification_context": {
+            "type": "OBJECT",
+            "nullable": True,
+            "properties": {
+                "missing_info": {"type": "STRING"},
+                "ambiguous_field": {"type": "STRING"},
+                "target_agent": {"type": "STRING", "enum": ["finance", "setup"]},
+                "suggestion": {"type": "STRING"},
+            },
+        },
+    },
+    "required": ["intent", "route", "confidence", "needs_clarification"],
+}
+
+# O google-generativeai==0.3.2 fixado no pyproject não conhece
+# response_mime_type/response_schema: lá a primeira chamada falha ao montar o
+# GenerationConfig e o roteamento passa a usar texto livre (ver
+# _generate_route_text). Com SDK mais novo ou Vertex AI, o schema é usado.
+_ROUTER_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": _ROUTER_RESPONSE_SCHEMA,
+}
+
+# Trechos das mensagens de erro de SDK/modelo que não aceitam saída estruturada
+# (ex: proto-plus: "Unknown field for GenerationConfig: response_mime_type")
+_STRUCTURED_OUTPUT_ERROR_HINTS = ("response_mime_type", "response_schema", "generationconfig", "unknown field")
+
+
+def _structured_output_unsupported(error: Exception) -> bool:
+    """
+    True se o erro mostra que o SDK/modelo não aceita _ROUTER_GENERATION_CONFIG.
+    
+    TypeError (argumento/campo desconhecido) e InvalidArgument da API (400)
+    contam; ValueError só quando a mensagem cita o GenerationConfig. Timeout,
+    cota (429), erro 5xx e resposta bloqueada não contam.
+    """
+    if isinstance(error, TypeError) or type(error).__name__ == "InvalidArgument":
+        return True
+    if isinstance(error, ValueError):
+        text = str(error).lower()
+        return any(hint in text for hint in _STRUCTURED_OUTPUT_ERROR_HINTS)
+    return False
 
 
 class RouterAgent(BaseAgent):
@@ -34,6 +231,10 @@ class RouterAgent(BaseAgent):
     identificando ambiguidades que precisam de esclarecimento.
     """
     
+    # Contexto do usuário por user_phone (ver get_user_context). Atributo de
+    # classe para que SetupAgent e o workflow possam invalidá-lo
+    _context_cache = TTLCache(maxsize=4096, ttl=30)
+    
     def __init__(self):
         """
         Inicializa o RouterAgent com LLM Gemini.
@@ -51,15 +252,26 @@ class RouterAgent(BaseAgent):
                     project_id=GOOGLE_CLOUD_PROJECT
                 )
                 self.model = self.llm_client.model
-                self.log(f"LLM configurado ({self.llm_client.client_type}, {GEMINI_MODEL}) para roteamento inteligente")
+                self.log("LLM configurado (%s, %s) para roteamento inteligente", self.llm_client.client_type, GEMINI_MODEL)
             except Exception as e:
                 self.llm_client = None
                 self.model = None
-                self.log(f"Erro ao configurar LLM: {e}. Roteamento limitado", "ERROR")
+                self.log("Erro ao configurar LLM: %s. Roteamento limitado", e, level="ERROR")
         else:
             self.llm_client = None
             self.model = None
-            self.log("LLM não configurado - roteamento limitado", "WARNING")
+            self.log("LLM não configurado - roteamento limitado", level="WARNING")
+        
+        # Cache das rotas decididas pelo LLM
+        # Chave: (mensagem normalizada, setup completo) -> resultado do roteamento
+        # Usuários repetem as mesmas frases ("oi", "quanto gastei?", "meus
+        # limites"): a mesma mensagem recebe a mesma rota sem nova chamada.
+        # Grande o bastante para guardar as frases repetidas de todos os usuários
+        self._route_cache = TTLCache(maxsize=8192, ttl=600)
+        
+        # Pede JSON estruturado ao LLM (response_schema); desligado na primeira
+        # vez que o SDK/modelo recusar (ver _generate_route_text)
+        self._structured_output = True
     
     def process(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -95,13 +307,31 @@ class RouterAgent(BaseAgent):
                 - clarification_context: Contexto do que precisa ser esclarecido
                 - ambiguity_cases: Lista de ambiguidades detectadas
         """
-        user_phone = state.get("user_phone")
+        early_route = self._route_without_llm(state)
+        if early_route is not None:
+            return early_route
+        
+        # Busca contexto do usuário
+        user_context = self.get_user_context(state.get("user_phone"))
+        
+        # Usa LLM para análise inteligente
+        return self._route_with_llm(
+            state.get("message", ""), user_context, state.get("normalized_message")
+        )
+    
+    def _route_without_llm(self, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Rotas decididas só pelo estado: setup em andamento ou LLM indisponível.
+        
+        Returns:
+            A rota, ou None se a mensagem precisa ser analisada pelo LLM
+        """
         message = state.get("message", "")
         setup_step = state.get("setup_step")
         
         # Se está em setup, roteia direto para SetupAgent
         if setup_step:
-            self.log(f"Setup em andamento ({setup_step}) - roteando para SetupAgent")
+            self.log("Setup em andamento (%s) - roteando para SetupAgent", setup_step)
             return {
                 "route": "setup",
                 "intent": "setup",
@@ -115,48 +345,63 @@ class RouterAgent(BaseAgent):
         if not self.llm_client or not self.llm_client.model:
             return self._route_basic(message)
         
-        # Busca contexto do usuário
-        user_context = self._get_user_context(user_phone)
-        
-        # Usa LLM para análise inteligente
-        return self._route_with_llm(message, user_context)
+        return None
     
-    def _get_user_context(self, user_phone: str) -> Dict[str, Any]:
+    def get_user_context(self, user_phone: str) -> Dict[str, Any]:
         """
         Busca contexto do usuário no banco de dados.
         
+        O resultado fica em _context_cache por 30 segundos: numa sequência de
+        mensagens do mesmo usuário, nome e etapa de setup não mudam. Quem
+        altera esses campos chama invalidate_user_context().
+        
         Returns:
             Dicionário com informações do usuário
         """
+        context = RouterAgent._context_cache.get(user_phone)
+        if context is not None:
+            return context
+        
         try:
             with get_connection() as conn:
-                user = conn.execute(
-                    "SELECT user_name, setup_step FROM users WHERE user_phone = ?",
-                    (user_phone,)
-                ).fetchone()
-                
-                if user:
-                    return {
-                        "exists": True,
-                        "name": user["user_name"],
-                        "setup_step": user["setup_step"],
-                        "setup_complete": user["setup_step"] is None
-                    }
-                else:
-                    return {
-                        "exists": False,
-                        "name": None,
-                        "setup_step": None,
-                        "setup_complete": False
-                    }
+                user = conn.execute(_USER_CONTEXT_QUERY, (user_phone,)).fetchone()
         except Exception as e:
-            self.log(f"Erro ao buscar contexto do usuário: {e}", "ERROR")
+            # Erro não entra no cache: a próxima mensagem tenta de novo
+            self.log("Erro ao buscar contexto do usuário: %s", e, level="ERROR")
+            return {
+                "exists": False,
+                "name": None,
+                "setup_step": None,
+                "setup_complete": False
+            }
+        
+        if not user:
+            # Usuário ainda não existe (vai ser criado nesta mensagem): não
+            # entra no cache
             return {
                 "exists": False,
                 "name": None,
                 "setup_step": None,
                 "setup_complete": False
             }
+        
+        context = {
+            "exists": True,
+            "name": user["user_name"],
+            "setup_step": user["setup_step"],
+            "setup_complete": user["setup_step"] is None
+        }
+        RouterAgent._context_cache.set(user_phone, context)
+        return context
+    
+    @staticmethod
+    def invalidate_user_context(user_phone: str) -> None:
+        """
+        Descarta o contexto em cache de um usuário.
+        
+        Chamado ao criar o usuário e ao mudar user_name ou setup_step.
+        """
+        RouterAgent._context_cache.pop(user_phone)
     
     def _route_basic(self, message: str) -> Dict[str, Any]:
         """
@@ -164,11 +409,8 @@ class RouterAgent(BaseAgent):
         
         Usa heurísticas simples quando LLM não está disponível.
         """
-        msg_lower = message.lower().strip()
-        
-        # Palavras-chave para setup
-        setup_keywords = ["cadastrar", "configurar", "setup", "começar", "iniciar"]
-        if any(keyword in msg_lower for keyword in setup_keywords):
+        # Palavras-chave para setup (uma busca só, ver _SETUP_KEYWORDS_RE)
+        if _SETUP_KEYWORDS_RE.search(message):
             return {
                 "route": "setup",
                 "intent": "setup",
@@ -188,7 +430,12 @@ class RouterAgent(BaseAgent):
             "ambiguity_cases": []
         }
     
-    def _route_with_llm(self, message: str, user_context: Dict[str, Any]) -> Dict[str, Any]:
+    def _route_with_llm(
+        self,
+        message: str,
+        user_context: Dict[str, Any],
+        normalized_message: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
         Roteamento inteligente usando LLM.
         
@@ -197,6 +444,65 @@ class RouterAgent(BaseAgent):
         - Ambiguidades
         - Rota apropriada
         """
+        prepared = self._prepare_llm_route(message, user_context, normalized_message)
+        if isinstance(prepared, dict):
+            return prepared
+        
+        prompt, cache_key = prepared
+        try:
+            # Chama LLM
+            response_text = self._generate_route_text(prompt)
+        except Exception as e:
+            self.log("Erro ao rotear com LLM: %s", e, level="ERROR")
+            # Fallback para roteamento básico
+            return self._route_basic(message)
+        
+        return self._parse_llm_route(message, response_text, cache_key)
+    
+    def _generate_route_text(self, prompt: str) -> str:
+        """
+        Chama o LLM de roteamento pedindo saída estruturada (JSON puro).
+        
+        Usa LLMClient.generate_json_text: a resposta vem em streaming e a
+        leitura para assim que o objeto JSON fecha.
+        
+        Se a chamada com _ROUTER_GENERATION_CONFIG falhar com um erro que
+        mostra que o SDK/modelo não suporta saída estruturada
+        (_structured_output_unsupported), ela é desligada para as próximas
+        chamadas e esta é refeita sem o config (a resposta em texto livre
+        continua sendo entendida por _parse_llm_route). Qualquer outro erro
+        (timeout, cota, 5xx) sobe sem nova chamada e sem desligar nada.
+        """
+        if self._structured_output:
+            try:
+                return self.llm_client.generate_json_text(
+                    prompt, generation_config=_ROUTER_GENERATION_CONFIG
+                )
+            except Exception as e:
+                if not _structured_output_unsupported(e):
+                    raise
+                self._disable_structured_output(e)
+        
+        return self.llm_client.generate_json_text(prompt)
+    
+    def _disable_structured_output(self, error: Exception) -> None:
+        """Passa a chamar o LLM de roteamento sem saída estruturada."""
+        self._structured_output = False
+        self.log("Saída estruturada indisponível (%s) - usando resposta em texto", error, level="WARNING")
+    
+    def _prepare_llm_route(
+        self,
+        message: str,
+        user_context: Dict[str, Any],
+        normalized_message: Optional[str] = None
+    ) -> Union[Dict[str, Any], Tuple[str, tuple]]:
+        """
+        Resolve o que dá para resolver sem chamar o LLM.
+        
+        Returns:
+            A rota pronta (dict) quando o LLM não é necessário, ou
+            (prompt, chave do cache) para a chamada ao LLM
+        """
         # Se usuário não existe, é setup
         if not user_context.get("exists"):
             return {
@@ -208,137 +514,54 @@ class RouterAgent(BaseAgent):
                 "ambiguity_cases": []
             }
         
+        # Normalizada pelo partner_node quando vem do workflow
+        if normalized_message is None:
+            normalized_message = FormatterTool.normalize_text(message)
+        # Com setup pendente o LLM decide (pode mandar para o SetupAgent)
+        table = _ROUTE_TABLE if user_context.get("setup_complete") else ()
+        for pattern, intent in table:
+            if pattern.match(normalized_message):
+                self.log("Rota detectada sem LLM: finance (intent: %s)", intent)
+                return {
+                    "route": "finance",
+                    "intent": intent,
+                    "confidence": _TABLE_ROUTE_CONFIDENCE,
+                    "needs_clarification": False,
+                    "clarification_context": None,
+                    "ambiguity_cases": []
+                }
+        
+        cache_key = (normalized_message, bool(user_context.get("setup_complete")))
+        cached_route = self._route_cache.get(cache_key)
+        if cached_route is not None:
+            self.log("Rota reaproveitada do cache: %s (intent: %s)", cached_route["route"], cached_route["intent"])
+            return dict(cached_route)
+        
         # Cria prompt para o LLM
-        prompt = f"""Você é um roteador inteligente que analisa mensagens e decide qual agente deve processar.
-
-**Mensagem do usuário:** "{message}"
-
-**Contexto do usuário:**
-- Nome: {user_context.get('name', 'Não informado')}
-- Setup completo: {user_context.get('setup_complete', False)}
-
-**Sua tarefa:**
-1. Identifique a intenção principal:
-   - REGISTRO: registrar gasto (ex: "gastei 50 reais", "paguei 30")
-   - CONSULTA: ver gastos (ex: "quanto gastei?", "resumo")
-   - CONSULTA_LIMITES: ver limites (ex: "meus limites", "limites")
-   - LISTAR_CATEGORIAS: listar todas as categorias (ex: "me mostre minhas categorias", "quais são minhas categorias?", "listar categorias")
-   - ADICIONAR_CATEGORIA: criar categoria (ex: "adicionar categoria Pets")
-   - SETUP: configurar sistema (ex: "quero me cadastrar", "configurar")
-   - AJUDA: ajuda/informação (ex: "oi", "como funciona?")
-   - FORA_ESCOPO: não relacionado a finanças (ex: "qual o tamanho do brasil")
-
-2. Identifique AMBIGUIDADES (seja flexível):
-   - Apenas ambiguidades CRÍTICAS que realmente impedem processamento
-   - Permita suposições razoáveis (ex: "50" = R$ 50,00, não R$ 0,50)
-   - Use contexto para inferir informações faltantes quando possível
-   - Só peça esclarecimento se realmente não conseguir processar
-
-3. Decida a ROTA:
-   - "setup": se intenção é SETUP ou usuário não completou setup
-   - "finance": se intenção é REGISTRO, CONSULTA, CONSULTA_LIMITES, LISTAR_CATEGORIAS, ADICIONAR_CATEGORIA, AJUDA
-   - "clarification": APENAS se houver ambiguidade CRÍTICA que realmente impede processamento
-
-4. Se houver ambiguidade CRÍTICA, identifique:
-   - O que está faltando ou ambíguo
-   - Qual informação precisa ser esclarecida
-   - Qual agente deve fazer o esclarecimento (finance ou setup)
-
-**IMPORTANTE:**
-- Seja FLEXÍVEL: permita suposições razoáveis baseadas em contexto
-- Confie no LLM para inferir informações quando possível
-- Só use route="clarification" para ambiguidades REALMENTE críticas
-- Prefira processar com suposições razoáveis do que pedir esclarecimento
-- Retorne JSON válido
-
-**Formato de resposta:**
-```json
-{{
-  "intent": "registro|consulta|consulta_limites|listar_categorias|adicionar_categoria|setup|ajuda|fora_escopo",
-  "route": "finance|setup|clarification",
-  "confidence": 0.0-1.0,
-  "needs_clarification": true|false,
-  "ambiguity_cases": ["descrição da ambiguidade 1", "descrição da ambiguidade 2"],
-  "clarification_context": {{
-    "missing_info": "o que está faltando",
-    "ambiguous_field": "campo ambíguo",
-    "target_agent": "finance|setup",
-    "suggestion": "sugestão de pergunta para esclarecimento"
-  }}
-}}
-```
-
-**Exemplos:**
-
-Mensagem: "gastei 50"
-{{
-  "intent": "registro",
-  "route": "clarification",
-  "confidence": 0.9,
-  "needs_clarification": true,
-  "ambiguity_cases": ["Categoria não especificada"],
-  "clarification_context": {{
-    "missing_info": "categoria",
-    "ambiguous_field": "categoria",
-    "target_agent": "finance",
-    "suggestion": "Em qual categoria devo registrar? (ex: Alimentação, Transporte)"
-  }}
-}}
-
-Mensagem: "gastei 50 reais no mercado"
-{{
-  "intent": "registro",
-  "route": "finance",
-  "confidence": 0.95,
-  "needs_clarification": false,
-  "ambiguity_cases": [],
-  "clarification_context": null
-}}
-
-Mensagem: "quanto gastei?"
-{{
-  "intent": "consulta",
-  "route": "finance",
-  "confidence": 0.9,
-  "needs_clarification": false,
-  "ambiguity_cases": [],
-  "clarification_context": null
-}}
-
-Mensagem: "paguei"
-{{
-  "intent": "registro",
-  "route": "finance",
-  "confidence": 0.7,
-  "needs_clarification": false,
-  "ambiguity_cases": [],
-  "clarification_context": null
-}}
-Nota: Deixe o FinanceAgent lidar com a ambiguidade - ele pode pedir esclarecimento se necessário, mas tente processar primeiro.
-
-JSON:"""
+        return _ROUTER_PROMPT_HEAD.format(
+            message=message,
+            name=user_context.get('name', 'Não informado'),
+            setup_complete=user_context.get('setup_complete', False)
+        ) + _ROUTER_PROMPT_BODY, cache_key
+    
+    def _parse_llm_route(self, message: str, response_text: str, cache_key: tuple) -> Dict[str, Any]:
+        """
+        Interpreta a resposta do LLM de roteamento e guarda a rota no cache.
         
+        Em caso de JSON inválido (ou campos com tipo errado), usa o
+        roteamento básico.
+        """
         try:
-            # Chama LLM
-            response = self.llm_client.generate_content(prompt)
-            response_text = response.text.strip()
-            
-            # Extrai JSON
-            json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group(1)
-            else:
-                json_text = response_text
-            
-            # Faz parse
-            result = json.loads(json_text)
-            
-            self.log(f"Rota detectada: {result.get('route')} (intent: {result.get('intent')}, confidence: {result.get('confidence')})")
+            result = json_loads(extract_json_text(response_text))
             
+            log_entries = [
+                ("INFO", "Rota detectada: %s (intent: %s, confidence: %s)", result.get('route'), result.get('intent'), result.get('confidence')),
+            ]
             if result.get("needs_clarification"):
-                self.log(f"Ambiguidade detectada: {result.get('ambiguity_cases')}")
+                log_entries.append(("INFO", "Ambiguidade detectada: %s", result.get('ambiguity_cases')))
+            self.log_many(log_entries)
             
-            return {
+            route = {
                 "route": result.get("route", "finance"),
                 "intent": result.get("intent", "process"),
                 "confidence": float(result.get("confidence", 0.5)),
@@ -346,15 +569,20 @@ JSON:"""
                 "clarification_context": result.get("clarification_context"),
                 "ambiguity_cases": result.get("ambiguity_cases", [])
             }
+            # Só guarda rotas vindas do LLM (fallbacks de erro não entram)
+            self._route_cache.set(cache_key, route)
+            return dict(route)
         
         except json.JSONDecodeError as e:
-            self.log(f"Erro ao fazer parse do JSON do LLM: {e}", "ERROR")
-            self.log(f"Resposta do LLM: {response_text[:200]}", "ERROR")
+            self.log_many([
+                ("ERROR", "Erro ao fazer parse do JSON do LLM: %s", e),
+                ("ERROR", "Resposta do LLM: %s", response_text[:200]),
+            ])
             # Fallback para roteamento básico
             return self._route_basic(message)
         
         except Exception as e:
-            self.log(f"Erro ao rotear com LLM: {e}", "ERROR")
+            self.log("Erro ao rotear com LLM: %s", e, level="ERROR")
             # Fallback para roteamento básico
             return self._route_basic(message)
 
@@ -1,13 +1,127 @@
 """SetupAgent - Agente responsável por configuração inicial usando LLM."""
 
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple, Union
+from datetime import timedelta
+import hashlib
 import os
+import re
 import json
 from agents.base_agent import BaseAgent
-from tools import SQLTool
+from agents.router_agent import RouterAgent
+from tools import SQLTool, FormatterTool, TTLCache
 from database import get_connection
 from config import GEMINI_MODEL, GEMINI_API_KEY, GOOGLE_CLOUD_PROJECT
-from llm_client import create_llm_client
+from llm_client import create_llm_client, json_loads
+
+
+# ============================================================================
+# PROMPTS DO SETUP
+# ============================================================================
+
+# Resposta sobre categorias personalizadas (handle_categories). Campos: message
+_CATEGORIES_PROMPT_TEMPLATE = """Você é um assistente que interpreta respostas sobre categorias financeiras.
+
+Mensagem do usuário: "{message}"
+
+Contexto: O usuário acabou de receber as categorias padrão e foi perguntado se quer adicionar categorias personalizadas.
+
+**Sua tarefa:** Interprete a intenção e retorne JSON:
+
+{{
+  "action": "add_category" | "finish" | "other",
+  "category_name": "NomeDaCategoria" (apenas se action="add_category"),
+  "response": "resposta ao usuário" (apenas se action="other")
+}}
+
+Exemplos:
+- "Pets" → {{"action": "add_category", "category_name": "Pets"}}
+- "Quero adicionar Academia" → {{"action": "add_category", "category_name": "Academia"}}
+- "não" ou "pronto" ou "continuar" → {{"action": "finish"}}
+- "o que são categorias?" → {{"action": "other", "response": "Categorias são grupos onde seus gastos são organizados. Ex: Alimentação, Transporte, etc."}}
+
+**IMPORTANTE - Tratamento de Ambiguidade:**
+- Se o nome da categoria não estiver claro (ex: "sim" pode ser nome ou confirmação), use action="other" e pergunte
+- Se a resposta estiver ambígua (ex: "talvez"), use action="other" e pergunte se quer adicionar ou não
+- Se TUDO estiver claro, use action="add_category" ou action="finish"
+- Retorne APENAS JSON válido
+- category_name com primeira letra maiúscula
+- Se for pergunta ou dúvida, use action="other" e responda de forma amigável
+
+JSON:"""
+
+# Resposta sobre limites de gasto (handle_limits). Campos: message
+_LIMITS_PROMPT_TEMPLATE = """Você é um assistente que interpreta respostas sobre limites de gasto.
+
+Mensagem do usuário: "{message}"
+
+Contexto: O usuário foi perguntado se quer definir limites de gasto por categoria.
+
+**Sua tarefa:** Interprete a intenção e retorne JSON:
+
+{{
+  "action": "add_limit" | "finish" | "other",
+  "category_name": "NomeDaCategoria" (apenas se action="add_limit"),
+  "limit_value": número (apenas se action="add_limit"),
+  "response": "resposta ao usuário" (apenas se action="other")
+}}
+
+Exemplos:
+- "Alimentação 2000" → {{"action": "add_limit", "category_name": "Alimentação", "limit_value": 2000}}
+- "Transporte 500" → {{"action": "add_limit", "category_name": "Transporte", "limit_value": 500}}
+- "não" ou "pular" → {{"action": "finish"}}
+- "o que são limites?" → {{"action": "other", "response": "Limites são valores máximos que você quer gastar por categoria no mês. Ex: Alimentação 2000 = máximo R$ 2000/mês em alimentação."}}
+
+**IMPORTANTE - Tratamento de Ambiguidade:**
+- Se o valor estiver ausente ou ambíguo (ex: "Alimentação" sem valor), use action="other" e pergunte o valor
+- Se a categoria estiver ausente ou ambígua (ex: "2000" sem categoria), use action="other" e pergunte a categoria
+- Se o valor estiver ambíguo (ex: "50" pode ser R$ 50 ou R$ 0,50), use action="other" e pergunte
+- Se TUDO estiver claro, use action="add_limit"
+- Retorne APENAS JSON válido
+- category_name com primeira letra maiúscula
+- limit_value deve ser um número
+- Se for pergunta, use action="other" e responda
+
+JSON:"""
+
+# Matching de categoria (_find_category_with_llm). Campos: category_input, category_list
+_CATEGORY_MATCH_PROMPT_TEMPLATE = """Você é um assistente que faz matching inteligente de categorias.
+
+**Categoria que o usuário digitou:** "{category_input}"
+
+**Categorias disponíveis:**
+{category_list}
+
+**Sua tarefa:** Encontre a categoria mais próxima da que o usuário digitou.
+
+Considere:
+- Erros de digitação (ex: "Alimentacao" → "Alimentação")
+- Diferenças de acentuação
+- Variações de nome
+- Similaridade fonética
+
+Retorne APENAS o nome exato da categoria mais próxima, ou "NENHUMA" se não houver correspondência razoável.
+
+Categoria mais próxima:"""
+
+# Bloco ```json ... ``` na resposta do LLM
+_JSON_BLOCK_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+
+# Validade das respostas do LLM guardadas na tabela llm_cache (etapas de
+# categorias e limites)
+_SETUP_REPLY_TTL = timedelta(days=7)
+
+
+def _setup_reply_key(step: str, message: str) -> str:
+    """
+    Chave da resposta do LLM para uma mensagem em uma etapa do setup.
+    
+    A mensagem entra normalizada (FormatterTool.normalize_text: minúsculas,
+    sem acentos, espaços colapsados e sem pontuação final), para que
+    "Não", "nao!" e "NÃO " caiam na mesma entrada. O modelo faz parte da
+    chave: trocar GEMINI_MODEL não reaproveita respostas de outro modelo.
+    """
+    normalized = FormatterTool.normalize_text(message)
+    return hashlib.sha256(f"{GEMINI_MODEL}:{step}:{normalized}".encode()).hexdigest()
 
 
 class SetupAgent(BaseAgent):
@@ -35,15 +149,22 @@ class SetupAgent(BaseAgent):
                     project_id=GOOGLE_CLOUD_PROJECT
                 )
                 self.model = self.llm_client.model  # Compatibilidade com código existente
-                self.log(f"LLM configurado ({self.llm_client.client_type}, {GEMINI_MODEL})")
+                self.log("LLM configurado (%s, %s)", self.llm_client.client_type, GEMINI_MODEL)
             except Exception as e:
                 self.llm_client = None
                 self.model = None
-                self.log(f"Erro ao configurar LLM: {e}. Usando fallback", "WARNING")
+                self.log("Erro ao configurar LLM: %s. Usando fallback", e, level="WARNING")
         else:
             self.llm_client = None
             self.model = None
-            self.log("LLM não configurado - usando fallback", "WARNING")
+            self.log("LLM não configurado - usando fallback", level="WARNING")
+        
+        # Respostas do LLM de matching de categoria (_find_category_with_llm):
+        # (entrada normalizada, nomes das categorias) -> texto da resposta.
+        # A lista de categorias faz parte da chave, então criar ou remover uma
+        # categoria já invalida as entradas antigas; usuários com as mesmas
+        # categorias (as padrão) compartilham os matchings
+        self._category_match_cache = TTLCache(maxsize=1024, ttl=3600)
         
         # Categorias padrão
         self.default_categories = [
@@ -73,7 +194,7 @@ class SetupAgent(BaseAgent):
         Returns:
             Dicionário com resultado do processamento
         """
-        self.log(f"Processando esclarecimento no setup - etapa: {setup_step}")
+        self.log("Processando esclarecimento no setup - etapa: %s", setup_step)
         
         # Roteia para a etapa apropriada com a mensagem de esclarecimento
         if setup_step == "get_name":
@@ -108,7 +229,7 @@ class SetupAgent(BaseAgent):
         # Garante que usuário existe
         SQLTool.get_or_create_user(user_phone)
         
-        self.log(f"Processando setup - etapa: {setup_step}")
+        self.log("Processando setup - etapa: %s", setup_step)
         
         # Roteia para etapa apropriada
         if setup_step == "start":
@@ -122,6 +243,47 @@ class SetupAgent(BaseAgent):
         else:
             return self.start_setup(user_phone)
     
+    def _has_llm(self) -> bool:
+        """True se o LLM está configurado (etapas de categorias e limites)."""
+        return bool(self.model and self.llm_client and self.llm_client.model)
+    
+    def _cached_reply(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Resposta do LLM já guardada em llm_cache para esta chave, ou None."""
+        cached = SQLTool.get_llm_reply(cache_key, _SETUP_REPLY_TTL)
+        if cached is None:
+            return None
+        self.log("Resposta do LLM reaproveitada do cache")
+        return json_loads(cached)
+    
+    def _decode_and_cache_reply(self, cache_key: str, result_text: str) -> Dict[str, Any]:
+        """
+        Extrai o JSON da resposta do LLM e guarda em llm_cache.
+        
+        Só respostas válidas (um objeto JSON) são guardadas - um erro do LLM
+        não fica preso no cache.
+        
+        Raises:
+            ValueError: resposta sem um objeto JSON válido
+        """
+        result_text = result_text.strip()
+        
+        # Extrai JSON da resposta
+        if "```" in result_text:
+            # Procura por bloco de código JSON
+            json_match = _JSON_BLOCK_RE.search(result_text)
+            if json_match:
+                result_text = json_match.group(1).strip()
+            else:
+                # Tenta qualquer bloco de código
+                result_text = result_text.split("```")[1].replace("json", "").strip()
+        
+        result = json_loads(result_text)
+        if not isinstance(result, dict):
+            raise ValueError(f"JSON do LLM não é um objeto: {result_text[:200]}")
+        
+        SQLTool.save_llm_reply(cache_key, json.dumps(result, ensure_ascii=False), _SETUP_REPLY_TTL)
+        return result
+    
     def start_setup(self, user_phone: str) -> Dict[str, Any]:
         """Inicia processo de configuração."""
         self.log("Iniciando configuração")
@@ -212,8 +374,9 @@ Seu assistente financeiro pessoal inteligente.
         conn = get_connection()
         conn.execute("UPDATE users SET user_name = ? WHERE user_phone = ?", (user_name, user_phone))
         conn.commit()
+        RouterAgent.invalidate_user_context(user_phone)
         
-        self.log(f"Nome salvo: {user_name}")
+        self.log("Nome salvo: %s", user_name)
         
         # Cria categorias padrão automaticamente
         created = []
@@ -257,163 +420,117 @@ Envie o nome da categoria ou digite *"não"* para continuar.
         - Se disse "não" ou "pronto" (continua)
         - Qualquer outra coisa (responde apropriadamente)
         """
-        if not self.model:
-            # Fallback simples sem LLM
-            msg_lower = message.lower().strip()
-            if "n" in msg_lower[:3] or "pronto" in msg_lower:
-                return self._finish_categories(user_phone)
-            else:
-                # Tenta criar categoria
-                category_name = message.strip().title()
-                try:
-                    SQLTool.create_category(user_phone, category_name, f"Categoria: {category_name}")
-                    return {
-                        "success": True,
-                        "response": f"✅ Categoria *{category_name}* criada!\n\nQuer adicionar mais? Envie o nome ou digite *não* para continuar.",
-                        "setup_complete": False,
-                        "next_step": "categories"
-                    }
-                except Exception as e:
-                    return {
-                        "success": False,
-                        "response": f"❌ Erro ao criar categoria. Tente outro nome ou digite *não* para continuar.",
-                        "setup_complete": False,
-                        "next_step": "categories"
-                    }
-        
-        # Usa LLM para interpretar
-        if not self.llm_client or not self.llm_client.model:
-            # Fallback simples sem LLM
-            msg_lower = message.lower().strip()
-            if "n" in msg_lower[:3] or "pronto" in msg_lower:
-                return self._finish_categories(user_phone)
-            else:
-                # Tenta criar categoria
-                category_name = message.strip().title()
-                try:
-                    SQLTool.create_category(user_phone, category_name, f"Categoria: {category_name}")
-                    return {
-                        "success": True,
-                        "response": f"✅ Categoria *{category_name}* criada!\n\nQuer adicionar mais? Envie o nome ou digite *não* para continuar.",
-                        "setup_complete": False,
-                        "next_step": "categories"
-                    }
-                except Exception as e:
-                    return {
-                        "success": False,
-                        "response": f"❌ Erro ao criar categoria. Tente outro nome ou digite *não* para continuar.",
-                        "setup_complete": False,
-                        "next_step": "categories"
-                    }
+        if not self._has_llm():
+            return self._categories_without_llm(user_phone, message)
         
         try:
-            prompt = f"""Você é um assistente que interpreta respostas sobre categorias financeiras.
-
-Mensagem do usuário: "{message}"
-
-Contexto: O usuário acabou de receber as categorias padrão e foi perguntado se quer adicionar categorias personalizadas.
-
-**Sua tarefa:** Interprete a intenção e retorne JSON:
-
-{{
-  "action": "add_category" | "finish" | "other",
-  "category_name": "NomeDaCategoria" (apenas se action="add_category"),
-  "response": "resposta ao usuário" (apenas se action="other")
-}}
-
-Exemplos:
-- "Pets" → {{"action": "add_category", "category_name": "Pets"}}
-- "Quero adicionar Academia" → {{"action": "add_category", "category_name": "Academia"}}
-- "não" ou "pronto" ou "continuar" → {{"action": "finish"}}
-- "o que são categorias?" → {{"action": "other", "response": "Categorias são grupos onde seus gastos são organizados. Ex: Alimentação, Transporte, etc."}}
-
-**IMPORTANTE - Tratamento de Ambiguidade:**
-- Se o nome da categoria não estiver claro (ex: "sim" pode ser nome ou confirmação), use action="other" e pergunte
-- Se a resposta estiver ambígua (ex: "talvez"), use action="other" e pergunte se quer adicionar ou não
-- Se TUDO estiver claro, use action="add_category" ou action="finish"
-- Retorne APENAS JSON válido
-- category_name com primeira letra maiúscula
-- Se for pergunta ou dúvida, use action="other" e responda de forma amigável
-
-JSON:"""
-            
-            # Usa LLMClient que funciona com ambas as APIs (Gemini API ou Vertex AI)
-            response_llm = self.llm_client.generate_content(prompt)
-            result_text = response_llm.text.strip()
-            
-            # Remove markdown se houver
-            if "```" in result_text:
-                result_text = result_text.split("```")[1].replace("json", "").strip()
-            
-            result = json.loads(result_text)
-            action = result.get("action")
-            
-            self.log(f"LLM interpretou: action={action}")
+            cache_key = _setup_reply_key("categories", message)
+            result = self._cached_reply(cache_key)
+            if result is None:
+                # Usa LLMClient que funciona com ambas as APIs (Gemini API ou Vertex AI)
+                response_llm = self.llm_client.generate_content(
+                    _CATEGORIES_PROMPT_TEMPLATE.format(message=message)
+                )
+                result = self._decode_and_cache_reply(cache_key, response_llm.text)
+            return self._categories_from_llm(user_phone, message, result)
+        except Exception as e:
+            return self._categories_llm_failed(e)
+    
+    def _categories_without_llm(self, user_phone: str, message: str) -> Dict[str, Any]:
+        """Fallback simples sem LLM para a etapa de categorias."""
+        msg_lower = message.lower().strip()
+        if "n" in msg_lower[:3] or "pronto" in msg_lower:
+            return self._finish_categories(user_phone)
+        else:
+            # Tenta criar categoria
+            category_name = message.strip().title()
+            try:
+                SQLTool.create_category(user_phone, category_name, f"Categoria: {category_name}")
+                return {
+                    "success": True,
+                    "response": f"✅ Categoria *{category_name}* criada!\n\nQuer adicionar mais? Envie o nome ou digite *não* para continuar.",
+                    "setup_complete": False,
+                    "next_step": "categories"
+                }
+            except Exception as e:
+                return {
+                    "success": False,
+                    "response": f"❌ Erro ao criar categoria. Tente outro nome ou digite *não* para continuar.",
+                    "setup_complete": False,
+                    "next_step": "categories"
+                }
+    
+    def _categories_from_llm(self, user_phone: str, message: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Executa a ação que o LLM identificou na resposta sobre categorias."""
+        action = result.get("action")
+        
+        self.log("LLM interpretou: action=%s", action)
+        
+        if action == "add_category":
+            category_name = result.get("category_name", message.strip().title())
             
-            if action == "add_category":
-                category_name = result.get("category_name", message.strip().title())
-                
-                # Validação de nome da categoria
-                if not category_name or len(category_name) < 2:
-                    return {
-                        "success": False,
-                        "response": "❓ Nome da categoria muito curto. Pode informar o nome completo?",
-                        "setup_complete": False,
-                        "next_step": "categories",
-                        "needs_clarification": True
-                    }
-                
-                # Validação de nome ambíguo
-                ambiguous_words = ["sim", "não", "ok", "pronto", "continuar", "n", "talvez"]
-                if category_name.lower() in ambiguous_words:
-                    return {
-                        "success": False,
-                        "response": "❓ Isso parece ser uma resposta de confirmação. Qual o nome real da categoria que você quer adicionar?",
-                        "setup_complete": False,
-                        "next_step": "categories",
-                        "needs_clarification": True
-                    }
-                
-                try:
-                    SQLTool.create_category(user_phone, category_name, f"Categoria: {category_name}")
-                    self.log(f"Categoria criada: {category_name}")
-                    return {
-                        "success": True,
-                        "response": f"✅ Categoria *{category_name}* criada!\n\nQuer adicionar mais? Envie o nome ou digite *não* para continuar.",
-                        "setup_complete": False,
-                        "next_step": "categories"
-                    }
-                except Exception as e:
-                    return {
-                        "success": False,
-                        "response": f"❌ Erro ao criar categoria. Tente outro nome ou digite *não* para continuar.",
-                        "setup_complete": False,
-                        "next_step": "categories"
-                    }
+            # Validação de nome da categoria
+            if not category_name or len(category_name) < 2:
+                return {
+                    "success": False,
+                    "response": "❓ Nome da categoria muito curto. Pode informar o nome completo?",
+                    "setup_complete": False,
+                    "next_step": "categories",
+                    "needs_clarification": True
+                }
             
-            elif action == "finish":
-                return self._finish_categories(user_phone)
+            # Validação de nome ambíguo
+            ambiguous_words = ["sim", "não", "ok", "pronto", "continuar", "n", "talvez"]
+            if category_name.lower() in ambiguous_words:
+                return {
+                    "success": False,
+                    "response": "❓ Isso parece ser uma resposta de confirmação. Qual o nome real da categoria que você quer adicionar?",
+                    "setup_complete": False,
+                    "next_step": "categories",
+                    "needs_clarification": True
+                }
             
-            else:
-                # Outra resposta - usa a resposta do LLM
-                llm_response = result.get("response", "Entendi! Quer adicionar alguma categoria ou digite *não* para continuar.")
+            try:
+                SQLTool.create_category(user_phone, category_name, f"Categoria: {category_name}")
+                self.log("Categoria criada: %s", category_name)
                 return {
                     "success": True,
-                    "response": llm_response,
+                    "response": f"✅ Categoria *{category_name}* criada!\n\nQuer adicionar mais? Envie o nome ou digite *não* para continuar.",
+                    "setup_complete": False,
+                    "next_step": "categories"
+                }
+            except Exception as e:
+                return {
+                    "success": False,
+                    "response": f"❌ Erro ao criar categoria. Tente outro nome ou digite *não* para continuar.",
                     "setup_complete": False,
                     "next_step": "categories"
                 }
         
-        except Exception as e:
-            self.log(f"Erro no LLM: {e}", "ERROR")
-            # Sem fallback hardcoded - retorna erro e pede para tentar novamente
+        elif action == "finish":
+            return self._finish_categories(user_phone)
+        
+        else:
+            # Outra resposta - usa a resposta do LLM
+            llm_response = result.get("response", "Entendi! Quer adicionar alguma categoria ou digite *não* para continuar.")
             return {
-                "success": False,
-                "response": "❌ Não consegui processar sua mensagem. Por favor, tente novamente ou digite *não* para continuar.",
+                "success": True,
+                "response": llm_response,
                 "setup_complete": False,
                 "next_step": "categories"
             }
     
+    def _categories_llm_failed(self, error: Exception) -> Dict[str, Any]:
+        """Resposta quando o LLM da etapa de categorias falha."""
+        self.log("Erro no LLM: %s", error, level="ERROR")
+        # Sem fallback hardcoded - retorna erro e pede para tentar novamente
+        return {
+            "success": False,
+            "response": "❌ Não consegui processar sua mensagem. Por favor, tente novamente ou digite *não* para continuar.",
+            "setup_complete": False,
+            "next_step": "categories"
+        }
+    
     def _finish_categories(self, user_phone: str) -> Dict[str, Any]:
         """Finaliza etapa de categorias e pergunta sobre limites."""
         self.log("Categorias finalizadas - perguntando sobre limites")
@@ -449,209 +566,200 @@ Responda: *sim* (definir limites) ou *não* (pular)
         
         IMPORTANTE: Sem fallback hardcoded - confia 100% no LLM.
         """
-        if not self.model:
-            # Sem LLM, não pode processar - retorna erro
-            return {
-                "success": False,
-                "response": "⚠️ Sistema de IA não disponível. Por favor, tente novamente mais tarde.",
-                "setup_complete": False,
-                "next_step": "limits"
-            }
-        
-        # Usa LLM para interpretar TUDO
-        if not self.llm_client or not self.llm_client.model:
-            # Sem LLM, não pode processar - retorna erro
-            return {
-                "success": False,
-                "response": "⚠️ Sistema de IA não disponível. Por favor, tente novamente mais tarde.",
-                "setup_complete": False,
-                "next_step": "limits"
-            }
+        if not self._has_llm():
+            return self._limits_without_llm()
         
         try:
-            prompt = f"""Você é um assistente que interpreta respostas sobre limites de gasto.
-
-Mensagem do usuário: "{message}"
-
-Contexto: O usuário foi perguntado se quer definir limites de gasto por categoria.
-
-**Sua tarefa:** Interprete a intenção e retorne JSON:
-
-{{
-  "action": "add_limit" | "finish" | "other",
-  "category_name": "NomeDaCategoria" (apenas se action="add_limit"),
-  "limit_value": número (apenas se action="add_limit"),
-  "response": "resposta ao usuário" (apenas se action="other")
-}}
-
-Exemplos:
-- "Alimentação 2000" → {{"action": "add_limit", "category_name": "Alimentação", "limit_value": 2000}}
-- "Transporte 500" → {{"action": "add_limit", "category_name": "Transporte", "limit_value": 500}}
-- "não" ou "pular" → {{"action": "finish"}}
-- "o que são limites?" → {{"action": "other", "response": "Limites são valores máximos que você quer gastar por categoria no mês. Ex: Alimentação 2000 = máximo R$ 2000/mês em alimentação."}}
-
-**IMPORTANTE - Tratamento de Ambiguidade:**
-- Se o valor estiver ausente ou ambíguo (ex: "Alimentação" sem valor), use action="other" e pergunte o valor
-- Se a categoria estiver ausente ou ambígua (ex: "2000" sem categoria), use action="other" e pergunte a categoria
-- Se o valor estiver ambíguo (ex: "50" pode ser R$ 50 ou R$ 0,50), use action="other" e pergunte
-- Se TUDO estiver claro, use action="add_limit"
-- Retorne APENAS JSON válido
-- category_name com primeira letra maiúscula
-- limit_value deve ser um número
-- Se for pergunta, use action="other" e responda
-
-JSON:"""
-            
-            # Usa LLMClient que funciona com ambas as APIs (Gemini API ou Vertex AI)
-            response_llm = self.llm_client.generate_content(prompt)
-            result_text = response_llm.text.strip()
-            
-            # Extrai JSON da resposta
-            if "```" in result_text:
-                # Procura por bloco de código JSON
-                import re
-                json_match = re.search(r'```json\s*(.*?)\s*```', result_text, re.DOTALL)
-                if json_match:
-                    result_text = json_match.group(1).strip()
-                else:
-                    # Tenta qualquer bloco de código
-                    result_text = result_text.split("```")[1].replace("json", "").strip()
+            cache_key = _setup_reply_key("limits", message)
+            result = self._cached_reply(cache_key)
+            if result is None:
+                # Usa LLMClient que funciona com ambas as APIs (Gemini API ou Vertex AI)
+                response_llm = self.llm_client.generate_content(
+                    _LIMITS_PROMPT_TEMPLATE.format(message=message)
+                )
+                try:
+                    result = self._decode_and_cache_reply(cache_key, response_llm.text)
+                except ValueError as e:
+                    return self._limits_reply_invalid(response_llm.text, e)
+            parsed = self._parse_limits_reply(user_phone, result)
+            if isinstance(parsed, dict):
+                return parsed
             
+            category_name, limit_value = parsed
+            # Usa LLM para encontrar a categoria mais próxima (matching inteligente)
             try:
-                result = json.loads(result_text)
-            except json.JSONDecodeError as e:
-                self.log(f"Erro ao fazer parse do JSON do LLM: {e}", "ERROR")
-                self.log(f"Resposta do LLM: {result_text[:200]}", "ERROR")
+                category = self._find_category_with_llm(user_phone, category_name)
+            except Exception as e:
+                return self._limit_category_failed(e)
+            return self._save_limit(user_phone, category_name, limit_value, category)
+        except Exception as e:
+            return self._limits_llm_failed(user_phone, message, e)
+    
+    def _limits_without_llm(self) -> Dict[str, Any]:
+        """Sem LLM, a etapa de limites não pode ser processada - retorna erro."""
+        return {
+            "success": False,
+            "response": "⚠️ Sistema de IA não disponível. Por favor, tente novamente mais tarde.",
+            "setup_complete": False,
+            "next_step": "limits"
+        }
+    
+    def _limits_reply_invalid(self, result_text: str, error: Exception) -> Dict[str, Any]:
+        """Resposta quando o LLM de limites não devolve um JSON válido."""
+        self.log_many([
+            ("ERROR", "Erro ao fazer parse do JSON do LLM: %s", error),
+            ("ERROR", "Resposta do LLM: %s", result_text.strip()[:200]),
+        ])
+        return {
+            "success": False,
+            "response": "❌ Não consegui processar sua mensagem. Por favor, tente novamente ou digite *não* para continuar.",
+            "setup_complete": False,
+            "next_step": "limits"
+        }
+    
+    def _parse_limits_reply(self, user_phone: str, result: Dict[str, Any]) -> Union[Dict[str, Any], Tuple[str, float]]:
+        """
+        Interpreta a resposta do LLM sobre limites (JSON já decodificado).
+        
+        Returns:
+            (nome da categoria, valor) quando o usuário definiu um limite
+            válido - falta só encontrar a categoria e salvar (_save_limit) -,
+            ou a resposta pronta (dict) para qualquer outro caso
+        """
+        action = result.get("action")
+        
+        self.log("LLM interpretou: action=%s", action)
+        
+        if action == "add_limit":
+            category_name = result.get("category_name")
+            limit_value_str = result.get("limit_value")
+            
+            # Validação de categoria
+            if not category_name or not category_name.strip():
                 return {
                     "success": False,
-                    "response": "❌ Não consegui processar sua mensagem. Por favor, tente novamente ou digite *não* para continuar.",
+                    "response": "❓ Não consegui identificar a categoria. Pode informar? (ex: 'Alimentação 2000')",
                     "setup_complete": False,
-                    "next_step": "limits"
+                    "next_step": "limits",
+                    "needs_clarification": True
                 }
             
-            action = result.get("action")
-            
-            self.log(f"LLM interpretou: action={action}")
+            # Validação de valor
+            if limit_value_str is None:
+                return {
+                    "success": False,
+                    "response": f"❓ Identifiquei a categoria '{category_name}', mas não consegui identificar o valor. Quanto é o limite? (ex: 'Alimentação 2000')",
+                    "setup_complete": False,
+                    "next_step": "limits",
+                    "needs_clarification": True
+                }
             
-            if action == "add_limit":
-                category_name = result.get("category_name")
-                limit_value_str = result.get("limit_value")
-                
-                # Validação de categoria
-                if not category_name or not category_name.strip():
-                    return {
-                        "success": False,
-                        "response": "❓ Não consegui identificar a categoria. Pode informar? (ex: 'Alimentação 2000')",
-                        "setup_complete": False,
-                        "next_step": "limits",
-                        "needs_clarification": True
-                    }
-                
-                # Validação de valor
-                if limit_value_str is None:
-                    return {
-                        "success": False,
-                        "response": f"❓ Identifiquei a categoria '{category_name}', mas não consegui identificar o valor. Quanto é o limite? (ex: 'Alimentação 2000')",
-                        "setup_complete": False,
-                        "next_step": "limits",
-                        "needs_clarification": True
-                    }
+            try:
+                # Converte para float (pode ser int, float ou string)
+                limit_value = float(limit_value_str)
                 
-                try:
-                    # Converte para float (pode ser int, float ou string)
-                    if isinstance(limit_value_str, (int, float)):
-                        limit_value = float(limit_value_str)
-                    else:
-                        limit_value = float(limit_value_str)
-                    
-                    if limit_value <= 0:
-                        return {
-                            "success": False,
-                            "response": "❓ O valor do limite precisa ser maior que zero. Pode informar o valor correto?",
-                            "setup_complete": False,
-                            "next_step": "limits",
-                            "needs_clarification": True
-                        }
-                except (ValueError, TypeError) as e:
-                    self.log(f"Erro ao converter valor: {e}", "ERROR")
+                if limit_value <= 0:
                     return {
                         "success": False,
-                        "response": f"❓ Não consegui entender o valor '{limit_value_str}'. Pode informar em números? (ex: 'Alimentação 2000')",
+                        "response": "❓ O valor do limite precisa ser maior que zero. Pode informar o valor correto?",
                         "setup_complete": False,
                         "next_step": "limits",
                         "needs_clarification": True
                     }
-                
-                # Usa LLM para encontrar a categoria mais próxima (matching inteligente)
-                try:
-                    category = self._find_category_with_llm(user_phone, category_name)
-                    if not category:
-                        return {
-                            "success": False,
-                            "response": f"❓ Categoria '{category_name}' não encontrada.\n\nVerifique o nome ou digite *não* para pular.",
-                            "setup_complete": False,
-                            "next_step": "limits",
-                            "needs_clarification": True
-                        }
-                except Exception as e:
-                    self.log(f"Erro ao buscar categoria: {e}", "ERROR")
-                    import traceback
-                    self.log(traceback.format_exc(), "ERROR")
-                    return {
-                        "success": False,
-                        "response": f"❌ Erro ao buscar categoria. Tente novamente ou digite *não* para pular.",
-                        "setup_complete": False,
-                        "next_step": "limits"
-                    }
-                
-                try:
-                    SQLTool.create_limit_rule(user_phone, category["category_id"], "mensal", limit_value)
-                    # Usa o nome correto da categoria encontrada pelo LLM
-                    correct_name = category["category_name"]
-                    self.log(f"Limite criado: {correct_name} = R$ {limit_value}")
-                    return {
-                        "success": True,
-                        "response": f"✅ Limite registrado: *{correct_name}* = R$ {limit_value:,.2f}/mês\n\nQuer definir mais limites? Ou digite *não* para finalizar.",
-                        "setup_complete": False,
-                        "next_step": "limits"
-                    }
-                except Exception as e:
-                    self.log(f"Erro ao criar limite: {e}", "ERROR")
-                    import traceback
-                    self.log(traceback.format_exc(), "ERROR")
-                    return {
-                        "success": False,
-                        "response": f"❌ Erro ao criar limite. Tente novamente ou digite *não* para pular.",
-                        "setup_complete": False,
-                        "next_step": "limits"
-                    }
-            
-            elif action == "finish":
-                return self._finish_setup(user_phone)
-            
-            else:
-                # Outra resposta
-                llm_response = result.get("response", "Entendi! Quer definir um limite? Envie: *Categoria Valor* ou digite *não* para finalizar.")
+            except (ValueError, TypeError) as e:
+                self.log("Erro ao converter valor: %s", e, level="ERROR")
                 return {
-                    "success": True,
-                    "response": llm_response,
+                    "success": False,
+                    "response": f"❓ Não consegui entender o valor '{limit_value_str}'. Pode informar em números? (ex: 'Alimentação 2000')",
                     "setup_complete": False,
-                    "next_step": "limits"
+                    "next_step": "limits",
+                    "needs_clarification": True
                 }
+            
+            return category_name, limit_value
+        
+        elif action == "finish":
+            return self._finish_setup(user_phone)
         
+        else:
+            # Outra resposta
+            llm_response = result.get("response", "Entendi! Quer definir um limite? Envie: *Categoria Valor* ou digite *não* para finalizar.")
+            return {
+                "success": True,
+                "response": llm_response,
+                "setup_complete": False,
+                "next_step": "limits"
+            }
+    
+    def _save_limit(
+        self,
+        user_phone: str,
+        category_name: str,
+        limit_value: float,
+        category: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Cria o limite mensal na categoria encontrada (ou avisa que ela não existe)."""
+        if not category:
+            return {
+                "success": False,
+                "response": f"❓ Categoria '{category_name}' não encontrada.\n\nVerifique o nome ou digite *não* para pular.",
+                "setup_complete": False,
+                "next_step": "limits",
+                "needs_clarification": True
+            }
+        
+        try:
+            SQLTool.create_limit_rule(user_phone, category["category_id"], "mensal", limit_value)
+            # Usa o nome correto da categoria encontrada pelo LLM
+            correct_name = category["category_name"]
+            self.log("Limite criado: %s = R$ %s", correct_name, limit_value)
+            return {
+                "success": True,
+                "response": f"✅ Limite registrado: *{correct_name}* = R$ {limit_value:,.2f}/mês\n\nQuer definir mais limites? Ou digite *não* para finalizar.",
+                "setup_complete": False,
+                "next_step": "limits"
+            }
         except Exception as e:
-            self.log(f"Erro no LLM: {e}", "ERROR")
-            # Fallback
-            msg_lower = message.lower().strip()
-            if "n" in msg_lower[:3]:
-                return self._finish_setup(user_phone)
+            import traceback
+            self.log_many([
+                ("ERROR", "Erro ao criar limite: %s", e),
+                ("ERROR", traceback.format_exc()),
+            ])
             return {
                 "success": False,
-                "response": "Não entendi. Envie: *Categoria Valor* (ex: Alimentação 2000) ou digite *não* para finalizar.",
+                "response": f"❌ Erro ao criar limite. Tente novamente ou digite *não* para pular.",
                 "setup_complete": False,
                 "next_step": "limits"
             }
     
+    def _limit_category_failed(self, error: Exception) -> Dict[str, Any]:
+        """Resposta quando a busca da categoria do limite falha."""
+        import traceback
+        self.log_many([
+            ("ERROR", "Erro ao buscar categoria: %s", error),
+            ("ERROR", traceback.format_exc()),
+        ])
+        return {
+            "success": False,
+            "response": f"❌ Erro ao buscar categoria. Tente novamente ou digite *não* para pular.",
+            "setup_complete": False,
+            "next_step": "limits"
+        }
+    
+    def _limits_llm_failed(self, user_phone: str, message: str, error: Exception) -> Dict[str, Any]:
+        """Resposta quando o LLM da etapa de limites falha."""
+        self.log("Erro no LLM: %s", error, level="ERROR")
+        # Fallback
+        msg_lower = message.lower().strip()
+        if "n" in msg_lower[:3]:
+            return self._finish_setup(user_phone)
+        return {
+            "success": False,
+            "response": "Não entendi. Envie: *Categoria Valor* (ex: Alimentação 2000) ou digite *não* para finalizar.",
+            "setup_complete": False,
+            "next_step": "limits"
+        }
+    
     def _finish_setup(self, user_phone: str) -> Dict[str, Any]:
         """Finaliza o setup."""
         self.log("Setup concluído")
@@ -688,13 +796,15 @@ Experimente: "gastei 50 reais no supermercado"
         conn = get_connection()
         conn.execute("UPDATE users SET setup_step = ? WHERE user_phone = ?", (step, user_phone))
         conn.commit()
-        self.log(f"Setup step salvo: {step}")
+        RouterAgent.invalidate_user_context(user_phone)
+        self.log("Setup step salvo: %s", step)
     
     def _clear_setup_step(self, user_phone: str):
         """Limpa o estado de setup."""
         conn = get_connection()
         conn.execute("UPDATE users SET setup_step = NULL WHERE user_phone = ?", (user_phone,))
         conn.commit()
+        RouterAgent.invalidate_user_context(user_phone)
         self.log("Setup concluído - estado limpo")
     
     def _find_category_with_llm(self, user_phone: str, category_input: str) -> Optional[Dict[str, Any]]:
@@ -705,62 +815,90 @@ Experimente: "gastei 50 reais no supermercado"
         - Erros de digitação (Alimentacao vs Alimentação)
         - Diferenças de acentuação
         - Variações de nome (Alimentação vs Alimentacao vs Alimentacao)
+        
+        Diferenças só de maiúsculas/acentos já são resolvidas pela busca
+        exata (SQLTool.get_category_by_name), sem LLM; respostas do LLM para
+        a mesma entrada e as mesmas categorias vêm de _category_match_cache.
         """
-        # Primeiro tenta busca exata
-        category = SQLTool.get_category_by_name(user_phone, category_input)
-        if category:
+        category, all_categories = self._find_category_without_llm(user_phone, category_input)
+        if category or not all_categories:
             return category
         
-        # Se não encontrou, busca todas as categorias do usuário
-        all_categories = SQLTool.get_user_categories(user_phone)
-        if not all_categories:
-            return None
-        
-        # Se não tem LLM, retorna None
-        if not self.llm_client or not self.llm_client.model:
-            return None
+        match_key = self._category_match_key(category_input, all_categories)
+        matched_name = self._category_match_cache.get(match_key)
+        if matched_name is not None:
+            return self._match_category_reply(category_input, all_categories, matched_name)
         
         # Usa LLM para encontrar a categoria mais próxima
         try:
-            category_names = [cat["category_name"] for cat in all_categories]
-            
-            prompt = f"""Você é um assistente que faz matching inteligente de categorias.
-
-**Categoria que o usuário digitou:** "{category_input}"
-
-**Categorias disponíveis:**
-{chr(10).join(f"- {name}" for name in category_names)}
-
-**Sua tarefa:** Encontre a categoria mais próxima da que o usuário digitou.
-
-Considere:
-- Erros de digitação (ex: "Alimentacao" → "Alimentação")
-- Diferenças de acentuação
-- Variações de nome
-- Similaridade fonética
-
-Retorne APENAS o nome exato da categoria mais próxima, ou "NENHUMA" se não houver correspondência razoável.
-
-Categoria mais próxima:"""
-            
             # Usa LLMClient que funciona com ambas as APIs
-            response_llm = self.llm_client.generate_content(prompt)
-            matched_name = response_llm.text.strip()
-            
-            # Remove aspas se houver
-            matched_name = matched_name.strip('"\'')
-            
-            if matched_name.upper() == "NENHUMA" or matched_name == "":
-                return None
-            
-            # Busca a categoria encontrada pelo LLM
-            for cat in all_categories:
-                if cat["category_name"].lower() == matched_name.lower():
-                    self.log(f"LLM encontrou categoria: '{category_input}' → '{cat['category_name']}'")
-                    return cat
-            
-            return None
-            
+            response_llm = self.llm_client.generate_content(
+                self._category_match_prompt(category_input, all_categories)
+            )
+            self._category_match_cache.set(match_key, response_llm.text)
+            return self._match_category_reply(category_input, all_categories, response_llm.text)
         except Exception as e:
-            self.log(f"Erro no LLM de matching: {e}", "ERROR")
+            self.log("Erro no LLM de matching: %s", e, level="ERROR")
             return None
+    
+    def _find_category_without_llm(
+        self,
+        user_phone: str,
+        category_input: str
+    ) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Parte do matching de categoria que não usa LLM.
+        
+        Returns:
+            (categoria, []) se a busca exata encontrou; (None, categorias do
+            usuário) se o LLM deve escolher entre elas; (None, []) se não há
+            o que procurar (sem categorias ou sem LLM)
+        """
+        # Primeiro tenta busca exata
+        category = SQLTool.get_category_by_name(user_phone, category_input)
+        if category:
+            return category, []
+        
+        # Se não tem LLM, retorna None
+        if not self.llm_client or not self.llm_client.model:
+            return None, []
+        
+        # Se não encontrou, busca todas as categorias do usuário
+        return None, SQLTool.get_user_categories(user_phone)
+    
+    @staticmethod
+    def _category_match_key(category_input: str, all_categories: List[Dict[str, Any]]) -> tuple:
+        """Chave do _category_match_cache: entrada normalizada + nomes das categorias."""
+        return (
+            FormatterTool.normalize_text(category_input),
+            tuple(cat["category_name"] for cat in all_categories),
+        )
+    
+    @staticmethod
+    def _category_match_prompt(category_input: str, all_categories: List[Dict[str, Any]]) -> str:
+        """Monta o prompt de matching com os nomes das categorias do usuário."""
+        return _CATEGORY_MATCH_PROMPT_TEMPLATE.format(
+            category_input=category_input,
+            category_list="\n".join(f"- {cat['category_name']}" for cat in all_categories),
+        )
+    
+    def _match_category_reply(
+        self,
+        category_input: str,
+        all_categories: List[Dict[str, Any]],
+        matched_name: str
+    ) -> Optional[Dict[str, Any]]:
+        """Encontra a categoria cujo nome o LLM respondeu (ou None)."""
+        # Remove aspas se houver
+        matched_name = matched_name.strip().strip('"\'')
+        
+        if matched_name.upper() == "NENHUMA" or matched_name == "":
+            return None
+        
+        # Busca a categoria encontrada pelo LLM
+        for cat in all_categories:
+            if cat["category_name"].lower() == matched_name.lower():
+                self.log("LLM encontrou categoria: '%s' → '%s'", category_input, cat['category_name'])
+                return cat
+        
+        return None
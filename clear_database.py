@@ -32,6 +32,7 @@ def clear_database(verbose: bool = True):
             # Ordem de deleção considerando foreign keys
             # Deletar na ordem inversa das dependências
             tables = [
+                "llm_cache",
                 "conversation_history",
                 "user_rules",
                 "transactions",
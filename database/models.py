@@ -12,12 +12,15 @@ O banco de dados SQLite é usado para armazenar:
 - Transações financeiras (transactions) - registro de todos os gastos
 - Regras de limite de gastos (user_rules) - limites por categoria e período
 - Histórico de conversas (conversation_history) - mensagens e respostas para contexto
+- Cache de respostas do LLM (llm_cache) - respostas já interpretadas no setup
 
 Todas as operações de banco de dados são feitas através do SQLTool
 (em tools/sql_tool.py), que fornece uma interface mais amigável.
 """
 
 import sqlite3
+import threading
+import unicodedata
 from pathlib import Path
 from typing import Optional
 
@@ -37,6 +40,24 @@ load_dotenv()
 # Padrão: jarvis.db na raiz do projeto
 DATABASE_PATH = Path(os.getenv("DATABASE_PATH", "jarvis.db"))
 
+# Conexões abertas, reaproveitadas entre chamadas: uma por thread e por arquivo.
+# Abrir a conexão (e configurar os PRAGMAs) a cada operação custava mais que
+# as próprias consultas. Por thread porque o bot executa o workflow em threads
+# do executor e uma conexão SQLite não deve ser compartilhada entre threads.
+_thread_connections = threading.local()
+
+# Configuração aplicada uma vez, ao abrir cada conexão:
+# - WAL: leituras não bloqueiam a escrita (e vice-versa) entre threads
+# - synchronous=NORMAL: seguro com WAL e evita um fsync por commit
+# - busy_timeout: espera o lock em vez de falhar com "database is locked"
+# - temp_store=MEMORY: ordenações/agrupamentos temporários ficam em memória
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+)
+
 
 def get_connection(db_path: Optional[Path] = None) -> sqlite3.Connection:
     """
@@ -46,8 +67,12 @@ def get_connection(db_path: Optional[Path] = None) -> sqlite3.Connection:
     Ela configura a conexão para retornar resultados como dicionários (Row factory),
     facilitando o acesso aos dados.
     
+    A conexão é reaproveitada: cada thread mantém uma conexão aberta por
+    arquivo, criada na primeira chamada. Por isso, NÃO feche a conexão.
+    
     IMPORTANTE: Sempre use esta função com context manager (with) para garantir
-    que a conexão seja fechada corretamente:
+    que a transação seja confirmada (commit) ou desfeita (rollback em caso de
+    erro) ao final do bloco:
         with get_connection() as conn:
             cursor = conn.execute("SELECT ...")
     
@@ -73,6 +98,19 @@ def get_connection(db_path: Optional[Path] = None) -> sqlite3.Connection:
     # Usa caminho fornecido ou padrão
     target = Path(db_path) if db_path else DATABASE_PATH
     
+    # Reaproveita a conexão desta thread para o arquivo, se já existir
+    connections = getattr(_thread_connections, "by_path", None)
+    if connections is None:
+        connections = _thread_connections.by_path = {}
+    
+    connection = connections.get(target)
+    if connection is None:
+        connection = connections[target] = _open_connection(target)
+    return connection
+
+
+def _open_connection(target: Path) -> sqlite3.Connection:
+    """Abre e configura uma nova conexão (usada só por get_connection)."""
     # Cria diretório pai se não existir (útil se db_path for em subdiretório)
     target.parent.mkdir(parents=True, exist_ok=True)
     
@@ -83,9 +121,28 @@ def get_connection(db_path: Optional[Path] = None) -> sqlite3.Connection:
     # Isso permite acessar colunas por nome: row['user_phone'] em vez de row[0]
     connection.row_factory = sqlite3.Row
     
+    for pragma in _CONNECTION_PRAGMAS:
+        connection.execute(pragma)
+    
+    # unaccent(texto) no SQL: compara nomes sem acentos (ex: SQLTool.get_category_by_name)
+    connection.create_function("unaccent", 1, _unaccent, deterministic=True)
+    
     return connection
 
 
+def _unaccent(text: Optional[str]) -> Optional[str]:
+    """
+    Remove acentos de um texto ("Alimentação" → "Alimentacao").
+    
+    Registrada em cada conexão como a função SQL unaccent(), com o mesmo nome
+    da extensão do PostgreSQL.
+    """
+    if text is None:
+        return None
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
 def init_database(db_path: Optional[Path] = None) -> None:
     """
     Cria as tabelas necessárias para o funcionamento do Jarvis.
@@ -233,6 +290,15 @@ def init_database(db_path: Optional[Path] = None) -> None:
             """
         )
 
+        # Índice para listar/agrupar as categorias de um usuário
+        # (get_user_categories, get_spending_by_category) sem varrer a tabela
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_categories_user 
+            ON categories(user_phone)
+            """
+        )
+
         # ========================================================================
         # TABELA: transactions - Transações financeiras (gastos)
         # ========================================================================
@@ -282,6 +348,27 @@ def init_database(db_path: Optional[Path] = None) -> None:
             """
         )
 
+        # Índices compostos para as consultas de gastos por período
+        # - idx_tx_user_date: total/lista do usuário em um intervalo de datas
+        #   (get_total_by_period, get_transactions, get_period_snapshot)
+        # - idx_tx_user_cat_date: total de uma categoria em um intervalo
+        #   (get_total_by_category, recálculo de limites a cada gasto)
+        # Os intervalos são semiabertos (created_at >= ? AND created_at < ?)
+        # sobre a coluna pura, então o SQLite faz SEARCH pelo índice em vez
+        # de varrer a tabela inteira
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_tx_user_date 
+            ON transactions(user_phone, created_at)
+            """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_tx_user_cat_date 
+            ON transactions(user_phone, category_id, created_at)
+            """
+        )
+
         # ========================================================================
         # TABELA: user_rules - Regras de limite de gastos
         # ========================================================================
@@ -350,6 +437,15 @@ def init_database(db_path: Optional[Path] = None) -> None:
             """
         )
 
+        # Índice composto para buscar as regras de uma categoria do usuário
+        # (SQLTool.get_active_rules_for_category) sem varrer todas as regras
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_rules_user_category 
+            ON user_rules(user_phone, category_id)
+            """
+        )
+
         # ========================================================================
         # TABELA: conversation_history - Histórico de conversas
         # ========================================================================
@@ -407,6 +503,46 @@ def init_database(db_path: Optional[Path] = None) -> None:
             """
         )
 
+        # ========================================================================
+        # TABELA: llm_cache - Cache persistente de respostas do LLM
+        # ========================================================================
+        # Propósito: Guarda o JSON já interpretado das respostas do LLM nas etapas
+        #            de categorias e limites do setup. Muitos usuários respondem com
+        #            os mesmos textos ("não", "pronto", "Pets", "Alimentação 2000"),
+        #            e a resposta repetida sai daqui em vez de uma nova chamada.
+        #
+        # Campos:
+        #   - cache_key (TEXT, PK): sha256 de "modelo:etapa:mensagem normalizada"
+        #                           (ver SetupAgent, _setup_reply_key)
+        #   - response (TEXT): JSON da resposta do LLM, já validado
+        #   - created_at (DATETIME): Quando a resposta foi guardada
+        #                            Entradas mais antigas que o TTL são ignoradas
+        #                            e apagadas a cada nova gravação
+        #                            (SQLTool.save_llm_reply)
+        #
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY,                     -- sha256 do modelo, etapa e mensagem
+                response TEXT NOT NULL,                         -- JSON da resposta do LLM
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP   -- Data de gravação
+            )
+            """
+        )
+
+        # Índice para apagar as entradas expiradas (SQLTool.save_llm_reply)
+        # sem varrer a tabela inteira
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_created 
+            ON llm_cache(created_at)
+            """
+        )
+
+        # Atualiza as estatísticas do planejador de consultas (ANALYZE) quando
+        # elas estão desatualizadas - ex: índices recém-criados em base já populada
+        cursor.execute("PRAGMA optimize")
+
         # Confirma todas as alterações no banco
         conn.commit()
 
@@ -10,6 +10,8 @@ class GraphState(TypedDict):
     Campos:
     - user_phone: Telefone/ID do usuário
     - message: Mensagem original do usuário
+    - normalized_message: Mensagem normalizada (FormatterTool.normalize_text),
+      calculada uma vez no partner_node e reaproveitada pelos agentes
     - intent: Intenção detectada (setup, registro, consulta, etc)
     - route: Rota decidida pelo RouterAgent (finance, setup, clarification)
     - confidence: Confiança na detecção (0-1)
@@ -26,6 +28,7 @@ class GraphState(TypedDict):
     """
     user_phone: str
     message: str
+    normalized_message: Optional[str]
     intent: Optional[str]
     route: Optional[str]  # Rota decidida pelo RouterAgent: "finance" | "setup" | "clarification"
     confidence: Optional[float]
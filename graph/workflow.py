@@ -4,28 +4,33 @@ from typing import Literal
 from langgraph.graph import StateGraph, END
 from graph.state import GraphState
 from agents import PartnerAgent, FinanceAgent, SetupAgent, OutputAgent, RouterAgent
+from tools import FormatterTool
 
 
-# Instâncias globais dos agentes
-partner_agent = PartnerAgent()
-router_agent = RouterAgent()
-finance_agent = FinanceAgent()
-setup_agent = SetupAgent()
-output_agent = OutputAgent()
+# Instâncias globais dos agentes (singletons compartilhados via BaseAgent.get)
+partner_agent = PartnerAgent.get()
+router_agent = RouterAgent.get()
+finance_agent = FinanceAgent.get()
+setup_agent = SetupAgent.get()
+output_agent = OutputAgent.get()
 
 
 def partner_node(state: GraphState) -> GraphState:
     """
-    Nó do PartnerAgent: valida segurança + verifica setup em andamento.
+    Nó de entrada: valida segurança, verifica setup em andamento e roteia.
+    
+    PartnerAgent (validação) e RouterAgent (roteamento) rodam no mesmo nó:
+    a validação é só regex, então um nó separado para ela custava mais uma
+    passagem pelo grafo (e uma cópia do estado) por mensagem sem ganho algum.
     """
-    partner_agent.log(f"Validando mensagem: '{state['message']}'")
+    partner_agent.log("Validando mensagem: '%s'", state['message'])
     
     # Valida segurança
     result = partner_agent.process({"message": state["message"]})
     
     # Se inválido, termina
     if not result.get("valid"):
-        partner_agent.log(f"Mensagem bloqueada: {result['error']}", "WARNING")
+        partner_agent.log("Mensagem bloqueada: %s", result['error'], level="WARNING")
         return {
             **state,
             "intent": "invalid",
@@ -33,63 +38,64 @@ def partner_node(state: GraphState) -> GraphState:
             "response": f"❌ {result['error']}"
         }
     
-    # Verifica se usuário existe no banco
-    from database import get_connection
-    conn = get_connection()
-    user = conn.execute(
-        "SELECT user_name, setup_step FROM users WHERE user_phone = ?",
-        (state["user_phone"],)
-    ).fetchone()
+    # Normalizada uma vez só: RouterAgent (tabela e cache de rotas) e
+    # FinanceAgent (atalhos por regex) comparam a mesma forma da mensagem
+    cleaned_message = result["cleaned_message"]
+    normalized_message = FormatterTool.normalize_text(cleaned_message)
+    
+    # Verifica se usuário existe no banco (contexto em cache no RouterAgent:
+    # o mesmo que o roteamento usa logo abaixo)
+    user_context = router_agent.get_user_context(state["user_phone"])
     
     # Se usuário NÃO existe, é a primeira vez! Inicia setup automaticamente
-    if not user:
-        partner_agent.log("NOVO USUÁRIO! Iniciando apresentação + setup")
-        
-        # Cria o usuário no banco
+    if not user_context["exists"]:
+        # Cria o usuário já com setup_step="start" (um único INSERT)
         from tools import SQLTool
-        SQLTool.get_or_create_user(state["user_phone"])
+        created = SQLTool.create_user(state["user_phone"], setup_step="start")
+        RouterAgent.invalidate_user_context(state["user_phone"])
         
-        # Define setup_step como "start" para começar o fluxo
-        conn.execute(
-            "UPDATE users SET setup_step = ? WHERE user_phone = ?",
-            ("start", state["user_phone"])
-        )
-        conn.commit()
+        if created:
+            partner_agent.log("NOVO USUÁRIO! Iniciando apresentação + setup")
+            return {
+                **state,
+                "message": cleaned_message,
+                "normalized_message": normalized_message,
+                "intent": "setup",
+                "setup_step": "start",
+                "action": "setup",
+            }
         
-        return {
-            **state,
-            "message": result["cleaned_message"],
-            "intent": "setup",
-            "setup_step": "start",
-            "action": "setup",
-        }
+        # Já existia (a consulta falhou ou outra mensagem acabou de criá-lo)
+        user_context = router_agent.get_user_context(state["user_phone"])
     
     # Se usuário está em processo de setup - roteia direto
-    if user and user["setup_step"]:
-        partner_agent.log(f"Setup em andamento: {user['setup_step']}")
+    if user_context["setup_step"]:
+        partner_agent.log("Setup em andamento: %s", user_context['setup_step'])
         return {
             **state,
-            "message": result["cleaned_message"],
+            "message": cleaned_message,
+            "normalized_message": normalized_message,
             "intent": "setup",
-            "setup_step": user["setup_step"],
+            "setup_step": user_context["setup_step"],
             "action": "setup",
         }
     
     # Mensagem válida - passa para RouterAgent
     partner_agent.log("Mensagem válida, encaminhando para RouterAgent")
     
-    return {
+    return _route_message({
         **state,
-        "message": result["cleaned_message"],
+        "message": cleaned_message,
+        "normalized_message": normalized_message,
         "intent": "process",
         "confidence": 1.0,
         "action": "route",
-    }
+    })
 
 
-def router_node(state: GraphState) -> GraphState:
+def _route_message(state: GraphState) -> GraphState:
     """
-    Nó do RouterAgent: analisa mensagem e decide rota usando LLM.
+    Etapa de roteamento do partner_node: analisa mensagem e decide rota usando LLM.
     
     O RouterAgent identifica:
     - Intenção principal
@@ -115,7 +121,7 @@ def router_node(state: GraphState) -> GraphState:
     # Se precisa esclarecimento, salva intenção pendente
     if route_result.get("needs_clarification"):
         updated_state["pending_intent"] = route_result.get("intent")
-        router_agent.log(f"Ambiguidade detectada: {route_result.get('ambiguity_cases')}")
+        router_agent.log("Ambiguidade detectada: %s", route_result.get('ambiguity_cases'))
         # Se é uma nova ambiguidade (não é continuação), reseta contador
         # Se já havia tentativas, mantém o contador (será incrementado no clarification_node)
         if "clarification_attempts" not in state or state.get("clarification_attempts") is None:
@@ -124,7 +130,7 @@ def router_node(state: GraphState) -> GraphState:
         # Se não precisa esclarecimento, reseta contador
         updated_state["clarification_attempts"] = 0
     
-    router_agent.log(f"Rota decidida: {updated_state['route']} (intent: {updated_state['intent']})")
+    router_agent.log("Rota decidida: %s (intent: %s)", updated_state['route'], updated_state['intent'])
     
     return updated_state
 
@@ -147,7 +153,7 @@ def clarification_node(state: GraphState) -> GraphState:
     
     # Se excedeu o limite, deixa o LLM decidir como responder
     if attempts >= MAX_CLARIFICATION_ATTEMPTS:
-        router_agent.log(f"Limite de esclarecimentos excedido ({attempts} tentativas) - deixando LLM decidir", "WARNING")
+        router_agent.log("Limite de esclarecimentos excedido (%s tentativas) - deixando LLM decidir", attempts, level="WARNING")
         # Em vez de mensagem fixa, roteia para FinanceAgent que vai usar LLM para responder
         return {
             **state,
@@ -156,7 +162,7 @@ def clarification_node(state: GraphState) -> GraphState:
             "action": "process",
         }
     
-    router_agent.log(f"Gerando pergunta de esclarecimento (tentativa {attempts + 1}/{MAX_CLARIFICATION_ATTEMPTS})")
+    router_agent.log("Gerando pergunta de esclarecimento (tentativa %s/%s)", attempts + 1, MAX_CLARIFICATION_ATTEMPTS)
     
     # Obtém contexto de esclarecimento (pode vir do RouterAgent ou do FinanceAgent)
     clarification_context = state.get("clarification_context")
@@ -205,8 +211,13 @@ def finance_node(state: GraphState) -> GraphState:
     data = {
         "user_phone": state["user_phone"],
         "message": state["message"],
+        "normalized_message": state.get("normalized_message"),
         "action": "clarification" if needs_clarification and clarification_context else "process",
         "clarification_context": clarification_context,
+        # Decisão do RouterAgent: permite ao FinanceAgent pular o próprio LLM
+        # quando a intenção já classificada não precisa de extração de dados
+        "router_intent": state.get("intent"),
+        "router_confidence": state.get("confidence"),
     }
     
     # Processa com LLM
@@ -245,7 +256,7 @@ def finance_node(state: GraphState) -> GraphState:
             MAX_ATTEMPTS = 3
             
             if attempts >= MAX_ATTEMPTS:
-                finance_agent.log(f"Limite de esclarecimentos excedido ({attempts} tentativas) - deixando LLM decidir", "WARNING")
+                finance_agent.log("Limite de esclarecimentos excedido (%s tentativas) - deixando LLM decidir", attempts, level="WARNING")
                 # Em vez de mensagem fixa, usa a resposta do LLM que já detectou que não entendeu
                 # O LLM já gerou uma resposta apropriada (fora_escopo ou ajuda)
                 return {
@@ -256,7 +267,7 @@ def finance_node(state: GraphState) -> GraphState:
                     "error": None
                 }
             
-            finance_agent.log(f"Precisa esclarecimento (tentativa {attempts + 1}/{MAX_ATTEMPTS})")
+            finance_agent.log("Precisa esclarecimento (tentativa %s/%s)", attempts + 1, MAX_ATTEMPTS)
             return {
                 **state,
                 "response": result["response"],
@@ -268,14 +279,14 @@ def finance_node(state: GraphState) -> GraphState:
         # Se success=False mas há uma resposta válida, não é erro - é uma resposta informativa
         # (ex: "não é possível remover categoria com transações")
         if result.get("response") and not result.get("success", True):
-            finance_agent.log(f"Resposta informativa (não é erro): {result['response'][:100]}")
+            finance_agent.log("Resposta informativa (não é erro): %s", result['response'][:100])
             return {
                 **state,
                 "response": result["response"],
                 "error": None  # Não é erro, é uma resposta válida
             }
         
-        finance_agent.log(f"Erro no processamento: {result.get('response', 'Sem resposta')}", "ERROR")
+        finance_agent.log("Erro no processamento: %s", result.get('response', 'Sem resposta'), level="ERROR")
         return {
             **state,
             "response": result.get("response", "Desculpe, tive um problema ao processar sua solicitação."),
@@ -314,7 +325,7 @@ def setup_node(state: GraphState) -> GraphState:
         result = setup_agent.process(data)
     
     if result["success"]:
-        setup_agent.log(f"Setup concluído: {result.get('setup_complete', False)}")
+        setup_agent.log("Setup concluído: %s", result.get('setup_complete', False))
         return {
             **state,
             "response": result["response"],
@@ -333,7 +344,7 @@ def setup_node(state: GraphState) -> GraphState:
             MAX_ATTEMPTS = 3
             
             if attempts >= MAX_ATTEMPTS:
-                setup_agent.log(f"Limite de esclarecimentos excedido no setup ({attempts} tentativas) - deixando LLM decidir", "WARNING")
+                setup_agent.log("Limite de esclarecimentos excedido no setup (%s tentativas) - deixando LLM decidir", attempts, level="WARNING")
                 # Em vez de mensagem fixa, usa a resposta do LLM que já detectou que não entendeu
                 return {
                     **state,
@@ -343,7 +354,7 @@ def setup_node(state: GraphState) -> GraphState:
                     "error": None
                 }
             
-            setup_agent.log(f"Precisa esclarecimento no setup (tentativa {attempts + 1}/{MAX_ATTEMPTS})")
+            setup_agent.log("Precisa esclarecimento no setup (tentativa %s/%s)", attempts + 1, MAX_ATTEMPTS)
             return {
                 **state,
                 "response": result["response"],
@@ -352,7 +363,7 @@ def setup_node(state: GraphState) -> GraphState:
                 "error": None
             }
         
-        setup_agent.log(f"Erro no setup: {result['response']}", "ERROR")
+        setup_agent.log("Erro no setup: %s", result['response'], level="ERROR")
         return {
             **state,
             "response": result["response"],
@@ -390,10 +401,13 @@ def output_node(state: GraphState) -> GraphState:
         response = "Desculpe, tive um problema ao processar sua solicitação. Tente novamente!"
     else:
         # Prepara dados para o OutputAgent
+        agent_data = state.get("data")
         data = {
             "response": state.get("response", ""),
             "intent": state.get("intent"),
-            "user_phone": state["user_phone"]
+            "user_phone": state["user_phone"],
+            # FinanceAgent marca respostas montadas só com textos fixos (_TEMPLATE_INTENTS)
+            "skip_validation": isinstance(agent_data, dict) and bool(agent_data.get("skip_validation")),
         }
     
         # Processa com LLM (valida + modera)
@@ -403,7 +417,7 @@ def output_node(state: GraphState) -> GraphState:
             output_agent.log("Resposta validada e moderada com sucesso")
             response = result["response"]  # Resposta melhorada pelo LLM
         else:
-            output_agent.log(f"Erro na validação: {result.get('error')}", "ERROR")
+            output_agent.log("Erro na validação: %s", result.get('error'), level="ERROR")
             response = "Desculpe, não consegui processar sua solicitação corretamente."
     
     # Salva conversa no histórico
@@ -416,7 +430,7 @@ def output_node(state: GraphState) -> GraphState:
         )
         output_agent.log("Conversa salva no histórico")
     except Exception as e:
-        output_agent.log(f"Erro ao salvar histórico: {e}", "WARNING")
+        output_agent.log("Erro ao salvar histórico: %s", e, level="WARNING")
     
     return {
         **state,
@@ -424,30 +438,30 @@ def output_node(state: GraphState) -> GraphState:
     }
 
 
-def route_after_partner(state: GraphState) -> Literal["router", "setup", "end"]:
+def route_after_partner(state: GraphState) -> Literal["finance", "setup", "clarification", "end"]:
     """
-    Roteador: decide qual nó executar após o PartnerAgent.
+    Roteador: decide qual nó executar após o partner_node.
     
     - invalid → END
     - setup (em andamento) → SetupAgent
-    - process → RouterAgent (analisa e decide rota)
+    - demais → rota decidida pelo RouterAgent (ver route_after_router)
     """
     intent = state.get("intent")
     
     if intent == "invalid":
         # Mensagem bloqueada por segurança
         return "end"
-    elif intent == "setup":
-        # Usuário está em processo de setup
+    elif intent == "setup" and state.get("route") is None:
+        # Usuário está em processo de setup (RouterAgent não foi chamado)
         return "setup"
     else:
-        # Vai para RouterAgent para análise inteligente
-        return "router"
+        # RouterAgent já analisou a mensagem no próprio partner_node
+        return route_after_router(state)
 
 
 def route_after_router(state: GraphState) -> Literal["finance", "setup", "clarification", "end"]:
     """
-    Roteador: decide qual nó executar após o RouterAgent.
+    Roteador: decide o destino a partir da rota decidida pelo RouterAgent.
     
     Usa o campo "route" retornado pelo RouterAgent para decidir o próximo nó.
     O RouterAgent já fez a análise inteligente e decidiu a rota apropriada.
@@ -524,8 +538,8 @@ def create_workflow() -> StateGraph:
     Cria o workflow SIMPLIFICADO + SETUP do Jarvis.
     
     Fluxo:
-    1. START → partner_node (valida segurança)
-    2. partner_node → [finance_node | END]
+    1. START → partner_node (valida segurança e roteia com o RouterAgent)
+    2. partner_node → [finance_node | setup_node | clarification_node | END]
     3. finance_node (LLM decide) → [setup_node | validator_node]
        - Se LLM detecta setup → setup_node (fluxo guiado)
        - Caso contrário → validator_node
@@ -545,8 +559,7 @@ def create_workflow() -> StateGraph:
     workflow = StateGraph(GraphState)
     
     # Adiciona nós
-    workflow.add_node("partner", partner_node)      # Valida segurança
-    workflow.add_node("router", router_node)        # Analisa e decide rota
+    workflow.add_node("partner", partner_node)      # Valida segurança + decide rota
     workflow.add_node("clarification", clarification_node)  # Gera pergunta de esclarecimento
     workflow.add_node("finance", finance_node)      # Processa operações financeiras
     workflow.add_node("setup", setup_node)          # Fluxo guiado de setup
@@ -555,21 +568,10 @@ def create_workflow() -> StateGraph:
     # Define ponto de entrada
     workflow.set_entry_point("partner")
     
-    # Roteamento após partner
+    # Roteamento após partner (já com a rota do RouterAgent)
     workflow.add_conditional_edges(
         "partner",
         route_after_partner,
-        {
-            "router": "router",   # Normal → RouterAgent (analisa)
-            "setup": "setup",     # Setup em andamento → SetupAgent
-            "end": END            # Inválido → END
-        }
-    )
-    
-    # Roteamento após router
-    workflow.add_conditional_edges(
-        "router",
-        route_after_router,
         {
             "clarification": "clarification",  # Precisa esclarecimento
             "setup": "setup",                  # Roteia para SetupAgent
@@ -629,6 +631,7 @@ def run_workflow(user_phone: str, message: str) -> dict:
     initial_state: GraphState = {
         "user_phone": user_phone,
         "message": message,
+        "normalized_message": None,  # Preenchido pelo partner_node
         "intent": None,
         "route": None,  # Será definido pelo RouterAgent
         "confidence": None,
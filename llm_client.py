@@ -8,22 +8,83 @@ Este módulo abstrai a diferença entre:
 Detecta automaticamente qual usar baseado na chave fornecida.
 """
 
+import json
 import os
-from typing import Optional, Any
+from typing import Optional, Any, Iterator, Tuple
+
+# As bibliotecas do Google (google.generativeai / vertexai) são importadas só
+# dentro de _init_gemini_api() / _init_vertex_ai(): são pesadas e apenas uma
+# delas é usada, então não entram no custo de importar este módulo.
 
-# Tenta importar ambas as bibliotecas
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
 
+# orjson é opcional: decodifica o JSON do LLM bem mais rápido que o json da
+# stdlib. Seus erros herdam de json.JSONDecodeError, então os except continuam
+# valendo com qualquer um dos dois.
 try:
-    import vertexai
-    from vertexai.generative_models import GenerativeModel as VertexGenerativeModel
-    VERTEX_AVAILABLE = True
+    import orjson
+    json_loads = orjson.loads
 except ImportError:
-    VERTEX_AVAILABLE = False
+    json_loads = json.loads
+
+
+def _find_json_object(text: str) -> Optional[Tuple[int, int]]:
+    """
+    Localiza o primeiro objeto JSON de nível superior completo no texto.
+    
+    Varre o texto uma vez contando chaves, ignorando as que aparecem dentro
+    de strings (com escapes). Não valida o JSON - só encontra onde ele termina.
+    
+    Returns:
+        (início, fim) do objeto, com fim exclusivo, ou None se o texto ainda
+        não contém um objeto fechado
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return start, i + 1
+    return None
+
+
+def extract_json_text(text: str) -> str:
+    """
+    Extrai o texto JSON de uma resposta do LLM.
+    
+    O LLM pode retornar o JSON dentro de um bloco markdown (```json ... ```)
+    ou diretamente como texto. Usa só str.find (uma passada, sem regex com
+    backtracking), então respostas longas ou com cercas sem fechamento não
+    travam o processamento.
+    
+    Returns:
+        Conteúdo do bloco ```json (até a próxima cerca ou o fim do texto),
+        ou o próprio texto se não houver bloco
+    """
+    start = text.find("```json")
+    if start == -1:
+        return text.strip()
+    
+    start += len("```json")
+    end = text.find("```", start)
+    return text[start:end if end != -1 else len(text)].strip()
 
 
 class LLMClient:
@@ -73,7 +134,9 @@ class LLMClient:
     
     def _init_gemini_api(self):
         """Inicializa cliente Gemini API direta."""
-        if not GEMINI_AVAILABLE:
+        try:
+            import google.generativeai as genai
+        except ImportError:
             raise ImportError("google-generativeai não está instalado. Execute: uv add google-generativeai")
         
         genai.configure(api_key=self.api_key)
@@ -82,7 +145,10 @@ class LLMClient:
     
     def _init_vertex_ai(self):
         """Inicializa cliente Vertex AI."""
-        if not VERTEX_AVAILABLE:
+        try:
+            import vertexai
+            from vertexai.generative_models import GenerativeModel as VertexGenerativeModel
+        except ImportError:
             raise ImportError(
                 "vertexai não está instalado. Execute: uv add google-cloud-aiplatform\n"
                 "E configure autenticação: https://cloud.google.com/vertex-ai/docs/authentication"
@@ -130,6 +196,61 @@ class LLMClient:
         response = self.model.generate_content(prompt, **kwargs)
         return response
     
+    def generate_content_stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Gera conteúdo em streaming, devolvendo o texto de cada pedaço.
+        
+        Args:
+            prompt: Texto do prompt
+            **kwargs: Argumentos adicionais para o modelo
+            
+        Yields:
+            Texto de cada pedaço da resposta, na ordem em que chega
+        """
+        if not self.model:
+            raise ValueError("Modelo não inicializado. Verifique a chave de API.")
+        
+        # Ambas as APIs aceitam stream=True e devolvem um iterável de pedaços
+        for chunk in self.model.generate_content(prompt, stream=True, **kwargs):
+            yield chunk.text
+    
+    def generate_json_text(self, prompt: str, **kwargs) -> str:
+        """
+        Gera uma resposta que contém um objeto JSON e devolve só o texto dele.
+        
+        Usa streaming e para de ler assim que o objeto JSON de nível superior
+        fecha - o texto que o modelo escreve depois (fechamento do bloco
+        markdown, explicações) não é esperado. Só repete a chamada sem
+        streaming quando o próprio streaming não é suportado (TypeError ou
+        NotImplementedError antes do primeiro pedaço); erros do conteúdo
+        (ex: ValueError no .text de um pedaço bloqueado), de cota ou de rede
+        sobem direto, sem gastar uma segunda chamada.
+        
+        Args:
+            prompt: Texto do prompt (deve pedir uma resposta em JSON)
+            **kwargs: Argumentos adicionais para o modelo
+            
+        Returns:
+            Texto do objeto JSON, ou a resposta inteira se nenhum objeto
+            completo foi encontrado (o chamador trata como antes)
+        """
+        parts = []
+        try:
+            for text in self.generate_content_stream(prompt, **kwargs):
+                parts.append(text)
+                # A resposta chega em poucos pedaços, então reescanear o buffer
+                # inteiro a cada pedaço é barato
+                buffer = "".join(parts)
+                bounds = _find_json_object(buffer)
+                if bounds is not None:
+                    return buffer[bounds[0]:bounds[1]]
+            return "".join(parts).strip()
+        except (TypeError, NotImplementedError):
+            if parts:
+                raise
+            # Streaming indisponível neste SDK/modelo - usa a chamada normal
+            return self.generate_content(prompt, **kwargs).text.strip()
+    
     def __repr__(self) -> str:
         return f"LLMClient(type={self.client_type}, model={self.model_name})"
 
@@ -127,8 +127,7 @@ def populate_test_cases(user_id: str = "123456789"):
             cat_id = categories[category_name]["category_id"]
             
             # Verifica se já existe limite
-            rules = SQLTool.get_active_rules(user_id)
-            existing = any(r["category_id"] == cat_id for r in rules)
+            existing = SQLTool.get_active_rules_for_category(user_id, cat_id)
             
             if not existing:
                 rule_id = SQLTool.create_limit_rule(
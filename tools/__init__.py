@@ -2,9 +2,11 @@
 
 from .sql_tool import SQLTool
 from .formatter_tool import FormatterTool
+from .cache_tool import TTLCache
 
 __all__ = [
     "SQLTool",
     "FormatterTool",
+    "TTLCache",
 ]
 
@@ -0,0 +1,79 @@
+"""TTLCache - Cache em memória com expiração (TTL) e limite de tamanho (LRU)."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Cache em memória com tempo de vida por entrada e descarte LRU.
+
+    Usado pelos agentes para evitar recomputar resultados determinísticos
+    (validações, consultas repetidas) dentro de uma janela curta de tempo.
+
+    - Cada entrada expira `ttl` segundos depois de gravada
+    - Ao passar de `maxsize` entradas, a menos usada recentemente é descartada
+    - Thread-safe: o bot executa o workflow em threads do executor
+
+    Exemplo:
+        cache = TTLCache(maxsize=128, ttl=60)
+        cache.set(("user", "123"), {"total": 50.0})
+        cache.get(("user", "123"))  # {"total": 50.0} (ou None se expirou)
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 60.0):
+        """
+        Args:
+            maxsize: Número máximo de entradas mantidas
+            ttl: Tempo de vida de cada entrada, em segundos
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Retorna o valor da chave, ou `default` se não existir ou tiver expirado.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                # Expirou - remove para não ocupar espaço
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)  # Marca como usada recentemente
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Grava o valor, descartando a entrada menos usada se o cache estiver cheio.
+        """
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Optional[Any]:
+        """
+        Remove a chave (invalidação) e retorna o valor que estava gravado.
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        """Remove todas as entradas."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -1,7 +1,40 @@
 """FormatterTool - Formatação de mensagens e valores."""
 
+import re
+import unicodedata
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple
+
+
+# Status de um limite pelo percentual usado: (emoji, rótulo)
+# Índice 0: abaixo de 80% | 1: de 80% a 100% | 2: 100% ou mais
+_LIMIT_STATUS = (("🟢", "OK"), ("🟡", "ATENÇÃO"), ("🔴", "EXCEDIDO"))
+
+# Emojis usados nas respostas do bot ("⚠️" casa pelo "⚠") e marcadores
+# Markdown - cada checagem é uma única varredura do texto
+_RESPONSE_EMOJI_RE = re.compile("[✅❌⚠💰📊🎉📝📋🔴🟡🟢]")
+_MARKDOWN_RE = re.compile(r"[*_`]")
+
+# Linha de cada transação em format_transaction_list
+_TRANSACTION_LINE_TEMPLATE = "• {datetime} - {amount}\n  {description} ({category})"
+
+
+def _to_datetime(value: Any) -> datetime:
+    """
+    Converte o created_at de uma transação em datetime.
+    
+    Aceita datetime ou string ISO (inclusive os formatos do SQLite
+    "YYYY-MM-DD HH:MM:SS[.ffffff]" e "YYYY-MM-DD"). Qualquer outra coisa
+    vira a data atual.
+    """
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+    return datetime.now()
 
 
 class FormatterTool:
@@ -84,55 +117,38 @@ class FormatterTool:
         Returns:
             String formatada com a lista de transações (inclui data e horário)
         """
+        return "".join(FormatterTool.format_transaction_list_iter(transactions))
+    
+    @staticmethod
+    def format_transaction_list_iter(transactions: List[Dict[str, Any]]) -> Iterator[str]:
+        """
+        Mesmo texto de format_transaction_list(), em pedaços.
+        
+        Para quem monta uma resposta maior: os pedaços entram direto no
+        "".join final, sem criar a string da lista no meio do caminho.
+        """
         if not transactions:
-            return "Nenhuma transação encontrada."
+            yield "Nenhuma transação encontrada."
+            return
         
-        lines = ["📋 *Transações:*\n"]
+        yield "📋 *Transações:*\n"
         
         for t in transactions:
-            # Converte created_at para datetime se for string
-            created_at = t.get('created_at')
-            if created_at is None:
-                continue
-                
-            if isinstance(created_at, str):
-                # Tenta parsear como ISO format primeiro
-                try:
-                    date = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                except:
-                    # Se falhar, tenta outros formatos comuns do SQLite
-                    try:
-                        # Formato: YYYY-MM-DD HH:MM:SS
-                        date = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S')
-                    except:
-                        try:
-                            # Formato: YYYY-MM-DD HH:MM:SS.ffffff
-                            date = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S.%f')
-                        except:
-                            # Último recurso: tenta parsear como date apenas
-                            try:
-                                date = datetime.strptime(created_at, '%Y-%m-%d')
-                            except:
-                                # Se tudo falhar, usa data atual
-                                date = datetime.now()
-            elif isinstance(created_at, datetime):
-                date = created_at
-            else:
-                # Se for outro tipo, usa data atual
-                date = datetime.now()
-            
-            # Formata data e horário
-            datetime_str = FormatterTool.format_datetime(date)
-            amount_str = FormatterTool.format_currency(t['amount'])
-            category = t.get('category_name', 'Sem categoria')
-            description = t.get('expense_description', 'Sem descrição')
+            # Consultas do SQLTool já trazem a data formatada pelo SQLite
+            datetime_str = t.get('created_at_display')
+            if datetime_str is None:
+                created_at = t.get('created_at')
+                if created_at is None:
+                    continue
+                datetime_str = FormatterTool.format_datetime(_to_datetime(created_at))
             
-            lines.append(
-                f"• {datetime_str} - {amount_str}\n"
-                f"  {description} ({category})"
+            yield "\n"
+            yield _TRANSACTION_LINE_TEMPLATE.format(
+                datetime=datetime_str,
+                amount=FormatterTool.format_currency(t['amount']),
+                description=t.get('expense_description', 'Sem descrição'),
+                category=t.get('category_name', 'Sem categoria'),
             )
-        
-        return "\n".join(lines)
     
     @staticmethod
     def format_category_summary(spending_data: List[Dict[str, Any]]) -> str:
@@ -146,10 +162,16 @@ class FormatterTool:
         Returns:
             String formatada
         """
+        return "".join(FormatterTool.format_category_summary_iter(spending_data))
+    
+    @staticmethod
+    def format_category_summary_iter(spending_data: List[Dict[str, Any]]) -> Iterator[str]:
+        """Mesmo texto de format_category_summary(), em pedaços (ver format_transaction_list_iter)."""
         if not spending_data:
-            return "Nenhum gasto registrado ainda."
+            yield "Nenhum gasto registrado ainda."
+            return
         
-        lines = ["💰 *Gastos por Categoria:*\n"]
+        yield "💰 *Gastos por Categoria:*\n"
         total_geral = sum(item.get('total_amount', 0) or 0 for item in spending_data)
         
         for item in spending_data:
@@ -163,15 +185,23 @@ class FormatterTool:
             
             percentual = (total / total_geral * 100) if total_geral > 0 else 0
             
-            lines.append(
-                f"• *{cat_name}*: {FormatterTool.format_currency(total)}\n"
+            yield (
+                f"\n• *{cat_name}*: {FormatterTool.format_currency(total)}\n"
                 f"  {count} transações • Média: {FormatterTool.format_currency(avg)} "
                 f"({FormatterTool.format_percentage(percentual)})"
             )
         
-        lines.append(f"\n*Total Geral:* {FormatterTool.format_currency(total_geral)}")
+        yield f"\n\n*Total Geral:* {FormatterTool.format_currency(total_geral)}"
+    
+    @staticmethod
+    def limit_status(percentage: float) -> Tuple[str, str]:
+        """
+        Retorna (emoji, status) de um limite pelo percentual já usado.
         
-        return "\n".join(lines)
+        Exemplo:
+            limit_status(85.0) → ("🟡", "ATENÇÃO")
+        """
+        return _LIMIT_STATUS[2 if percentage >= 100 else 1 if percentage >= 80 else 0]
     
     @staticmethod
     def format_limit_alert(
@@ -187,16 +217,7 @@ class FormatterTool:
             Mensagem formatada
         """
         percentage = (current_total / limit_value * 100) if limit_value > 0 else 0
-        
-        if percentage >= 100:
-            emoji = "🔴"
-            status = "EXCEDIDO"
-        elif percentage >= 80:
-            emoji = "🟡"
-            status = "ATENÇÃO"
-        else:
-            emoji = "🟢"
-            status = "OK"
+        emoji, status = FormatterTool.limit_status(percentage)
         
         return (
             f"{emoji} *Alerta de Limite* {emoji}\n\n"
@@ -265,6 +286,36 @@ class FormatterTool:
             f"Está correto? (Sim/Não)"
         )
     
+    @staticmethod
+    def is_well_formatted(text: str) -> bool:
+        """
+        Verifica se uma resposta já está pronta para o usuário.
+        
+        Considera pronta a resposta com mais de 20 caracteres que tem pelo
+        menos um emoji do bot e alguma marcação Markdown (*, _ ou `).
+        Usado para dispensar a revisão por LLM do OutputAgent.
+        """
+        return (
+            len(text) > 20
+            and _RESPONSE_EMOJI_RE.search(text) is not None
+            and _MARKDOWN_RE.search(text) is not None
+        )
+    
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """
+        Normaliza um texto para comparações e chaves de cache.
+        
+        Converte para minúsculas, remove acentos, colapsa espaços e
+        descarta pontuação final.
+        
+        Exemplo:
+            normalize_text("  Olá,   Jarvis! ") → "ola, jarvis"
+        """
+        text = unicodedata.normalize("NFKD", text.lower())
+        text = "".join(c for c in text if not unicodedata.combining(c))
+        return " ".join(text.split()).strip(" .!?")
+    
     @staticmethod
     def format_success_message(message: str) -> str:
         """Formata mensagem de sucesso."""
@@ -1,8 +1,9 @@
 """SQLTool - Interface para operações no banco de dados."""
 
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from database import get_connection
+from .cache_tool import TTLCache
 
 
 class SQLTool:
@@ -13,6 +14,76 @@ class SQLTool:
     operações de banco de dados como ferramentas utilizáveis pelos agentes.
     """
     
+    # Histórico de conversas (mais recente primeiro). O corte de bot_response é
+    # feito no próprio SQLite quando max_response_chars é informado, para que
+    # respostas longas (resumos, listas) nem cheguem ao Python.
+    # Parâmetros: (max_chars, max_chars, max_chars, user_phone, limit)
+    _HISTORY_QUERY = """SELECT user_message,
+                  CASE WHEN ? IS NOT NULL AND LENGTH(bot_response) > ?
+                       THEN SUBSTR(bot_response, 1, ?) || '...'
+                       ELSE bot_response
+                  END AS bot_response,
+                  created_at
+           FROM conversation_history
+           WHERE user_phone = ?
+           ORDER BY created_at DESC
+           LIMIT ?"""
+    
+    # Comandos do caminho de escrita de gastos, definidos uma vez só. O sqlite3
+    # mantém um cache de comandos preparados por conexão, indexado pelo texto
+    # do SQL; com as conexões reaproveitadas (database.get_connection), o
+    # mesmo texto é compilado uma vez por conexão em vez de a cada gasto.
+    # Parâmetros: (user_phone, category_id, amount, description, created_at)
+    _INSERT_TRANSACTION_QUERY = """INSERT INTO transactions 
+                   (user_phone, category_id, amount, expense_description, created_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   RETURNING transaction_id"""
+    
+    # Parâmetros: (current_total, last_updated, rule_id)
+    _UPDATE_RULE_TOTAL_QUERY = """UPDATE user_rules 
+                   SET current_total = ?, last_updated = ?
+                   WHERE rule_id = ?"""
+    
+    # Regras ativas de uma categoria já com o total gasto no período de cada
+    # uma (subquery correlacionada)
+    # Parâmetros: (week_start, month_start, now, user_phone, category_id)
+    _RULE_TOTALS_QUERY = """SELECT 
+                    r.rule_id,
+                    c.category_name,
+                    r.period_type,
+                    r.limit_value,
+                    (SELECT COALESCE(SUM(t.amount), 0)
+                     FROM transactions t
+                     WHERE t.user_phone = r.user_phone
+                       AND t.category_id = r.category_id
+                       AND t.created_at >= CASE WHEN r.period_type = 'semanal' THEN ? ELSE ? END
+                       AND t.created_at <= ?) AS current_total
+                   FROM user_rules r
+                   JOIN categories c ON r.category_id = c.category_id
+                   WHERE r.user_phone = ? AND r.category_id = ? AND r.active = 1
+                """
+    
+    # Regras ativas do usuário (com nome da categoria)
+    _ACTIVE_RULES_QUERY = """SELECT 
+                    r.rule_id,
+                    r.category_id,
+                    c.category_name,
+                    r.period_type,
+                    r.limit_value,
+                    r.current_total,
+                    r.last_updated
+                   FROM user_rules r
+                   JOIN categories c ON r.category_id = c.category_id  -- JOIN para obter nome da categoria
+                   WHERE r.user_phone = ? AND r.active = 1  -- Filtro pelo relacionamento user_rules → users
+                """
+    
+    # Cache das regras ativas por usuário (user_phone → lista de regras).
+    # Regras mudam raramente, mas são consultadas a cada gasto registrado:
+    # com o cache, um gasto em categoria sem limite é só o INSERT.
+    # Invalidado por create_limit_rule, delete_limit_rule, delete_category e
+    # update_rule_total; insert_transaction_and_check_limit grava os totais novos.
+    _rules_cache = TTLCache(maxsize=1024, ttl=30)
+    
     @staticmethod
     def insert_transaction(
         user_phone: str,
@@ -39,14 +110,108 @@ class SQLTool:
             ID da transação criada (transaction_id gerado pelo AUTOINCREMENT)
         """
         with get_connection() as conn:
-            cursor = conn.execute(
-                """INSERT INTO transactions 
-                   (user_phone, category_id, amount, expense_description, created_at)
-                   VALUES (?, ?, ?, ?, ?)""",
+            transaction_id = conn.execute(
+                SQLTool._INSERT_TRANSACTION_QUERY,
                 (user_phone, category_id, amount, description, datetime.now())
-            )
+            ).fetchone()[0]
             conn.commit()
-            return cursor.lastrowid
+            return transaction_id
+    
+    @staticmethod
+    def insert_transaction_and_check_limit(
+        user_phone: str,
+        category_id: int,
+        amount: float,
+        description: str
+    ) -> Dict[str, Any]:
+        """
+        Insere uma transação e recalcula os limites da categoria de uma vez.
+        
+        Faz em uma única conexão/transação o que antes exigia várias idas ao
+        banco (insert_transaction + get_active_rules + get_total_by_category +
+        update_rule_total):
+        1. INSERT ... RETURNING transaction_id
+        2. Regras ativas do usuário (do cache _rules_cache; só consulta o
+           banco quando não estão em cache) - sem regra para a categoria,
+           termina aqui
+        3. Um SELECT que traz as regras ativas da categoria já com o total
+           gasto no período de cada uma (subquery correlacionada)
+        4. UPDATE de current_total das regras encontradas
+        
+        Períodos (iguais aos usados antes em FinanceAgent._check_limits):
+        - "semanal": últimos 7 dias
+        - "mensal" e demais: desde o primeiro dia do mês atual
+        
+        Args:
+            user_phone: ID do usuário que fez o gasto
+            category_id: ID da categoria do gasto
+            amount: Valor do gasto
+            description: Descrição opcional do gasto
+        
+        Returns:
+            Dicionário com:
+            - transaction_id: ID da transação criada
+            - rules: Lista de regras ativas da categoria, cada uma com rule_id,
+              category_name, period_type, limit_value e current_total (já
+              incluindo o novo gasto). Lista vazia se não houver limite.
+        """
+        now = datetime.now()
+        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        week_start = now - timedelta(days=7)
+        
+        with get_connection() as conn:
+            transaction_id = conn.execute(
+                SQLTool._INSERT_TRANSACTION_QUERY,
+                (user_phone, category_id, amount, description, now)
+            ).fetchone()[0]
+            
+            user_rules = SQLTool._rules_cache.get(user_phone)
+            if user_rules is None:
+                user_rules = [dict(row) for row in conn.execute(SQLTool._ACTIVE_RULES_QUERY, (user_phone,)).fetchall()]
+                SQLTool._rules_cache.set(user_phone, user_rules)
+            
+            if not any(rule["category_id"] == category_id for rule in user_rules):
+                # Categoria sem limite: nada a recalcular
+                conn.commit()
+                return {"transaction_id": transaction_id, "rules": []}
+            
+            rows = conn.execute(
+                SQLTool._RULE_TOTALS_QUERY,
+                (week_start, month_start, now, user_phone, category_id)
+            ).fetchall()
+            rules = [dict(row) for row in rows]
+            
+            if rules:
+                conn.executemany(
+                    SQLTool._UPDATE_RULE_TOTAL_QUERY,
+                    [(rule["current_total"], now, rule["rule_id"]) for rule in rules]
+                )
+            conn.commit()
+        
+        if rules:
+            SQLTool._store_rule_totals(user_phone, rules, now)
+        
+        return {"transaction_id": transaction_id, "rules": rules}
+    
+    @staticmethod
+    def _store_rule_totals(user_phone: str, rules: List[Dict[str, Any]], now: datetime) -> None:
+        """
+        Reflete no cache de regras os totais recém-gravados de um usuário.
+        
+        Grava uma lista nova (quem já leu a antiga não vê mudança), com
+        last_updated no mesmo formato que o SQLite devolve. Sem entrada em
+        cache não há o que atualizar - a próxima leitura vem do banco.
+        """
+        user_rules = SQLTool._rules_cache.get(user_phone)
+        if user_rules is None:
+            return
+        
+        new_totals = {rule["rule_id"]: rule["current_total"] for rule in rules}
+        SQLTool._rules_cache.set(user_phone, [
+            {**rule, "current_total": new_totals[rule["rule_id"]], "last_updated": now.isoformat(" ")}
+            if rule["rule_id"] in new_totals else rule
+            for rule in user_rules
+        ])
     
     @staticmethod
     def get_user_categories(user_phone: str) -> List[Dict[str, Any]]:
@@ -82,7 +247,11 @@ class SQLTool:
     @staticmethod
     def get_category_by_name(user_phone: str, category_name: str) -> Optional[Dict[str, Any]]:
         """
-        Busca uma categoria pelo nome.
+        Busca uma categoria pelo nome, sem diferenciar maiúsculas nem acentos.
+        
+        "alimentacao" encontra "Alimentação" já nesta consulta, sem precisar
+        listar as categorias e compará-las uma a uma. Se houver mais de uma
+        candidata, prefere a que só difere em maiúsculas.
         
         Returns:
             Dicionário com dados da categoria ou None se não encontrada
@@ -91,8 +260,10 @@ class SQLTool:
             row = conn.execute(
                 """SELECT category_id, category_name, description
                    FROM categories
-                   WHERE user_phone = ? AND LOWER(category_name) = LOWER(?)""",
-                (user_phone, category_name)
+                   WHERE user_phone = ? AND LOWER(unaccent(category_name)) = LOWER(unaccent(?))
+                   ORDER BY LOWER(category_name) = LOWER(?) DESC
+                   LIMIT 1""",
+                (user_phone, category_name, category_name)
             ).fetchone()
             return dict(row) if row else None
     
@@ -113,13 +284,14 @@ class SQLTool:
         A query agrega (SUM) todas as transações que:
         - Pertencem ao usuário (user_phone)
         - Estão na categoria especificada (category_id)
-        - Estão no período opcional (created_at BETWEEN start_date AND end_date)
+        - Estão no período opcional [start_date, end_date) - intervalo
+          semiaberto sobre a coluna crua, para usar o índice de created_at
         
         Args:
             user_phone: ID do usuário (relacionamento com users)
             category_id: ID da categoria (relacionamento com categories)
-            start_date: Data inicial para filtrar por período (opcional)
-            end_date: Data final para filtrar por período (opcional)
+            start_date: Data inicial para filtrar por período (opcional, inclusiva)
+            end_date: Data final para filtrar por período (opcional, exclusiva)
             
         Returns:
             Total gasto (float) na categoria. Retorna 0.0 se não houver transações.
@@ -136,7 +308,7 @@ class SQLTool:
             params.append(start_date)
         
         if end_date:
-            query += " AND created_at <= ?"
+            query += " AND created_at < ?"
             params.append(end_date)
         
         with get_connection() as conn:
@@ -152,6 +324,9 @@ class SQLTool:
         """
         Calcula o total gasto em um período.
         
+        O período é o intervalo semiaberto [start_date, end_date): para incluir
+        um dia inteiro, passe a meia-noite do dia seguinte como end_date.
+        
         Returns:
             Total gasto no período
         """
@@ -159,7 +334,7 @@ class SQLTool:
             result = conn.execute(
                 """SELECT COALESCE(SUM(amount), 0) as total
                    FROM transactions
-                   WHERE user_phone = ? AND created_at BETWEEN ? AND ?""",
+                   WHERE user_phone = ? AND created_at >= ? AND created_at < ?""",
                 (user_phone, start_date, end_date)
             ).fetchone()
             return result[0] if result else 0.0
@@ -187,8 +362,8 @@ class SQLTool:
         Args:
             user_phone: ID do usuário para filtrar transações
             category_id: ID da categoria para filtrar (opcional)
-            start_date: Data inicial para filtrar por período (opcional)
-            end_date: Data final para filtrar por período (opcional)
+            start_date: Data inicial para filtrar por período (opcional, inclusiva)
+            end_date: Data final para filtrar por período (opcional, exclusiva)
             limit: Número máximo de transações a retornar (padrão: 50)
         
         Returns:
@@ -197,14 +372,31 @@ class SQLTool:
             - amount: Valor gasto
             - expense_description: Descrição do gasto
             - created_at: Data/hora da transação
+            - created_at_display: Data/hora já formatada pelo SQLite
+              ("DD/MM/YYYY às HH:MM", mesmo formato de FormatterTool.format_datetime)
             - category_name: Nome da categoria (via JOIN com categories)
         """
+        query, params = SQLTool._transactions_query(user_phone, category_id, start_date, end_date, limit)
+        with get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+            return [dict(row) for row in rows]
+    
+    @staticmethod
+    def _transactions_query(
+        user_phone: str,
+        category_id: Optional[int],
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        limit: int
+    ) -> Tuple[str, List[Any]]:
+        """Monta o SELECT (e os parâmetros) de get_transactions()."""
         query = """
             SELECT 
                 t.transaction_id,
                 t.amount,
                 t.expense_description,
                 t.created_at,
+                strftime('%d/%m/%Y às %H:%M', t.created_at) AS created_at_display,  -- já no formato exibido
                 c.category_name
             FROM transactions t
             LEFT JOIN categories c ON t.category_id = c.category_id  -- JOIN para obter nome da categoria
@@ -221,15 +413,86 @@ class SQLTool:
             params.append(start_date)
         
         if end_date:
-            query += " AND t.created_at <= ?"
+            query += " AND t.created_at < ?"  # end_date exclusiva
             params.append(end_date)
         
+        query += " ORDER BY t.created_at DESC LIMIT ?"
+        params.append(limit)
+        return query, params
+    
+    @staticmethod
+    def find_transactions(
+        user_phone: str,
+        description: Optional[str] = None,
+        date: Optional[datetime] = None,
+        amount: Optional[float] = None,
+        limit: int = 5
+    ) -> Dict[str, Any]:
+        """
+        Busca transações por critérios, com a filtragem feita no SQL.
+        
+        Usado para localizar a transação que o usuário quer remover. Cada
+        critério informado vira uma condição do WHERE (todas combinadas com AND):
+        - description: trecho contido em expense_description (sem diferenciar
+          maiúsculas/minúsculas ASCII, como LIKE do SQLite)
+        - date: dia da transação (intervalo [dia, dia seguinte) em created_at)
+        - amount: valor com tolerância de 0.01
+        
+        Args:
+            user_phone: ID do usuário
+            description: Trecho da descrição (opcional)
+            date: Dia da transação - só a parte de data é usada (opcional)
+            amount: Valor da transação (opcional)
+            limit: Número máximo de transações retornadas (padrão: 5)
+        
+        Returns:
+            Dicionário com:
+                - transactions: Até `limit` transações (mais recentes primeiro),
+                  mesmas colunas de get_transactions()
+                - total_matches: Quantas transações atendem aos critérios no total
+        """
+        query = """
+            SELECT 
+                t.transaction_id,
+                t.amount,
+                t.expense_description,
+                t.created_at,
+                strftime('%d/%m/%Y às %H:%M', t.created_at) AS created_at_display,
+                c.category_name,
+                COUNT(*) OVER () AS total_matches  -- total antes do LIMIT
+            FROM transactions t
+            LEFT JOIN categories c ON t.category_id = c.category_id
+            WHERE t.user_phone = ?
+        """
+        params: List[Any] = [user_phone]
+        
+        if description:
+            # Escapa curingas do LIKE para buscar o texto literal
+            escaped = description.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query += " AND t.expense_description LIKE '%' || ? || '%' ESCAPE '\\'"
+            params.append(escaped)
+        
+        if date:
+            day_start = datetime(date.year, date.month, date.day)
+            query += " AND t.created_at >= ? AND t.created_at < ?"
+            params.extend([day_start, day_start + timedelta(days=1)])
+        
+        if amount is not None:
+            # Tolerância para float como intervalo fechado (em vez de ABS(t.amount - ?)):
+            # compara a coluna diretamente, sem calcular nada por linha
+            query += " AND t.amount BETWEEN ? AND ?"
+            params.extend([amount - 0.01, amount + 0.01])
+        
         query += " ORDER BY t.created_at DESC LIMIT ?"
         params.append(limit)
         
         with get_connection() as conn:
-            rows = conn.execute(query, params).fetchall()
-            return [dict(row) for row in rows]
+            rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+        
+        total_matches = rows[0].pop("total_matches") if rows else 0
+        for row in rows[1:]:
+            row.pop("total_matches")
+        return {"transactions": rows, "total_matches": total_matches}
     
     @staticmethod
     def get_spending_by_category(
@@ -257,8 +520,8 @@ class SQLTool:
         
         Args:
             user_phone: ID do usuário para filtrar categorias e transações
-            start_date: Data inicial para filtrar transações por período (opcional)
-            end_date: Data final para filtrar transações por período (opcional)
+            start_date: Data inicial para filtrar transações por período (opcional, inclusiva)
+            end_date: Data final para filtrar transações por período (opcional, exclusiva)
         
         Returns:
             Lista de dicionários com resumo por categoria, cada um contendo:
@@ -268,6 +531,18 @@ class SQLTool:
             - total_amount: Total gasto na categoria (None se não houver transações)
             - avg_amount: Média de gastos por transação na categoria
         """
+        query, params = SQLTool._spending_by_category_query(user_phone, start_date, end_date)
+        with get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+            return [dict(row) for row in rows]
+    
+    @staticmethod
+    def _spending_by_category_query(
+        user_phone: str,
+        start_date: Optional[datetime],
+        end_date: Optional[datetime]
+    ) -> Tuple[str, List[Any]]:
+        """Monta o SELECT (e os parâmetros) de get_spending_by_category()."""
         query = """
             SELECT 
                 c.category_name,
@@ -277,6 +552,7 @@ class SQLTool:
                 AVG(t.amount) as avg_amount
             FROM categories c
             LEFT JOIN transactions t ON c.category_id = t.category_id  -- JOIN para agrupar transações por categoria
+                AND t.user_phone = c.user_phone  -- redundante (a categoria é do usuário), mas usa idx_tx_user_cat_date
             WHERE c.user_phone = ?  -- Filtro pelo relacionamento categories → users
         """
         params = [user_phone]
@@ -286,14 +562,64 @@ class SQLTool:
             params.append(start_date)
         
         if end_date:
-            query += " AND (t.created_at IS NULL OR t.created_at <= ?)"
+            query += " AND (t.created_at IS NULL OR t.created_at < ?)"
             params.append(end_date)
         
         query += " GROUP BY c.category_id, c.category_name ORDER BY total_amount DESC"
+        return query, params
+    
+    @staticmethod
+    def get_period_snapshot(
+        user_phone: str,
+        start_date: Optional[datetime],
+        end_date: datetime,
+        transactions_limit: int = 0
+    ) -> Dict[str, Any]:
+        """
+        Busca o total, o resumo por categoria e (opcionalmente) as transações
+        de um período de uma vez.
+        
+        Equivale a get_total_by_period() + get_spending_by_category() +
+        get_transactions(), mas as consultas rodam na mesma conexão e dentro
+        de uma única transação de leitura - os três resultados vêm do mesmo
+        estado do banco, mesmo com um gasto sendo gravado em paralelo.
+        Usado pelo FinanceAgent em query_total e query_by_date_range.
+        
+        Args:
+            user_phone: ID do usuário
+            start_date: Início do período (inclusivo) ou None para "desde sempre"
+            end_date: Fim do período (exclusivo)
+            transactions_limit: Máximo de transações listadas (0 = não lista)
+        
+        Returns:
+            Dicionário com:
+                - total: Total gasto no período
+                - by_category: Mesmo formato de get_spending_by_category()
+                - transactions: Mesmo formato de get_transactions() (vazia se
+                  transactions_limit for 0)
+        """
+        spending_query, spending_params = SQLTool._spending_by_category_query(user_phone, start_date, end_date)
         
         with get_connection() as conn:
-            rows = conn.execute(query, params).fetchall()
-            return [dict(row) for row in rows]
+            conn.execute("BEGIN")
+            total_row = conn.execute(
+                """SELECT COALESCE(SUM(amount), 0) as total
+                   FROM transactions
+                   WHERE user_phone = ? AND created_at >= COALESCE(?, '') AND created_at < ?""",
+                (user_phone, start_date, end_date)
+            ).fetchone()
+            by_category = [dict(row) for row in conn.execute(spending_query, spending_params).fetchall()]
+            
+            transactions = []
+            if transactions_limit > 0:
+                query, params = SQLTool._transactions_query(user_phone, None, start_date, end_date, transactions_limit)
+                transactions = [dict(row) for row in conn.execute(query, params).fetchall()]
+            
+            return {
+                "total": total_row[0] if total_row else 0.0,
+                "by_category": by_category,
+                "transactions": transactions,
+            }
     
     @staticmethod
     def create_category(
@@ -332,23 +658,30 @@ class SQLTool:
         Retorna usuário existente ou cria um novo.
         
         Returns:
-            Dados do usuário
+            Dados do usuário, mais has_history (1 se o usuário já tem conversas
+            salvas, 0 caso contrário - checado no mesmo SELECT pelo índice
+            idx_conversation_user_date)
         """
         with get_connection() as conn:
             # Tenta buscar
             row = conn.execute(
-                "SELECT * FROM users WHERE user_phone = ?",
+                """SELECT u.*,
+                          EXISTS(SELECT 1 FROM conversation_history c
+                                 WHERE c.user_phone = u.user_phone) AS has_history
+                   FROM users u
+                   WHERE u.user_phone = ?""",
                 (user_phone,)
             ).fetchone()
             
             if row:
                 return dict(row)
             
-            # Se não existe, cria
+            # Se não existe, cria (criação e última mensagem com o mesmo instante)
+            now = datetime.now()
             conn.execute(
                 """INSERT INTO users (user_phone, user_name, created_at, last_message_at)
                    VALUES (?, ?, ?, ?)""",
-                (user_phone, user_name, datetime.now(), datetime.now())
+                (user_phone, user_name, now, now)
             )
             conn.commit()
             
@@ -356,7 +689,30 @@ class SQLTool:
                 "SELECT * FROM users WHERE user_phone = ?",
                 (user_phone,)
             ).fetchone()
-            return dict(row)
+            # Usuário recém-criado ainda não tem conversas
+            return {**dict(row), "has_history": 0}
+    
+    @staticmethod
+    def create_user(user_phone: str, setup_step: Optional[str] = None) -> bool:
+        """
+        Cria o usuário, se ainda não existir (um único INSERT).
+        
+        Args:
+            user_phone: ID do usuário
+            setup_step: Etapa inicial do setup (ex: "start")
+        
+        Returns:
+            True se o usuário foi criado, False se já existia
+        """
+        now = datetime.now()
+        with get_connection() as conn:
+            cursor = conn.execute(
+                """INSERT INTO users (user_phone, created_at, last_message_at, setup_step)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT(user_phone) DO NOTHING""",
+                (user_phone, now, now, setup_step)
+            )
+            return cursor.rowcount == 1
     
     @staticmethod
     def update_last_message(user_phone: str) -> None:
@@ -401,7 +757,8 @@ class SQLTool:
                 (user_phone, category_id, period_type, limit_value, datetime.now())
             )
             conn.commit()
-            return cursor.lastrowid
+        SQLTool._rules_cache.pop(user_phone)
+        return cursor.lastrowid
     
     @staticmethod
     def get_active_rules(user_phone: str) -> List[Dict[str, Any]]:
@@ -429,36 +786,52 @@ class SQLTool:
             - limit_value: Valor máximo permitido
             - current_total: Total atual gasto no período
             - last_updated: Data/hora da última atualização
+            
+            A lista vem de _rules_cache quando possível (não a modifique).
+        """
+        rules = SQLTool._rules_cache.get(user_phone)
+        if rules is not None:
+            return rules
+        
+        with get_connection() as conn:
+            rows = conn.execute(SQLTool._ACTIVE_RULES_QUERY, (user_phone,)).fetchall()
+        rules = [dict(row) for row in rows]
+        SQLTool._rules_cache.set(user_phone, rules)
+        return rules
+    
+    @staticmethod
+    def get_active_rules_for_category(user_phone: str, category_id: int) -> List[Dict[str, Any]]:
         """
+        Retorna as regras ativas do usuário para uma única categoria.
+        
+        Se as regras do usuário estão em _rules_cache, filtra a lista em
+        memória; senão consulta só as regras da categoria (filtro no SQL,
+        pelo índice idx_rules_user_category) em vez de trazer todas.
+        
+        Returns:
+            Lista no mesmo formato de get_active_rules() (vazia se a
+            categoria não tem limite)
+        """
+        rules = SQLTool._rules_cache.get(user_phone)
+        if rules is not None:
+            return [rule for rule in rules if rule["category_id"] == category_id]
+        
         with get_connection() as conn:
             rows = conn.execute(
-                """SELECT 
-                    r.rule_id,
-                    r.category_id,
-                    c.category_name,
-                    r.period_type,
-                    r.limit_value,
-                    r.current_total,
-                    r.last_updated
-                   FROM user_rules r
-                   JOIN categories c ON r.category_id = c.category_id  -- JOIN para obter nome da categoria
-                   WHERE r.user_phone = ? AND r.active = 1  -- Filtro pelo relacionamento user_rules → users
-                """,
-                (user_phone,)
+                SQLTool._ACTIVE_RULES_QUERY + " AND r.category_id = ?",
+                (user_phone, category_id)
             ).fetchall()
-            return [dict(row) for row in rows]
+        return [dict(row) for row in rows]
     
     @staticmethod
     def update_rule_total(rule_id: int, new_total: float) -> None:
         """Atualiza o total acumulado de uma regra."""
         with get_connection() as conn:
-            conn.execute(
-                """UPDATE user_rules 
-                   SET current_total = ?, last_updated = ?
-                   WHERE rule_id = ?""",
-                (new_total, datetime.now(), rule_id)
-            )
+            conn.execute(SQLTool._UPDATE_RULE_TOTAL_QUERY, (new_total, datetime.now(), rule_id))
             conn.commit()
+        # Só temos o rule_id (não o usuário): descarta o cache inteiro. Chamado
+        # apenas por scripts (populate_test_cases), fora do fluxo de mensagens.
+        SQLTool._rules_cache.clear()
 
     @staticmethod
     def delete_category(user_phone: str, category_id: int) -> bool:
@@ -499,7 +872,8 @@ class SQLTool:
                 (category_id, user_phone)
             )
             conn.commit()
-            return True
+        SQLTool._rules_cache.pop(user_phone)
+        return True
     
     @staticmethod
     def delete_limit_rule(user_phone: str, category_id: int) -> bool:
@@ -532,7 +906,8 @@ class SQLTool:
                 (category_id, user_phone)
             )
             conn.commit()
-            return True
+        SQLTool._rules_cache.pop(user_phone)
+        return True
     
     @staticmethod
     def save_conversation(user_phone: str, user_message: str, bot_response: str) -> int:
@@ -578,13 +953,19 @@ class SQLTool:
             return cursor.rowcount > 0
     
     @staticmethod
-    def get_conversation_history(user_phone: str, limit: int = 10) -> List[Dict[str, Any]]:
+    def get_conversation_history(
+        user_phone: str,
+        limit: int = 10,
+        max_response_chars: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
         """
         Retorna o histórico de conversas do usuário.
         
         Args:
             user_phone: ID do usuário
             limit: Número máximo de mensagens a retornar (padrão: 10)
+            max_response_chars: Se informado, bot_response maiores que isso já vêm
+                                cortadas do banco com "..." no final
             
         Returns:
             Lista de dicionários com histórico de conversas, ordenado por data (mais antiga primeiro)
@@ -592,16 +973,100 @@ class SQLTool:
         """
         with get_connection() as conn:
             rows = conn.execute(
-                """SELECT user_message, bot_response, created_at
-                   FROM conversation_history
-                   WHERE user_phone = ?
-                   ORDER BY created_at DESC
-                   LIMIT ?""",
-                (user_phone, limit)
+                SQLTool._HISTORY_QUERY,
+                (max_response_chars, max_response_chars, max_response_chars, user_phone, limit)
             ).fetchall()
             # Inverte para ter ordem cronológica (mais antiga primeiro)
             return [dict(row) for row in reversed(rows)]
     
+    @staticmethod
+    def get_total_and_history(
+        user_phone: str,
+        start_date: datetime,
+        end_date: datetime,
+        history_limit: int = 5,
+        max_response_chars: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Busca o total gasto no período e o histórico de conversas de uma vez.
+        
+        Equivale a get_total_by_period() + get_conversation_history(), mas as
+        duas consultas rodam na mesma conexão (um único round-trip de abertura).
+        Usado pelo FinanceAgent para montar o contexto do prompt.
+        
+        Args:
+            max_response_chars: Mesmo corte de bot_response de get_conversation_history()
+        
+        Returns:
+            Dicionário com:
+                - total: Total gasto no período
+                - history: Histórico de conversas (mais antiga primeiro)
+        """
+        with get_connection() as conn:
+            total_row = conn.execute(
+                """SELECT COALESCE(SUM(amount), 0) as total
+                   FROM transactions
+                   WHERE user_phone = ? AND created_at >= ? AND created_at < ?""",
+                (user_phone, start_date, end_date)
+            ).fetchone()
+            rows = conn.execute(
+                SQLTool._HISTORY_QUERY,
+                (max_response_chars, max_response_chars, max_response_chars, user_phone, history_limit)
+            ).fetchall()
+            return {
+                "total": total_row[0] if total_row else 0.0,
+                # Inverte para ter ordem cronológica (mais antiga primeiro)
+                "history": [dict(row) for row in reversed(rows)]
+            }
+    
+    @staticmethod
+    def get_llm_reply(cache_key: str, max_age: timedelta) -> Optional[str]:
+        """
+        Busca uma resposta do LLM guardada na tabela llm_cache.
+        
+        Args:
+            cache_key: Chave da resposta (ver save_llm_reply)
+            max_age: Idade máxima da entrada - mais antigas contam como ausentes
+            
+        Returns:
+            Texto guardado (JSON), ou None se não houver entrada válida
+        """
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT response FROM llm_cache WHERE cache_key = ? AND created_at >= ?",
+                (cache_key, datetime.now() - max_age)
+            ).fetchone()
+            return row[0] if row else None
+    
+    @staticmethod
+    def save_llm_reply(cache_key: str, response: str, max_age: timedelta) -> None:
+        """
+        Guarda (ou substitui) uma resposta do LLM na tabela llm_cache.
+        
+        Na mesma transação, apaga as entradas mais antigas que max_age - sem
+        isso a tabela cresceria uma linha por mensagem distinta, para sempre.
+        
+        Args:
+            cache_key: Chave da resposta (ex: sha256 do modelo, etapa e mensagem)
+            response: Texto a guardar (JSON da resposta já interpretada)
+            max_age: Idade máxima das entradas (mesma usada em get_llm_reply)
+        """
+        now = datetime.now()
+        with get_connection() as conn:
+            conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?",
+                (now - max_age,)
+            )
+            conn.execute(
+                """INSERT INTO llm_cache (cache_key, response, created_at)
+                   VALUES (?, ?, ?)
+                   ON CONFLICT(cache_key) DO UPDATE SET
+                       response = excluded.response,
+                       created_at = excluded.created_at""",
+                (cache_key, response, now)
+            )
+            conn.commit()
+    
     @staticmethod
     def clear_conversation_history(user_phone: str) -> int:
         """